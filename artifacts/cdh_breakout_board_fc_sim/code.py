@@ -1,8 +1,56 @@
 """
 Entry point for a testing artifact that simulates the CDH microcontroller on
 a custom breakout board.
+
+Polls the subsystems simulated by the cdh_breakout_board_subsystem_sim artifact over RS485 as
+fast as the bus allows, and periodically prints the rate of telemetry round trips along with
+the statistics of each node, as an end-to-end benchmark of the inter-subsystem bus.
 """
 
+import asyncio
+import board
+
+from bus_master import BusMaster, Node, PollEntry
+from inter_subsystem_rs485 import Address, MessageId, Rs485Link
+
+REPORT_PERIOD_S = 5
+
+
+async def report_task(master: BusMaster):
+    """Prints the round trip rate and the statistics of each node every `REPORT_PERIOD_S`"""
+    while True:
+        await asyncio.sleep(REPORT_PERIOD_S)
+        print(
+            f"{master.round_trips_per_s():.1f} round trips/s, "
+            f"{master.unexpected_frames} unexpected frames"
+        )
+        for node in master.nodes:
+            stats = node.stats
+            print(
+                f"  {node.name}: {stats.replies}/{stats.requests} replies, {stats.nacks} NACKs, "
+                f"{stats.timeouts} timeouts, {stats.retries} retries, {stats.failures} failures, "
+                f"latency mean {stats.latency_us.mean():.0f} us, max {stats.latency_us.max()} us"
+            )
+
+
+async def benchmark():
+    """Polls every telemetry message from EPS and pings ADCS back to back"""
+    eps = Node("eps", Address.EPS)
+    adcs = Node("adcs", Address.ADCS)
+    schedule = [
+        PollEntry(eps, MessageId.EPS_BATTERY_TELEMETRY, 0),
+        PollEntry(eps, MessageId.EPS_BUS_TELEMETRY, 0),
+        PollEntry(eps, MessageId.EPS_SOLAR_TELEMETRY, 0),
+        PollEntry(eps, MessageId.EPS_HEALTH_TELEMETRY, 0),
+        PollEntry(adcs, MessageId.PING, 0),
+    ]
+    link = Rs485Link(board.RS485_TX, board.RS485_RX, board.RS485_DE)
+    master = BusMaster(link, schedule)
+    try:
+        await asyncio.gather(master.run(), report_task(master))
+    finally:
+        link.close()
+
+
 if __name__ == "__main__":
-    # Put your code here
-    pass
+    asyncio.run(benchmark())
@@ -1,3 +1,11 @@
 """
 Pin definitions for the board which runs the cdh_breakout_board_subsystem_sim artifact.
 """
+
+import microcontroller
+
+# inter-subsystem RS485 bus, on the lines of the inter-subsystem bus connector; TX and RX are
+# PAD0 and PAD1 of SERCOM5, since the SAM D51 UART transmits on PAD0
+RS485_TX = microcontroller.pin.PB16
+RS485_RX = microcontroller.pin.PB17
+RS485_DE = microcontroller.pin.PA20
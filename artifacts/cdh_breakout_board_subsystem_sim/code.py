@@ -1,8 +1,40 @@
 """
 Entry point for a testing artifact that simulates the a subsystem's microcontroller
 which may talk to CDH. This testing artifact runs on a custom breakout board.
+
+Answers requests from CDH on the RS485 bus on behalf of both EPS, using the EPS ICD engine
+with a datastore that is never updated, and ADCS, which only answers pings.
 """
 
+import asyncio
+import board
+
+import icd
+import datastore as ds
+from inter_subsystem_rs485 import Address, MessageId, HEADER_SIZE, REPLY_FLAG, Rs485Link
+
+datastore = ds.Datastore()
+
+
+async def subsystem_task():
+    """Answers requests for EPS and ADCS until interrupted"""
+    link = Rs485Link(board.RS485_TX, board.RS485_RX, board.RS485_DE)
+    eps = icd.IcdEngine(datastore).frame_handler(link)
+    # copied, since the link's transmit buffer is reused for the replies from EPS
+    adcs_ping = bytes(link.encode(bytes([Address.ADCS, MessageId.PING | REPLY_FLAG])))
+
+    def on_frame(payload):
+        if len(payload) >= HEADER_SIZE and payload[0] == Address.ADCS:
+            if payload[1] == MessageId.PING:
+                link.queue_frame(adcs_ping)
+        else:
+            eps(payload)
+
+    try:
+        await link.run(on_frame, icd.ICD_POLL_PERIOD_S)
+    finally:
+        link.close()
+
+
 if __name__ == "__main__":
-    # Put your code here
-    pass
+    asyncio.run(subsystem_task())
@@ -9,6 +9,8 @@ import board
 import bms
 import icd
 import monitoring
+import solar
+import state_of_charge
 
 import datastore as ds
 
@@ -19,13 +21,17 @@ async def gathered_task():
     """
     Runs all top-level tasks in parallel.
 
-    Currently includes battery management, output bus control, data recording to the `datastore`,
-    and intersubsystem communication.
+    Currently includes battery management, state of charge estimation, output bus control, solar
+    array and MPPT supervision, data recording to the `datastore`, health monitoring, and
+    intersubsystem communication.
     """
     await asyncio.gather(
         bms.battery_management_task(datastore),
+        state_of_charge.state_of_charge_task(datastore),
         icd.output_bus_control_task(datastore),
+        solar.solar_array_task(datastore),
         monitoring.data_recording_task(datastore),
+        monitoring.health_task(datastore),
         icd.intersubsystem_communication_task(datastore),
     )
 
@@ -97,14 +97,22 @@ class Ads1118:
     Driver class for the ADS1118 SPI analog-to-digital converter from Texas Instruments.
     """
 
-    def __init__(self, sck, mosi, miso, ss):
+    def __init__(self, sck, mosi, miso, ss, poll_drdy=False):
+        """
+        Creates a driver for an ADS1118 on a SPI bus which may be shared with other devices.
+
+        By default, the conversion result is read out once the conversion time for the selected
+        sampling rate has passed, so the SPI bus keeps running between samples. If `poll_drdy`
+        is True, the MISO pin is also read as a GPIO after each conversion to confirm that data
+        is ready, which detects a stalled conversion but deinitializes and reinitializes the
+        SPI peripheral for every sample.
+        """
         pm = pin_manager.PinManager.get_instance()
-        self.spi_bus = pm.create_spi(sck, mosi, miso)
-        self.drdy_gpio = pm.create_digital_in_out(miso)
-        self.ss_gpio = pm.create_digital_in_out(ss)
-        with self.ss_gpio as ss_gpio:
-            ss_gpio.direction = digitalio.Direction.OUTPUT
-            ss_gpio.value = True
+        self.spi_device = pm.create_spi_bus_device(
+            sck, mosi, miso, ss, baudrate=1000000, polarity=0, phase=1
+        )
+        self.drdy_gpio = pm.create_digital_in_out(miso) if poll_drdy else None
+        self.ss_gpio = self.spi_device.cs
 
     # Returns either the voltage in volts, or the temperature in degrees Celsius
     async def take_sample(
@@ -118,12 +126,14 @@ class Ads1118:
 
         First, a single-shot conversion command is sent to the ADC with the settings specified.
         Then, the coroutine yields for other tasks for a fixed amount of time based on the
-        selected sampling rate to allow the ADC to process the data. Finally, the ADC is polled
-        for data readiness and, once readiness is confirmed, the data is read from the ADC.
+        selected sampling rate to allow the ADC to process the data. Finally, the data is read
+        from the ADC, after polling it for data readiness if the driver was created with
+        `poll_drdy`.
 
-        In the case that an issue with the ADS1118 prevents data from being ready on schedule,
-        the driver will begin the process of resetting the ADC. This process takes 28ms, so in
-        the unlikely case that this process needs to occur, overall performance may be degraded.
+        When polling for data readiness, in the case that an issue with the ADS1118 prevents data
+        from being ready on schedule, the driver will begin the process of resetting the ADC.
+        This process takes 28ms, so in the unlikely case that this process needs to occur,
+        overall performance may be degraded.
 
         The measurement defaults to a full-scale range of 4.096V and a sampling rate of 128
         samples per second if not otherwise specified. The channel selected must be specified
@@ -140,18 +150,15 @@ class Ads1118:
         while not data_ready:
 
             # send data-getting command
-            with self.spi_bus as spi, self.ss_gpio as ss:
-                spi.try_lock()
-                spi.configure(baudrate=1000000, polarity=0, phase=1)
-                ss.direction = digitalio.Direction.OUTPUT
-                ss.value = False
+            with self.spi_device as spi:
                 spi.write_readinto(transmit_buffer, receive_buffer)
-                ss.value = True
-                spi.unlock()
 
             # wait for data to be ready
             await asyncio.sleep(ADS1118_SPS_DELAYS[sample_rate])
 
+            if self.drdy_gpio is None:
+                break
+
             # check if data is ready
             with self.drdy_gpio as drdy, self.ss_gpio as ss:
                 ss.direction = digitalio.Direction.OUTPUT
@@ -163,20 +170,14 @@ class Ads1118:
                 # we've already waited the delay time above so this should be near-instant
                 t0 = time.monotonic_ns()
                 while (not data_ready) and (
-                    (time.monotonic_ns() - t0) < ADS1118_SPI_RESET_TIME
+                    (time.monotonic_ns() - t0) < ADS1118_SPI_RESET_TIME * 1e9
                 ):
                     data_ready = not drdy.value
                 ss.value = True
 
         transmit_buffer[0] = transmit_buffer[0] & 0x7F
-        with self.spi_bus as spi, self.ss_gpio as ss:
-            spi.try_lock()
-            spi.configure(baudrate=1000000, polarity=0, phase=1)
-            ss.direction = digitalio.Direction.OUTPUT
-            ss.value = False
+        with self.spi_device as spi:
             spi.write_readinto(transmit_buffer, receive_buffer)
-            ss.value = True
-            spi.unlock()
 
         return (
             Ads1118._temperature_from_bytes(receive_buffer)
@@ -2,5 +2,163 @@
 Driver module for the ArduCam 5MP Mini SPI breakout board.
 """
 
-# the most up-to-date camera code is in a Jupyter notebook and has never been
-# in the GitHub. It should be added here as a class with appropriate control methods.
+import asyncio
+import time
+
+import pin_manager
+
+SPI_BAUDRATE = 8000000
+DEFAULT_CHUNK_SIZE = 256
+CAPTURE_POLL_PERIOD_S = 0.01
+CAPTURE_TIMEOUT_S = 3.0
+
+WRITE_FLAG = 0x80
+
+# ArduChip registers
+ARDUCHIP_TEST = 0x00
+ARDUCHIP_FIFO = 0x04
+ARDUCHIP_VERSION = 0x40
+ARDUCHIP_TRIG = 0x41
+FIFO_SIZE_1 = 0x42
+FIFO_SIZE_2 = 0x43
+FIFO_SIZE_3 = 0x44
+
+# commands which read the FIFO rather than a register
+BURST_FIFO_READ = 0x3C
+SINGLE_FIFO_READ = 0x3D
+
+# bits of ARDUCHIP_FIFO
+FIFO_CLEAR = 0x01
+FIFO_START = 0x02
+FIFO_READ_POINTER_RESET = 0x10
+FIFO_WRITE_POINTER_RESET = 0x20
+
+# bits of ARDUCHIP_TRIG
+CAPTURE_DONE = 0x08
+
+MAX_FIFO_SIZE = 0x7FFFFF  # the 8 MB frame buffer of the 5MP Mini
+
+
+class ArduCam:
+    """
+    Driver class for the ArduCam 5MP Mini camera on a SPI bus which may be shared with other
+    devices. The OV5642 image sensor is configured over I2C, outside of this driver, and must be
+    set up for JPEG output before capturing.
+    """
+
+    def __init__(self, sck, mosi, miso, cs, *, chunk_size=DEFAULT_CHUNK_SIZE, plus=False):
+        """
+        Creates a driver for an ArduCam selected by `cs`. Images are streamed in chunks of up to
+        `chunk_size` bytes, which are read into a buffer allocated once, here. `plus` is whether
+        the camera is a 5MP Mini Plus; the 5MP Mini sends a dummy byte at the start of each
+        burst read, which is clocked out with the burst command and discarded.
+        """
+        pm = pin_manager.PinManager.get_instance()
+        self.spi_device = pm.create_spi_bus_device(
+            sck, mosi, miso, cs, baudrate=SPI_BAUDRATE, polarity=0, phase=0
+        )
+        self._command = bytearray(2)
+        self._response = bytearray(2)
+        self._burst_command = bytes([BURST_FIFO_READ] if plus else [BURST_FIFO_READ, 0])
+        self._chunk = bytearray(chunk_size)
+
+    def write_register(self, address, value):
+        """Writes `value` to the ArduChip register at `address`"""
+        self._command[0] = address | WRITE_FLAG
+        self._command[1] = value
+        with self.spi_device as spi:
+            spi.write_readinto(self._command, self._response)
+
+    def read_register(self, address):
+        """Returns the value of the ArduChip register at `address`"""
+        self._command[0] = address & 0x7F
+        self._command[1] = 0
+        with self.spi_device as spi:
+            spi.write_readinto(self._command, self._response)
+        return self._response[1]
+
+    def probe(self):
+        """Returns whether the ArduChip's test register holds values written to it"""
+        for pattern in (0x55, 0xAA):
+            self.write_register(ARDUCHIP_TEST, pattern)
+            if self.read_register(ARDUCHIP_TEST) != pattern:
+                return False
+        return True
+
+    def start_capture(self):
+        """Clears the FIFO and starts capturing a frame into it"""
+        self.write_register(ARDUCHIP_FIFO, FIFO_CLEAR)
+        self.write_register(ARDUCHIP_FIFO, FIFO_READ_POINTER_RESET | FIFO_WRITE_POINTER_RESET)
+        self.write_register(ARDUCHIP_FIFO, FIFO_START)
+
+    def capture_done(self):
+        """Returns whether the frame being captured has been written to the FIFO"""
+        return bool(self.read_register(ARDUCHIP_TRIG) & CAPTURE_DONE)
+
+    async def capture(self, timeout=CAPTURE_TIMEOUT_S, poll_period=CAPTURE_POLL_PERIOD_S):
+        """
+        Asynchronous coroutine to capture a frame into the FIFO, returning the length of the
+        frame in bytes.
+
+        The capture is started, and then the capture done flag is polled every `poll_period`
+        seconds, yielding to other tasks in between. The SPI bus is only held for the polls
+        themselves. If the capture has not completed after `timeout` seconds,
+        asyncio.TimeoutError is raised.
+        """
+        self.start_capture()
+        deadline_ns = time.monotonic_ns() + int(timeout * 1e9)
+        while not self.capture_done():
+            if time.monotonic_ns() >= deadline_ns:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(poll_period)
+        return self.fifo_length()
+
+    def fifo_length(self):
+        """
+        Returns the length in bytes of the frame in the FIFO. Raises ValueError if the length is
+        zero or exceeds the FIFO, as it does when no frame was captured.
+        """
+        length = (
+            ((self.read_register(FIFO_SIZE_3) & 0x7F) << 16)
+            | (self.read_register(FIFO_SIZE_2) << 8)
+            | self.read_register(FIFO_SIZE_1)
+        )
+        if length == 0 or length >= MAX_FIFO_SIZE:
+            raise ValueError(f"Invalid FIFO length {length}")
+        return length
+
+    async def stream(self, sink, buffer=None, offset=0):
+        """
+        Asynchronous coroutine to read the frame in the FIFO out in chunks, returning its
+        length in bytes.
+
+        Each chunk is read with a burst read into `buffer` starting at `offset`, and then
+        `sink(position, chunk)` is called, where `chunk` is a memoryview of `buffer` from its
+        start to the end of the data read, and `position` is the position in the frame of the
+        first byte read. The sink must finish with the chunk before it returns, as the buffer
+        is reused for the next chunk; the bytes before `offset` are left for the sink to fill
+        in, for example with a message header, so that the chunk can be sent without copying.
+        `buffer` defaults to the driver's own chunk buffer. The coroutine yields to other
+        tasks after each chunk.
+
+        The FIFO read pointer is reset first, so a frame can be streamed more than once.
+        """
+        length = self.fifo_length()
+        if buffer is None:
+            buffer = self._chunk
+        view = memoryview(buffer)
+        capacity = len(buffer) - offset
+        if capacity < 1:
+            raise ValueError("Buffer has no room for data after the offset")
+        self.write_register(ARDUCHIP_FIFO, FIFO_READ_POINTER_RESET)
+        full_chunk = view[: offset + capacity]
+        position = 0
+        while position < length:
+            count = min(capacity, length - position)
+            with self.spi_device as spi:
+                spi.write(self._burst_command)
+                spi.readinto(buffer, start=offset, end=offset + count)
+            sink(position, full_chunk if count == capacity else view[: offset + count])
+            position += count
+            await asyncio.sleep(0)
+        return length
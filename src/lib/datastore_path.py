@@ -0,0 +1,15 @@
+"""
+Module to look up objects in a datastore by a dotted path, such as "batteries.string_1" or
+"batteries.temperatures.0", so that tables of datastore fields can be declared as strings.
+"""
+
+
+def resolve(datastore, path):
+    """
+    Returns the object at `path` below `datastore`. Each component of the path is an attribute
+    name, or an index into a list if it is made up of digits.
+    """
+    obj = datastore
+    for name in path.split("."):
+        obj = obj[int(name)] if name.isdigit() else getattr(obj, name)
+    return obj
@@ -1,64 +1,324 @@
 """
 Module of objects and classes which store data pertaining to the current state of the
 ADCS system for all tasks to update and use. Readings that have not yet been initialized
-are set to `None` throughout this module.
+are set to `None` throughout this module, or to NaN in the case of vectors.
 """
 
+import math
+import struct
+
+try:
+    import ulab.numpy as np  # For CircuitPython
+except ImportError:
+    import numpy as np  # For GitHub Actions / PC testing
+
+# single precision, as used by ulab on the boards, so that arrays have the same layout everywhere
+FLOAT = np.float32 if hasattr(np, "float32") else np.float
+_NAN = float("nan")
+
+# TODO: Tune the filter's noise and initial uncertainty against the flight sensors
+GYRO_NOISE_VARIANCE = 1e-6
+MEASUREMENT_NOISE_VARIANCE = 1e-3
+INITIAL_ATTITUDE_VARIANCE = 0.1
+
+# number of recent samples kept for each sensor
+SAMPLE_CAPACITY = 8
+
+
+def _vector(size=3):
+    vector = np.zeros(size, dtype=FLOAT)
+    vector[:] = _NAN
+    return vector
+
+
+def _diagonal(value):
+    matrix = np.zeros((3, 3), dtype=FLOAT)
+    for i in range(3):
+        matrix[i, i] = value
+    return matrix
+
+
 class Datastore:
     """
     Datastore class for adcs processes. Holds time, sensor, and attitude data to be used system-wide
+
+    Every vector and matrix is allocated once and updated in place, never rebound, so tasks may
+    hold on to them.
     """
 
+    __slots__ = ("time", "sensor", "attitude", "mode", "tle")
+
     # Action types
     DETUMBLE = 0
     POINT_TO_SUN = 1
     POINT_TO_EARTH = 2
     NOMINAL_PROCESSES = 3
 
-    # Constant matrices for MEKF
-    CV_MATRIX = (
-        None
-    )
-    GYRO_NOISE = (
-        None
-    )
-    MEAS_NOISE = (
-        None
-    )
-
     def __init__(self):
         self.time: AdcsTime = AdcsTime()
         self.sensor: SensorData = SensorData()
-        self.quaternion = (
-            None  # Quaternion representing attitude from body frame to inertial frame
-        )
+        self.attitude: AttitudeState = AttitudeState()
         self.mode = self.DETUMBLE
         self.tle: TLE = TLE()
 
+
 class AdcsTime:
     """
     Time helper class
     """
+
+    __slots__ = ("current_time", "last_cdh_update", "update_interval")
+
     def __init__(self):
-        self.current_time = None
-        self.last_cdh_update = None
-        self.update_interval = 1.0  # secondsgit
-        self.time_since_last_mekf = 0.0  # dt from tasks/mekf
+        self.current_time = None  # time.monotonic_ns()
+        self.last_cdh_update = None  # time.monotonic_ns()
+        self.update_interval = 1.0  # seconds
+
+
+class AttitudeState:
+    """
+    State of the attitude filter. `quaternion` is the attitude from the body frame to the
+    inertial frame as [w, x, y, z] (NaN until an attitude has first been determined), valid at
+    the `time.monotonic_ns()` time `updated_ns`, `rates` is the body angular rate vector in rad/s
+    last used to propagate it, and `covariance` is the 3x3 covariance of the attitude error.
+    `gyro_noise` and `measurement_noise` are the 3x3 noise covariances of the gyroscope and of
+    the measured body vectors.
+    """
+
+    __slots__ = (
+        "quaternion",
+        "rates",
+        "covariance",
+        "gyro_noise",
+        "measurement_noise",
+        "updated_ns",
+    )
+
+    def __init__(self):
+        self.quaternion = _vector(4)
+        self.rates = _vector()
+        self.covariance = _diagonal(INITIAL_ATTITUDE_VARIANCE)
+        self.gyro_noise = _diagonal(GYRO_NOISE_VARIANCE)
+        self.measurement_noise = _diagonal(MEASUREMENT_NOISE_VARIANCE)
+        self.updated_ns = None
+
+    @property
+    def valid(self):
+        """True once an attitude has been determined"""
+        return not math.isnan(self.quaternion[0])
+
+    def set_quaternion(self, w, x, y, z):
+        """Sets the attitude in place"""
+        quaternion = self.quaternion
+        quaternion[0] = w
+        quaternion[1] = x
+        quaternion[2] = y
+        quaternion[3] = z
+
+
+class SensorSamples:
+    """
+    Time-tagged samples of a 3-axis sensor. `vector` and `time_ns` hold the most recent sample
+    (NaN and None until the sensor is first sampled), and the last `capacity` samples are also
+    kept in a preallocated ring. Samples are tagged with the `time.monotonic_ns()` time at which
+    they were taken, and must be recorded in increasing time order.
+    """
+
+    __slots__ = ("vector", "time_ns", "_times", "_vectors", "_capacity", "_count")
+
+    def __init__(self, capacity=SAMPLE_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("SensorSamples capacity must be positive")
+        self.vector = _vector()
+        self.time_ns = None
+        self._times = [0] * capacity
+        self._vectors = np.zeros((capacity, 3), dtype=FLOAT)
+        self._capacity = capacity
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def clear(self):
+        """Discards all samples"""
+        self.vector[:] = _NAN
+        self.time_ns = None
+        self._count = 0
+
+    def record(self, time_ns, x, y, z):
+        """Records the sample (x, y, z) taken at `time_ns`, replacing the oldest if full"""
+        if self._count and time_ns <= self._times[(self._count - 1) % self._capacity]:
+            raise ValueError("Sensor samples must be recorded in time order")
+        slot = self._count % self._capacity
+        self._times[slot] = time_ns
+        vectors = self._vectors
+        vectors[slot, 0] = x
+        vectors[slot, 1] = y
+        vectors[slot, 2] = z
+        vector = self.vector
+        vector[0] = x
+        vector[1] = y
+        vector[2] = z
+        self.time_ns = time_ns
+        self._count += 1
+
+    def next_time_ns(self, after_ns):
+        """
+        Returns the time of the oldest held sample taken after `after_ns` (or of the oldest
+        held sample if `after_ns` is None), or None if there is none
+        """
+        times = self._times
+        capacity = self._capacity
+        for index in range(max(0, self._count - capacity), self._count):
+            time_ns = times[index % capacity]
+            if after_ns is None or time_ns > after_ns:
+                return time_ns
+        return None
+
+    def interpolate_into(self, out, time_ns):
+        """
+        Fills `out` with the sensor's vector at `time_ns`, linearly interpolated between the held
+        samples around it. Before the oldest or after the newest held sample, that sample is
+        used. Returns False, leaving `out` unchanged, if there are no samples.
+        """
+        count = self._count
+        if count == 0:
+            return False
+        times = self._times
+        vectors = self._vectors
+        capacity = self._capacity
+        oldest = max(0, count - capacity)
+        index = oldest
+        while index < count and times[index % capacity] < time_ns:
+            index += 1
+        after = (count - 1 if index == count else index) % capacity
+        if index == oldest or index == count or times[after] == time_ns:
+            for i in range(3):
+                out[i] = vectors[after, i]
+            return True
+        before = (index - 1) % capacity
+        fraction = (time_ns - times[before]) / (times[after] - times[before])
+        for i in range(3):
+            start = vectors[before, i]
+            out[i] = start + fraction * (vectors[after, i] - start)
+        return True
+
 
 class SensorData:
     """
-    Sensor helper class
+    Sensor helper class. Holds the time-tagged samples of the sun sensor and magnetometer, which
+    measure the sun and magnetic field vectors in the body frame, and of the gyroscope, which
+    measures the body angular rate vector, along with the model sun and magnetic field vectors
+    in the inertial frame.
     """
+
+    __slots__ = (
+        "sun",
+        "sun_model",
+        "magnetometer",
+        "magnetometer_model",
+        "gyroscope",
+    )
+
     def __init__(self):
-        self.sun = None
-        self.magnetometer = None
-        self.gyroscope = None
+        self.sun = SensorSamples()
+        self.sun_model = _vector()
+        self.magnetometer = SensorSamples()
+        self.magnetometer_model = _vector()
+        self.gyroscope = SensorSamples()
+
 
 class TLE:
     """
     Attitude helper class
     """
+
+    __slots__ = ("ref_vec1", "ref_vec2")
+
     def __init__(self):
         # reference vectors in inertial frame
-        self.ref_vec1 = 0.0 # more accurate vector
-        self.ref_vec2 = 0.0 # less accurate vector
+        self.ref_vec1 = _vector()  # more accurate vector
+        self.ref_vec2 = _vector()  # less accurate vector
+
+
+# Arrays included in a snapshot, in order, as paths of attributes from the Datastore
+SNAPSHOT_ARRAYS = (
+    ("attitude", "quaternion"),
+    ("attitude", "rates"),
+    ("attitude", "covariance"),
+    ("sensor", "sun", "vector"),
+    ("sensor", "magnetometer", "vector"),
+    ("sensor", "gyroscope", "vector"),
+)
+
+# Sample times included in a snapshot, as paths of attributes from the Datastore, which are sent
+# in milliseconds, wrapping
+SNAPSHOT_TIMES = (
+    ("attitude", "updated_ns"),
+    ("sensor", "sun", "time_ns"),
+    ("sensor", "magnetometer", "time_ns"),
+    ("sensor", "gyroscope", "time_ns"),
+)
+
+_HEADER_FORMAT = f"<B{len(SNAPSHOT_TIMES)}I"
+_NO_TIME = 0xFFFFFFFF
+
+
+def _owner(datastore, path):
+    # the object holding the last attribute of `path`
+    for name in path[:-1]:
+        datastore = getattr(datastore, name)
+    return datastore
+
+
+class AdcsSnapshot:
+    """
+    Fixed binary layout of the mode, sample times, and state arrays of a Datastore, used to
+    produce telemetry. The mode is packed as a byte and each time in `SNAPSHOT_TIMES` as a
+    little-endian 32-bit count of milliseconds (all ones if None), followed by the elements of
+    each array in `SNAPSHOT_ARRAYS` as little-endian single-precision floats, in row-major order.
+    Vectors which have not been initialized are sent as NaN. Only the most recent sample of each
+    sensor is included, and unpacking a snapshot does not add it to the sensor's ring.
+
+    The arrays are copied as raw bytes into and out of the caller's buffer, so packing a
+    snapshot does not convert each element separately.
+    """
+
+    def __init__(self):
+        self.header_size = struct.calcsize(_HEADER_FORMAT)
+        reference = Datastore()
+        self.array_sizes = [
+            getattr(_owner(reference, path), path[-1]).size * 4 for path in SNAPSHOT_ARRAYS
+        ]
+        self.size = self.header_size + sum(self.array_sizes)
+
+    def pack_into(self, datastore, buffer, offset=0):
+        """Packs a snapshot of `datastore` into `buffer` starting at `offset`"""
+        times = []
+        for path in SNAPSHOT_TIMES:
+            time_ns = getattr(_owner(datastore, path), path[-1])
+            times.append(_NO_TIME if time_ns is None else (time_ns // 1000000) & 0xFFFFFFFF)
+        struct.pack_into(_HEADER_FORMAT, buffer, offset, datastore.mode, *times)
+        position = offset + self.header_size
+        view = memoryview(buffer)
+        for path, size in zip(SNAPSHOT_ARRAYS, self.array_sizes):
+            array = getattr(_owner(datastore, path), path[-1])
+            view[position : position + size] = array.tobytes()
+            position += size
+
+    def unpack_from(self, datastore, buffer, offset=0):
+        """
+        Places the values of a snapshot packed in `buffer` at `offset` into `datastore`. Times
+        are placed into the datastore in nanoseconds, at millisecond resolution.
+        """
+        fields = struct.unpack_from(_HEADER_FORMAT, buffer, offset)
+        datastore.mode = fields[0]
+        for path, value in zip(SNAPSHOT_TIMES, fields[1:]):
+            time_ns = None if value == _NO_TIME else value * 1000000
+            setattr(_owner(datastore, path), path[-1], time_ns)
+        position = offset + self.header_size
+        for path, size in zip(SNAPSHOT_ARRAYS, self.array_sizes):
+            array = getattr(_owner(datastore, path), path[-1])
+            values = np.frombuffer(buffer, dtype=FLOAT, count=size // 4, offset=position)
+            array[:] = values.reshape(array.shape)
+            position += size
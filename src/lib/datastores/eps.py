@@ -4,6 +4,13 @@ EPS system for all tasks to update and use. Readings that have not yet been init
 are set to `None` throughout this module.
 """
 
+import math
+import struct
+
+import datastore_path
+
+_NAN = float("nan")
+
 
 # TODO: Ensure these are all initialized upon startup
 class Datastore:
@@ -12,6 +19,19 @@ class Datastore:
     EPS system either directly or indirectly.
     """
 
+    __slots__ = (
+        "batteries",
+        "bus_3v3",
+        "bus_5v",
+        "bus_12vlp",
+        "bus_12vhp",
+        "mppt",
+        "solar_array",
+        "control_commands",
+        "sampling",
+        "health",
+    )
+
     def __init__(self):
         self.batteries: DsBatteryPack = DsBatteryPack()
         self.bus_3v3: DsOutputBus = DsOutputBus()
@@ -21,15 +41,30 @@ class Datastore:
         self.mppt: DsMppt = DsMppt()
         self.solar_array: DsSolarArray = DsSolarArray()
         self.control_commands: DsCommands = DsCommands()
+        self.sampling: dict[str, DsChannelSampling] = {}
+        self.health: DsHealth = DsHealth()
 
 
 class DsBatteryPack:
     """
     A datastore object representing state data for a battery pack. Includes 3 strings of
     cells each in a 2S configuration, four temperature data points, and summary statistics
-    of pack electrical state.
+    of pack electrical state, including the estimated state of charge (as a fraction), the
+    remaining energy, and the time until the pack is empty at the present discharge rate.
     """
 
+    __slots__ = (
+        "string_1",
+        "string_2",
+        "string_3",
+        "temperatures",
+        "pack_capacity_mah",
+        "filled_capacity_mah",
+        "state_of_charge",
+        "remaining_energy_wh",
+        "time_to_empty_s",
+    )
+
     def __init__(self):
         self.string_1: DsBatteryString = DsBatteryString()
         self.string_2: DsBatteryString = DsBatteryString()
@@ -37,6 +72,9 @@ class DsBatteryPack:
         self.temperatures: list[int] = [None] * 4
         self.pack_capacity_mah: int = None
         self.filled_capacity_mah: int = None
+        self.state_of_charge: float = None
+        self.remaining_energy_wh: float = None
+        self.time_to_empty_s: float = None
 
 
 class DsOutputBus:
@@ -44,14 +82,31 @@ class DsOutputBus:
     A datastore object representing state data for an switched-mode power supply which takes
     power from the battery pack and produces a regulated voltage. Includes input and output
     currents, whether or not the supply is enabled, and the actual measured output voltage
-    for monitoring.
+    for monitoring. Also includes the state of the supply's fast overcurrent trip, the number of
+    times it has tripped, and the time from the offending current sample to the supply being
+    turned off for the most recent trip.
     """
 
+    __slots__ = (
+        "input_current",
+        "output_current",
+        "output_voltage",
+        "enabled",
+        "tripped",
+        "trip_count",
+        "last_trip_time_ns",
+        "last_trip_latency_ns",
+    )
+
     def __init__(self):
         self.input_current: int = None
         self.output_current: int = None
         self.output_voltage: int = None
         self.enabled: bool = None
+        self.tripped: bool = False
+        self.trip_count: int = 0
+        self.last_trip_time_ns: int = None
+        self.last_trip_latency_ns: int = None
 
 
 class DsMppt:
@@ -60,6 +115,16 @@ class DsMppt:
     and output currents, the measured input voltage, and control mode information from the mppt.
     """
 
+    __slots__ = (
+        "input_current",
+        "output_current",
+        "input_voltage",
+        "enabled",
+        "low_power_mode",
+        "charging_stage",
+        "fault",
+    )
+
     def __init__(self):
         self.input_current: int = None
         self.output_current: int = None
@@ -72,11 +137,27 @@ class DsMppt:
 
 class DsSolarArray:
     """
-    A datastore object representing state data for a solar array. Includes 4 independent panels.
+    A datastore object representing state data for a solar array. Includes 4 independent panels,
+    the power currently produced by the array along with its average and peak over a recent
+    window, and the energy harvested both since startup and over the most recent orbit.
     """
 
+    __slots__ = (
+        "panels",
+        "power_w",
+        "average_power_w",
+        "peak_power_w",
+        "energy_harvested_wh",
+        "recent_energy_wh",
+    )
+
     def __init__(self):
         self.panels: list[DsSolarPanel] = [DsSolarPanel() for i in range(4)]
+        self.power_w: float = None
+        self.average_power_w: float = None
+        self.peak_power_w: float = None
+        self.energy_harvested_wh: float = None
+        self.recent_energy_wh: float = None
 
 
 class DsBatteryString:
@@ -85,6 +166,16 @@ class DsBatteryString:
     and current values. Also includes protection and balancing control information.
     """
 
+    __slots__ = (
+        "top_cell_voltage",
+        "bottom_cell_voltage",
+        "output_current",
+        "discharging_enabled",
+        "charging_enabled",
+        "top_balancing_shunt_enabled",
+        "bottom_balancing_shunt_enabled",
+    )
+
     def __init__(self):
         self.top_cell_voltage: int = None
         self.bottom_cell_voltage: int = None
@@ -98,14 +189,83 @@ class DsBatteryString:
 class DsSolarPanel:
     """
     A datastore object representing state data for a single solar panel. Includes temperature and
-    output current measurements.
+    output current measurements, the power produced by the panel, and the energy it has harvested
+    since startup.
     """
 
+    __slots__ = (
+        "top_temperature",
+        "middle_temperature",
+        "bottom_temperature",
+        "output_current",
+        "power_w",
+        "energy_harvested_wh",
+    )
+
     def __init__(self):
         self.top_temperature: int = None
         self.middle_temperature: int = None
         self.bottom_temperature: int = None
         self.output_current: int = None
+        self.power_w: float = None
+        self.energy_harvested_wh: float = None
+
+
+class DsChannelSampling:
+    """
+    A datastore object representing the sampling statistics of a single scheduled measurement.
+    Includes the scheduled sampling period, the number of samples taken, the time of the most
+    recent sample (from `time.monotonic_ns()`), the time since that sample, and the sampling rate
+    actually achieved over recent samples.
+    """
+
+    __slots__ = ("period_s", "samples", "last_time_ns", "staleness_s", "achieved_rate_hz")
+
+    def __init__(self, period_s: float):
+        self.period_s: float = period_s
+        self.samples: int = 0
+        self.last_time_ns: int = None
+        self.staleness_s: float = None
+        self.achieved_rate_hz: float = None
+
+
+class DsHealth:
+    """
+    A datastore object representing reliability metrics for the EPS microcontroller. Includes the
+    boot count and the cause of the most recent reset (as an index into
+    `monitoring.RESET_REASONS`) along with the number of resets from each cause, the uptime, the
+    current and minimum free heap in bytes, the heap growth rate in bytes per hour, whether the
+    heap is too fragmented for a moderately sized allocation, the worst scheduler latency and the
+    worst overrun of each task's loop period over the last second in milliseconds, and the name
+    of the most recent task to stall.
+    """
+
+    __slots__ = (
+        "boot_count",
+        "reset_reason",
+        "reset_counts",
+        "uptime_s",
+        "mem_free",
+        "mem_free_min",
+        "heap_growth_bph",
+        "heap_fragmented",
+        "scheduler_latency_ms",
+        "task_overrun_ms",
+        "stalled_task",
+    )
+
+    def __init__(self):
+        self.boot_count: int = None
+        self.reset_reason: int = None
+        self.reset_counts: list[int] = None
+        self.uptime_s: int = None
+        self.mem_free: int = None
+        self.mem_free_min: int = None
+        self.heap_growth_bph: int = None
+        self.heap_fragmented: bool = None
+        self.scheduler_latency_ms: int = None
+        self.task_overrun_ms: dict[str, int] = {}
+        self.stalled_task: str = None
 
 
 class DsCommands:
@@ -114,8 +274,182 @@ class DsCommands:
     through system control commands from CDH.
     """
 
+    __slots__ = ("bus_3v3_enabled", "bus_5v_enabled", "bus_12vlp_enabled", "bus_12vhp_enabled")
+
     def __init__(self):
         self.bus_3v3_enabled: bool = True
         self.bus_5v_enabled: bool = True
         self.bus_12vlp_enabled: bool = True
         self.bus_12vhp_enabled: bool = True
+
+
+# Types of the fields in a snapshot. Each is a `struct` format character, except "?", which
+# stores a bool in a signed byte so that None can be represented.
+_NONE_VALUES = {"?": -1, "b": -128, "B": 0xFF, "H": 0xFFFF, "i": -(2**31), "I": 0xFFFFFFFF}
+_STRUCT_FORMATS = {"?": "b"}
+
+
+def _bus_fields(bus):
+    return [
+        (bus, "input_current", "f"),
+        (bus, "output_current", "f"),
+        (bus, "output_voltage", "f"),
+        (bus, "enabled", "?"),
+        (bus, "tripped", "?"),
+        (bus, "trip_count", "H"),
+        (bus, "last_trip_latency_ns", "I"),
+    ]
+
+
+def _string_fields(string):
+    return [
+        (string, "top_cell_voltage", "f"),
+        (string, "bottom_cell_voltage", "f"),
+        (string, "output_current", "f"),
+        (string, "discharging_enabled", "?"),
+        (string, "charging_enabled", "?"),
+        (string, "top_balancing_shunt_enabled", "?"),
+        (string, "bottom_balancing_shunt_enabled", "?"),
+    ]
+
+
+def _panel_fields(panel):
+    return [
+        (panel, "top_temperature", "f"),
+        (panel, "middle_temperature", "f"),
+        (panel, "bottom_temperature", "f"),
+        (panel, "output_current", "f"),
+        (panel, "power_w", "f"),
+        (panel, "energy_harvested_wh", "f"),
+    ]
+
+
+# Fields included in a snapshot, in order, as (dotted path of the object, attribute name or list
+# index, type) tuples
+SNAPSHOT_FIELDS = (
+    _string_fields("batteries.string_1")
+    + _string_fields("batteries.string_2")
+    + _string_fields("batteries.string_3")
+    + [("batteries.temperatures", i, "f") for i in range(4)]
+    + [
+        ("batteries", "pack_capacity_mah", "f"),
+        ("batteries", "filled_capacity_mah", "f"),
+        ("batteries", "state_of_charge", "f"),
+        ("batteries", "remaining_energy_wh", "f"),
+        ("batteries", "time_to_empty_s", "f"),
+    ]
+    + _bus_fields("bus_3v3")
+    + _bus_fields("bus_5v")
+    + _bus_fields("bus_12vlp")
+    + _bus_fields("bus_12vhp")
+    + [
+        ("mppt", "input_current", "f"),
+        ("mppt", "output_current", "f"),
+        ("mppt", "input_voltage", "f"),
+        ("mppt", "enabled", "?"),
+        ("mppt", "low_power_mode", "?"),
+        ("mppt", "charging_stage", "b"),
+    ]
+    + [field for i in range(4) for field in _panel_fields(f"solar_array.panels.{i}")]
+    + [
+        ("solar_array", "power_w", "f"),
+        ("solar_array", "average_power_w", "f"),
+        ("solar_array", "peak_power_w", "f"),
+        ("solar_array", "energy_harvested_wh", "f"),
+        ("solar_array", "recent_energy_wh", "f"),
+        ("control_commands", "bus_3v3_enabled", "?"),
+        ("control_commands", "bus_5v_enabled", "?"),
+        ("control_commands", "bus_12vlp_enabled", "?"),
+        ("control_commands", "bus_12vhp_enabled", "?"),
+        ("health", "boot_count", "I"),
+        ("health", "reset_reason", "b"),
+        ("health", "uptime_s", "I"),
+        ("health", "mem_free", "I"),
+        ("health", "mem_free_min", "I"),
+        ("health", "heap_growth_bph", "i"),
+        ("health", "heap_fragmented", "?"),
+        ("health", "scheduler_latency_ms", "I"),
+    ]
+)
+
+# Fixed-point scales of the float fields in a snapshot for the telemetry encoder, keyed by
+# attribute name (or by path, for list items). Each value is sent as a whole number of 1/scale
+# units, so voltages and currents are sent in millivolts and milliamps, temperatures in
+# hundredths of a degree, and powers and energies in milliwatts and milliwatt-hours.
+TELEMETRY_SCALES = {
+    "top_cell_voltage": 1000,
+    "bottom_cell_voltage": 1000,
+    "output_voltage": 1000,
+    "input_voltage": 1000,
+    "output_current": 1000,
+    "input_current": 1000,
+    "batteries.temperatures": 100,
+    "top_temperature": 100,
+    "middle_temperature": 100,
+    "bottom_temperature": 100,
+    "pack_capacity_mah": 1,
+    "filled_capacity_mah": 1,
+    "state_of_charge": 10000,
+    "remaining_energy_wh": 1000,
+    "time_to_empty_s": 1,
+    "power_w": 1000,
+    "average_power_w": 1000,
+    "peak_power_w": 1000,
+    "energy_harvested_wh": 1000,
+    "recent_energy_wh": 1000,
+}
+
+
+class DatastoreSnapshot:
+    """
+    Fixed binary layout of the scalar fields of a Datastore listed in `fields`, used to produce
+    telemetry. Fields are packed little-endian with no padding, in the order listed. Floats which
+    are None are packed as NaN, and other fields which are None are packed as a reserved value
+    (the minimum of signed types and the maximum of unsigned types).
+
+    Snapshots are written directly into and read directly from a caller's buffer, so that a
+    snapshot can be packed into a preallocated telemetry frame with a single `struct` call.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = SNAPSHOT_FIELDS if fields is None else fields
+        self.format = "<" + "".join(_STRUCT_FORMATS.get(t, t) for _, _, t in self.fields)
+        self.size = struct.calcsize(self.format)
+        self._datastore = None
+        self._targets = None
+        # reused by every call to `pack_into()`, which fills it in place
+        self._values = [0] * len(self.fields)
+
+    def _bind(self, datastore):
+        # resolving each field's object is only needed once per datastore
+        if datastore is not self._datastore:
+            self._targets = [datastore_path.resolve(datastore, path) for path, _, _ in self.fields]
+            self._datastore = datastore
+        return self._targets
+
+    def pack_into(self, datastore, buffer, offset=0):
+        """Packs a snapshot of `datastore` into `buffer` starting at `offset`"""
+        values = self._values
+        for i, (target, (_, field, kind)) in enumerate(zip(self._bind(datastore), self.fields)):
+            value = target[field] if isinstance(field, int) else getattr(target, field)
+            if value is None:
+                value = _NONE_VALUES.get(kind, _NAN)
+            elif kind == "?":
+                value = 1 if value else 0
+            values[i] = value
+        struct.pack_into(self.format, buffer, offset, *values)
+
+    def unpack_from(self, datastore, buffer, offset=0):
+        """Places the values of a snapshot packed in `buffer` at `offset` into `datastore`"""
+        values = struct.unpack_from(self.format, buffer, offset)
+        for target, (_, field, kind), value in zip(self._bind(datastore), self.fields, values):
+            if kind == "f":
+                value = None if math.isnan(value) else value
+            elif value == _NONE_VALUES[kind]:
+                value = None
+            elif kind == "?":
+                value = bool(value)
+            if isinstance(field, int):
+                target[field] = value
+            else:
+                setattr(target, field, value)
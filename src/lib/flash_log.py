@@ -0,0 +1,254 @@
+"""
+Circular log of fixed-size, timestamped binary records stored in NOR flash. Each record carries
+a checksum, so a record torn by a reset is skipped when the log is read back.
+"""
+
+import struct
+
+BLOCK_MAGIC = 0x4C47
+_BLOCK_HEADER_FORMAT = "<HI"
+BLOCK_HEADER_SIZE = struct.calcsize(_BLOCK_HEADER_FORMAT)
+_RECORD_TIMESTAMP_FORMAT = "<I"
+RECORD_OVERHEAD = 4 + 2  # timestamp and checksum
+_ERASED_TIMESTAMP = 0xFFFFFFFF
+
+
+def fletcher16(data, length):
+    """Returns the Fletcher-16 checksum of the first `length` bytes of `data`"""
+    sum1 = 0
+    sum2 = 0
+    for i in range(length):
+        sum1 = (sum1 + data[i]) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+class FlashLog:
+    """
+    A circular log of records with `payload_size`-byte payloads in `flash`, which has
+    `block_size`, `block_count`, and `page_size` attributes and `read(address, buffer)`,
+    `program(address, data)`, and `erase(block)` methods. The erase blocks are used as a ring,
+    and erasing a block drops the oldest records.
+
+    Records are buffered in RAM and programmed a page at a time; `flush()` programs a partial
+    page. `erase_ahead()` erases the next block while the logging task is idle, so that starting
+    a block never waits for an erase. Timestamps must not decrease, and the first timestamp of
+    each block is indexed so that `records()` only reads the blocks holding a time range.
+    """
+
+    def __init__(self, flash, payload_size):
+        self.flash = flash
+        self.payload_size = payload_size
+        self.record_size = payload_size + RECORD_OVERHEAD
+        self.records_per_block = (flash.block_size - BLOCK_HEADER_SIZE) // self.record_size
+        if self.records_per_block < 1 or flash.block_count < 3:
+            raise ValueError("Flash is too small for the log")
+        self.block_count = flash.block_count
+        self.page_size = flash.page_size
+
+        # sparse index: block sequence numbers and the first timestamp in each block, or None
+        self._block_sequences = [None] * self.block_count
+        self._first_timestamps = [None] * self.block_count
+        self._page = bytearray(self.page_size)
+        self._page_view = memoryview(self._page)
+        self._page_address = 0  # flash address of the start of `_page`
+        self._page_fill = 0  # bytes of `_page` holding data
+        self._page_programmed = 0  # bytes of `_page` already programmed
+        self._record = bytearray(self.record_size)
+        self._record_view = memoryview(self._record)
+        self._read = bytearray(self.record_size)
+        self._read_view = memoryview(self._read)
+        self._header = bytearray(BLOCK_HEADER_SIZE)
+        self._erased_block = None
+        self.last_timestamp = None
+        self._mount()
+
+    def _mount(self):
+        # finds the newest block and the position of the next record within it
+        newest = self._read_index()
+        if newest is None:
+            self._block = 0
+            self._slot = 0
+            self._sequence = 0
+            self._start_block(0, 0)
+            return
+        self._block = newest
+        self._sequence = self._block_sequences[newest]
+        timestamps = [t for t in self._first_timestamps if t is not None]
+        if timestamps:
+            self.last_timestamp = max(timestamps)
+        self._slot = self._scan_block(newest)
+        self._reset_page(self._slot_address(newest, self._slot))
+
+    def _read_index(self):
+        # rebuilds the sparse index from the flash, returning the newest block or None
+        newest = None
+        for block in range(self.block_count):
+            self.flash.read(block * self.flash.block_size, self._header)
+            magic, sequence = struct.unpack(_BLOCK_HEADER_FORMAT, self._header)
+            if magic != BLOCK_MAGIC:
+                continue
+            self._block_sequences[block] = sequence
+            self._first_timestamps[block] = self._first_timestamp(block)
+            if newest is None or sequence > self._block_sequences[newest]:
+                newest = block
+        return newest
+
+    def _first_timestamp(self, block):
+        # returns the timestamp of the first valid record in the block, or None if it has none;
+        # only blocks whose first record was torn are read past their first record
+        for slot in range(self.records_per_block):
+            if self._read_record(block, slot):
+                return self._record_timestamp()
+            if self._record_timestamp() == _ERASED_TIMESTAMP:
+                break
+        return None
+
+    def _scan_block(self, block):
+        # returns the first erased slot of the block, and records the timestamp of the last
+        # valid record before it
+        slot = 0
+        while slot < self.records_per_block:
+            self.flash.read(self._slot_address(block, slot), self._read_view[:4])
+            if self._record_timestamp() == _ERASED_TIMESTAMP:
+                break
+            if self._read_record(block, slot):
+                self.last_timestamp = self._record_timestamp()
+            slot += 1
+        return slot
+
+    def _slot_address(self, block, slot):
+        return block * self.flash.block_size + BLOCK_HEADER_SIZE + slot * self.record_size
+
+    def _read_record(self, block, slot):
+        # reads a record into `_read`, returning True if it is valid
+        self.flash.read(self._slot_address(block, slot), self._read)
+        if self._record_timestamp() == _ERASED_TIMESTAMP:
+            return False
+        checksum = self._read[-2] | (self._read[-1] << 8)
+        return fletcher16(self._read, self.record_size - 2) == checksum
+
+    def _record_timestamp(self):
+        return struct.unpack_from(_RECORD_TIMESTAMP_FORMAT, self._read)[0]
+
+    def _reset_page(self, address):
+        # starts buffering at `address`, keeping the part of its page already in flash
+        page_start = address - address % self.page_size
+        self._page_address = page_start
+        self._page_fill = address - page_start
+        self._page_programmed = self._page_fill
+        for i in range(self._page_fill, self.page_size):
+            self._page[i] = 0xFF
+
+    def _start_block(self, block, sequence):
+        if self._erased_block != block:
+            self.flash.erase(block)
+        self._erased_block = None
+        self._block_sequences[block] = sequence
+        self._first_timestamps[block] = None
+        struct.pack_into(_BLOCK_HEADER_FORMAT, self._header, 0, BLOCK_MAGIC, sequence)
+        self.flash.program(block * self.flash.block_size, self._header)
+        self._reset_page(block * self.flash.block_size + BLOCK_HEADER_SIZE)
+
+    def erase_ahead(self):
+        """Erases the block after the one being written, if it has not been erased already"""
+        block = (self._block + 1) % self.block_count
+        if self._erased_block == block:
+            return
+        self.flash.erase(block)
+        self._block_sequences[block] = None
+        self._first_timestamps[block] = None
+        self._erased_block = block
+
+    def append(self, timestamp, payload):
+        """
+        Appends a record with `payload`, which must be `payload_size` bytes, at `timestamp`, an
+        integer which must not be less than the timestamp of the previous record.
+        """
+        if len(payload) != self.payload_size:
+            raise ValueError("Payload has the wrong size")
+        if not 0 <= timestamp < _ERASED_TIMESTAMP:
+            raise ValueError("Timestamp out of range")
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            raise ValueError("Timestamps must not decrease")
+        if self._slot == self.records_per_block:
+            self.flush()
+            self._block = (self._block + 1) % self.block_count
+            self._sequence += 1
+            self._slot = 0
+            self._start_block(self._block, self._sequence)
+        record = self._record
+        struct.pack_into(_RECORD_TIMESTAMP_FORMAT, record, 0, timestamp)
+        self._record_view[4 : 4 + self.payload_size] = payload
+        checksum = fletcher16(record, self.record_size - 2)
+        record[-2] = checksum & 0xFF
+        record[-1] = checksum >> 8
+        if self._first_timestamps[self._block] is None:
+            self._first_timestamps[self._block] = timestamp
+        self._slot += 1
+        self.last_timestamp = timestamp
+        self._buffer(self._record_view)
+
+    def _buffer(self, data):
+        # copies data into the page buffer, programming each page as it fills
+        offset = 0
+        while offset < len(data):
+            count = min(len(data) - offset, self.page_size - self._page_fill)
+            self._page_view[self._page_fill : self._page_fill + count] = data[
+                offset : offset + count
+            ]
+            self._page_fill += count
+            offset += count
+            if self._page_fill == self.page_size:
+                self.flush()
+                self._reset_page(self._page_address + self.page_size)
+
+    def flush(self):
+        """Programs any buffered records which have not yet been written to flash"""
+        if self._page_fill > self._page_programmed:
+            self.flash.program(
+                self._page_address + self._page_programmed,
+                self._page_view[self._page_programmed : self._page_fill],
+            )
+            self._page_programmed = self._page_fill
+
+    def _blocks_in_order(self):
+        # blocks holding data, from oldest to newest
+        blocks = [b for b in range(self.block_count) if self._block_sequences[b] is not None]
+        blocks.sort(key=lambda b: self._block_sequences[b])
+        return blocks
+
+    def _search_blocks(self, blocks, timestamp):
+        # binary search for the index of the last of `blocks` starting before `timestamp`, or 0
+        # if none do; a block starting at `timestamp` may follow records with the same timestamp
+        low = 0
+        high = len(blocks)
+        while low < high:
+            middle = (low + high) // 2
+            if self._first_timestamps[blocks[middle]] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return max(0, low - 1)
+
+    def records(self, start, end):
+        """
+        Yields the (timestamp, payload) of each record with `start <= timestamp <= end`, oldest
+        first. The payload is a memoryview which is only valid until the next record is yielded.
+        Buffered records are flushed first.
+        """
+        self.flush()
+        blocks = [b for b in self._blocks_in_order() if self._first_timestamps[b] is not None]
+        payload = self._read_view[4 : 4 + self.payload_size]
+        for block in blocks[self._search_blocks(blocks, start) :]:
+            if self._first_timestamps[block] > end:
+                return
+            count = self._slot if block == self._block else self.records_per_block
+            for slot in range(count):
+                if not self._read_record(block, slot):
+                    continue
+                timestamp = self._record_timestamp()
+                if timestamp > end:
+                    return
+                if timestamp >= start:
+                    yield timestamp, payload
@@ -0,0 +1,92 @@
+"""
+Module to measure how promptly periodic tasks run their loops, so that a task starved by the
+scheduler can be detected from elsewhere:
+```python
+loop_timer = LoopMonitor.get_instance().register("bms", 0.1)
+while True:
+    loop_timer.tick()
+    ...
+    await asyncio.sleep(0.1)
+```
+"""
+
+import time
+
+DEFAULT_DEADLINE_PERIODS = 10
+
+
+class LoopTimer:
+    """
+    Timing statistics for the loop of a single periodic task which runs once every `period_s`
+    seconds. The task is considered stalled if it does not tick for `deadline_s` seconds.
+    """
+
+    def __init__(self, name, period_s, deadline_s):
+        self.name = name
+        self.period_s = period_s
+        self.deadline_ns = int(deadline_s * 1e9)
+        self.ticks = 0
+        self.last_tick_ns = time.monotonic_ns()
+        self.max_interval_ns = 0
+
+    def tick(self):
+        """Records an iteration of the task's loop"""
+        now_ns = time.monotonic_ns()
+        self.max_interval_ns = max(self.max_interval_ns, now_ns - self.last_tick_ns)
+        self.last_tick_ns = now_ns
+        self.ticks += 1
+
+    def stalled(self, now_ns):
+        """Returns True if the task has not ticked within its deadline as of `now_ns`"""
+        return now_ns - self.last_tick_ns > self.deadline_ns
+
+    def take_max_overrun_ms(self):
+        """
+        Returns the largest amount by which the time between iterations has exceeded the task's
+        period since the last call, in milliseconds, and starts a new measurement.
+        """
+        overrun_ms = max(0, int((self.max_interval_ns / 1e9 - self.period_s) * 1000))
+        self.max_interval_ns = 0
+        return overrun_ms
+
+
+class LoopMonitor:
+    """
+    Registry of the LoopTimers of all periodic tasks in the system. Use `get_instance()` to
+    access the shared instance.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def get_instance():
+        """
+        Creates a LoopMonitor and caches one if none exists, or returns the existing LoopMonitor
+        if one has already been created. This method allows this class to be used according to
+        the singleton pattern.
+        """
+        if LoopMonitor._instance is None:
+            LoopMonitor._instance = LoopMonitor()
+        return LoopMonitor._instance
+
+    def __init__(self):
+        self.timers = []
+
+    def register(self, name, period_s, deadline_s=None):
+        """
+        Creates and returns a LoopTimer for a task which loops every `period_s` seconds. The
+        deadline defaults to `DEFAULT_DEADLINE_PERIODS` periods.
+        """
+        if deadline_s is None:
+            deadline_s = period_s * DEFAULT_DEADLINE_PERIODS
+        timer = LoopTimer(name, period_s, deadline_s)
+        self.timers.append(timer)
+        return timer
+
+    def stalled_timer(self, now_ns=None):
+        """Returns the first LoopTimer which has stalled as of `now_ns`, or None if none have"""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        for timer in self.timers:
+            if timer.stalled(now_ns):
+                return timer
+        return None
@@ -34,8 +34,28 @@ If a context is created which uses a pin, but that contexts cannot be created du
 contention with an existing context on a distinct ManagedDevice, a RuntimeError will be
 raised. User code should close any contexts used in multiple tasks before yielding to
 guarantee this condition does not arise.
+
+Tasks which need to hold a device across a yield should instead acquire it asynchronously,
+which waits until every contending device has been released rather than raising:
+```py
+async with pm.acquire(m_spi, priority=1, timeout=0.5) as spi:
+    spi.write_readinto(tx, rx)
+    await asyncio.sleep(0)
+```
+
+Several chip-selected peripherals on one SPI bus should each be created as a SpiBusDevice,
+which shares a single busio.SPI with every other SpiBusDevice on the same pins. A context on
+a SpiBusDevice is a complete transaction with the peripheral:
+```py
+adc = pm.create_spi_bus_device(SCK, MOSI, MISO, CS, baudrate=1000000, phase=1)
+with adc as spi:
+    spi.write_readinto(tx, rx)
+```
 """
 
+import time
+import asyncio
+
 import digitalio
 import busio
 import analogio
@@ -45,6 +65,91 @@ class _ManagedPin:
     def __init__(self, pin):
         self.pin = pin
         self.claimer = _DefaultPinClaimer(self)
+        self.waiters = []
+
+    def add_waiter(self, waiter):
+        """
+        Queues a _PinWaiter behind all waiters of greater or equal priority.
+        """
+        index = len(self.waiters)
+        while index > 0 and self.waiters[index - 1].priority < waiter.priority:
+            index -= 1
+        self.waiters.insert(index, waiter)
+
+    def remove_waiter(self, waiter):
+        """
+        Removes a _PinWaiter from the queue and wakes the new head of the queue, if any.
+        """
+        self.waiters.remove(waiter)
+        self.wake_waiter()
+
+    def wake_waiter(self):
+        """
+        Wakes the waiter at the head of the queue so it can re-check for availability.
+        """
+        if self.waiters:
+            self.waiters[0].event.set()
+
+
+class _PinWaiter:
+    def __init__(self, managed_pins, priority):
+        self.managed_pins = managed_pins
+        self.priority = priority
+        self.event = asyncio.Event()
+
+    def is_first(self):
+        """
+        Returns whether this waiter is at the head of the queue for every pin it needs.
+        """
+        for m_pin in self.managed_pins:
+            if m_pin.waiters[0] is not self:
+                return False
+        return True
+
+
+class DeviceStats:
+    """
+    Usage statistics for a single ManagedDevice, collected only when statistics are enabled
+    on the PinManager which created the device. Times are measured in nanoseconds.
+    """
+
+    def __init__(self):
+        self.inits = 0
+        self.deinits = 0
+        self.entries = 0
+        self.contentions = 0
+        self.total_hold_ns = 0
+        self.max_hold_ns = 0
+        self._hold_start_ns = 0
+
+    def record_entry(self, active_contexts):
+        """
+        Records a context entry, starting the hold timer if the device was not already held.
+        """
+        self.entries += 1
+        if active_contexts == 0:
+            self._hold_start_ns = time.monotonic_ns()
+
+    def record_release(self):
+        """
+        Records the release of the last active context on the device.
+        """
+        held_ns = time.monotonic_ns() - self._hold_start_ns
+        self.total_hold_ns += held_ns
+        self.max_hold_ns = max(self.max_hold_ns, held_ns)
+
+    def snapshot(self):
+        """
+        Returns a dict containing a copy of the statistics.
+        """
+        return {
+            "inits": self.inits,
+            "deinits": self.deinits,
+            "entries": self.entries,
+            "contentions": self.contentions,
+            "total_hold_ns": self.total_hold_ns,
+            "max_hold_ns": self.max_hold_ns,
+        }
 
 
 class ManagedDevice:
@@ -53,11 +158,12 @@ class ManagedDevice:
     and used within a context opened in user code.
     """
 
-    def __init__(self, managed_pins, device_producer):
+    def __init__(self, managed_pins, device_producer, stats=None):
         self._managed_pins = managed_pins
         self._device_producer = device_producer
         self._instance = None
         self._active_contexts = 0
+        self.stats = stats
 
     # True if a call to __enter__() would do nothing to the hardware because
     # a context for this device is already active (or an explicit call to
@@ -97,6 +203,8 @@ class ManagedDevice:
             raise RuntimeError("Cannot reclaim device which is still open")
         self._instance.deinit()
         self._instance = None
+        if self.stats is not None:
+            self.stats.deinits += 1
         for m_pin in self._managed_pins:
             m_pin.claimer = _DefaultPinClaimer(m_pin)
 
@@ -104,24 +212,80 @@ class ManagedDevice:
     # until the next call to _reclaim(). Also increments the number of contexts in
     # which this device is considered to be open and unable to be reclaimed
     def __enter__(self):
-        if self._instance is not None:
-            self._active_contexts += 1
-            return self._instance
+        return self.hold()
+
+    # Raises a RuntimeError if a pin this device uses is held by another open device
+    def _check_contention(self):
+        for m_pin in self._managed_pins:
+            if m_pin.claimer.is_busy():
+                if self.stats is not None:
+                    self.stats.contentions += 1
+                raise RuntimeError("Cannot claim pin held by another open device")
+
+    # Decrements the number of contexts in which this device is considered to be open
+    def __exit__(self, exc_type, exc, exc_trace):
+        self.release()
+
+    # True if no device (including this one) holds an active context on any pin this
+    # device uses, so that it could be exclusively acquired without contention
+    def _is_available(self):
+        for m_pin in self._managed_pins:
+            if m_pin.claimer.is_busy():
+                return False
+        return True
+
+    # True if any task is waiting to acquire a pin this device uses
+    def _has_waiters(self):
+        for m_pin in self._managed_pins:
+            if m_pin.waiters:
+                return True
+        return False
+
+    def hold(self):
+        """
+        Opens a context on this device outside of a `with` block and returns the boxed
+        peripheral. Each call must be paired with a later call to release().
+
+        Holding a device which is already running does no hardware reconfiguration, so this is
+        the preferred way to keep a peripheral claimed across a tight loop of operations.
+        """
+        if self._instance is None:
+            self._claim()
+        if self.stats is not None:
+            self.stats.record_entry(self._active_contexts)
+        self._active_contexts += 1
+        return self._instance
+
+    # Reclaims the pins this device requires from their current claimers and creates the
+    # peripheral on them
+    def _claim(self):
+        self._check_contention()
+        # every claimer is either a ManagedDevice or a _DefaultPinClaimer from this module
         for m_pin in self._managed_pins:
             if m_pin.claimer.is_running():
-                m_pin.claimer._reclaim()
+                m_pin.claimer._reclaim()  # pylint: disable=protected-access
         for m_pin in self._managed_pins:
-            m_pin.claimer._reclaim()
+            m_pin.claimer._reclaim()  # pylint: disable=protected-access
         self._instance = self._device_producer()
         for m_pin in self._managed_pins:
             m_pin.claimer = self
             m_pin.is_claimed = True
-        self._active_contexts += 1
-        return self._instance
+        if self.stats is not None:
+            self.stats.inits += 1
 
-    # Decrements the number of contexts in which this device is considered to be open
-    def __exit__(self, exc_type, exc, exc_trace):
+    def release(self):
+        """
+        Closes a context previously opened with hold(). The device remains running until a
+        contending device reclaims its pins.
+        """
+        if self._active_contexts == 0:
+            raise RuntimeError("Cannot release device which is not held")
         self._active_contexts -= 1
+        if self._active_contexts == 0:
+            if self.stats is not None:
+                self.stats.record_release()
+            for m_pin in self._managed_pins:
+                m_pin.wake_waiter()
 
 
 class _DefaultPinClaimer:
@@ -169,6 +333,59 @@ class PinManager:
     def __init__(self):
         self._pins = {}
         self._devices = {}
+        self._shared_spi_buses = {}
+        self._collect_stats = False
+
+    def enable_stats(self):
+        """
+        Starts collecting usage statistics for every ManagedDevice created by this PinManager,
+        including devices which have already been created.
+        """
+        self._collect_stats = True
+        for device in self._devices.values():
+            if device.stats is None:
+                device.stats = DeviceStats()
+
+    def stats(self):
+        """
+        Returns a snapshot of the usage statistics of every device with statistics enabled.
+
+        The snapshot is a dict mapping a (pins, device type name) tuple for each device to a
+        dict of that device's statistics. See DeviceStats for the statistics collected.
+        """
+        res = {}
+        for (pins, device_type), device in self._devices.items():
+            if device.stats is not None:
+                res[(pins, _device_type_name(device_type))] = device.stats.snapshot()
+        return res
+
+    def format_stats(self):
+        """
+        Returns the statistics snapshot from stats() as a string with one line per device,
+        suitable for printing to the console or including in telemetry.
+        """
+        lines = []
+        for (pins, type_name), snapshot in self.stats().items():
+            lines.append(
+                f"{type_name}{pins}: init={snapshot['inits']} deinit={snapshot['deinits']} "
+                + f"enter={snapshot['entries']} contend={snapshot['contentions']} "
+                + f"held={snapshot['total_hold_ns'] // 1000}us "
+                + f"max={snapshot['max_hold_ns'] // 1000}us"
+            )
+        return "\n".join(lines)
+
+    def acquire(self, device, *, priority=0, timeout=None):
+        """
+        Returns an asynchronous context manager which exclusively holds the specified
+        ManagedDevice for the duration of the context, waiting for contending devices to be
+        released rather than raising a RuntimeError.
+
+        Waiters with a larger priority are served before waiters with a smaller priority, and
+        waiters with equal priority are served first-come first-served. If timeout (in seconds)
+        is not None and elapses before the device can be acquired, asyncio.TimeoutError is
+        raised. A task must not acquire a device which it already holds in a `with` block.
+        """
+        return _DeviceAcquisition(device, priority, timeout)
 
     def _get_pin_reference(self, pin):
         if pin not in self._pins:
@@ -176,11 +393,17 @@ class PinManager:
         return self._pins[pin]
 
     def _create_general_device(self, pins, device_type, device_producer):
-        m_pins = [self._get_pin_reference(pin) for pin in pins]
-        device_key = tuple(m_pins + [device_type])
-        if device_key not in self._devices:
-            self._devices[device_key] = ManagedDevice(m_pins, device_producer)
-        return self._devices[device_key]
+        # pins map one-to-one onto _ManagedPin objects, so the raw pins can key the cache
+        # and the managed pin list only needs to be built when a device is first created
+        device_key = (tuple(pins), device_type)
+        device = self._devices.get(device_key)
+        if device is None:
+            m_pins = tuple(self._get_pin_reference(pin) for pin in pins)
+            device = ManagedDevice(
+                m_pins, device_producer, DeviceStats() if self._collect_stats else None
+            )
+            self._devices[device_key] = device
+        return device
 
     def create_digital_in_out(self, pin):
         """
@@ -204,6 +427,24 @@ class PinManager:
             (lambda: busio.SPI(clock, mosi, miso)),
         )
 
+    def create_spi_bus_device(
+        self, clock, mosi, miso, cs, *, baudrate=100000, polarity=0, phase=0, bits=8
+    ):
+        """
+        Creates and returns a SpiBusDevice for a peripheral selected by the specified
+        chip-select pin on the SPI bus with the three specified pins. The busio.SPI for the
+        bus is shared with all other SpiBusDevices on the same bus, and is configured with the
+        specified settings for the duration of each transaction with this peripheral.
+        """
+        spi = self.create_spi(clock, mosi, miso)
+        if spi not in self._shared_spi_buses:
+            self._shared_spi_buses[spi] = _SharedSpiBus(spi)
+        return SpiBusDevice(
+            self._shared_spi_buses[spi],
+            self.create_digital_in_out(cs),
+            (baudrate, polarity, phase, bits),
+        )
+
     def create_i2c(self, scl, sda, frequency=100000):
         """
         Creates and returns ManagedDevice wrapping a busio.SPI on the two specified pins
@@ -216,21 +457,39 @@ class PinManager:
             (lambda: busio.I2C(scl, sda, frequency=frequency)),
         )
 
-    def create_uart(self, tx, rx, *, baudrate=115200, bits=8, parity=None, stop=1):
+    def create_uart(
+        self,
+        tx,
+        rx,
+        *,
+        baudrate=115200,
+        bits=8,
+        parity=None,
+        stop=1,
+        timeout=1,
+        receiver_buffer_size=64,
+    ):
         """
         Creates and returns ManagedDevice wrapping a busio.UART on the two specified pins
-        with the specified baudrate, bits per byte, parity, and number of stop bits, or returns
-        one from the cache if one has already been created.
+        with the specified baudrate, bits per byte, parity, number of stop bits, read timeout,
+        and receive buffer size, or returns one from the cache if one has already been created.
 
-        Note that baudrate is not used in the device key tuple as it can be reconfigured after
-        initialization.
+        Note that baudrate and timeout are not used in the device key tuple as they can be
+        reconfigured after initialization.
         """
         return self._create_general_device(
             [tx, rx],
-            (busio.UART, bits, parity, stop),
+            (busio.UART, bits, parity, stop, receiver_buffer_size),
             (
                 lambda: busio.UART(
-                    tx, rx, baudrate=baudrate, bits=bits, parity=parity, stop=stop
+                    tx,
+                    rx,
+                    baudrate=baudrate,
+                    bits=bits,
+                    parity=parity,
+                    stop=stop,
+                    timeout=timeout,
+                    receiver_buffer_size=receiver_buffer_size,
                 )
             ),
         )
@@ -245,3 +504,110 @@ class PinManager:
             analogio.AnalogIn,
             (lambda: analogio.AnalogIn(pin)),
         )
+
+
+class _SharedSpiBus:
+    def __init__(self, spi):
+        self.spi = spi
+        self._configured_instance = None
+        self._configuration = None
+
+    def configure(self, instance, configuration):
+        """
+        Configures a locked busio.SPI with the given settings tuple, unless the same instance
+        was most recently configured with identical settings.
+        """
+        if instance is self._configured_instance and configuration == self._configuration:
+            return
+        baudrate, polarity, phase, bits = configuration
+        instance.configure(baudrate=baudrate, polarity=polarity, phase=phase, bits=bits)
+        self._configured_instance = instance
+        self._configuration = configuration
+
+
+class SpiBusDevice:
+    """
+    A chip-selected peripheral on a SPI bus which may be shared with other peripherals.
+    Opening a context on a SpiBusDevice performs one transaction with the peripheral and
+    returns the locked and configured busio.SPI. The bus is only reconfigured if the last
+    transaction on it used different settings, and a bus which is already locked raises a
+    RuntimeError.
+    """
+
+    def __init__(self, shared_bus, cs, configuration):
+        self._bus = shared_bus
+        self.cs = cs
+        self._configuration = configuration
+        self._cs_instance = None
+        self._spi_instance = None
+
+    def _prepare_cs(self, cs_gpio):
+        # a DigitalInOut starts as an input when it is (re)created, so the chip-select pin
+        # only needs to be set up as an output when the underlying instance changes
+        if cs_gpio is not self._cs_instance:
+            cs_gpio.direction = digitalio.Direction.OUTPUT
+            cs_gpio.value = True
+            self._cs_instance = cs_gpio
+
+    def __enter__(self):
+        spi = self._bus.spi.hold()
+        try:
+            cs_gpio = self.cs.hold()
+        except Exception:
+            self._bus.spi.release()
+            raise
+        self._prepare_cs(cs_gpio)
+        if not spi.try_lock():
+            self.cs.release()
+            self._bus.spi.release()
+            raise RuntimeError("Cannot lock SPI bus held by another transaction")
+        self._bus.configure(spi, self._configuration)
+        cs_gpio.value = False
+        self._spi_instance = spi
+        return spi
+
+    def __exit__(self, exc_type, exc, exc_trace):
+        self._cs_instance.value = True
+        self._spi_instance.unlock()
+        self.cs.release()
+        self._bus.spi.release()
+
+
+class _DeviceAcquisition:
+    def __init__(self, device, priority, timeout):
+        self._device = device
+        self._priority = priority
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        device = self._device
+        if device._is_available() and not device._has_waiters():
+            return device.hold()
+        waiter = _PinWaiter(device._managed_pins, self._priority)
+        if device.stats is not None:
+            device.stats.contentions += 1
+        for m_pin in device._managed_pins:
+            m_pin.add_waiter(waiter)
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        try:
+            while not (waiter.is_first() and device._is_available()):
+                waiter.event.clear()
+                if deadline is None:
+                    await waiter.event.wait()
+                else:
+                    await asyncio.wait_for(
+                        waiter.event.wait(), max(0, deadline - time.monotonic())
+                    )
+            return device.hold()
+        finally:
+            for m_pin in device._managed_pins:
+                m_pin.remove_waiter(waiter)
+
+    async def __aexit__(self, exc_type, exc, exc_trace):
+        self._device.release()
+
+
+def _device_type_name(device_type):
+    if isinstance(device_type, tuple):
+        device_type = device_type[0]
+    return getattr(device_type, "__name__", str(device_type))
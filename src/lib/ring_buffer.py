@@ -0,0 +1,196 @@
+"""
+Fixed-capacity ring buffer of numeric samples with running statistics. Pushing a sample and
+querying the statistics of the full buffer take constant time and allocate no memory, so a
+RingBuffer can be updated from a control loop at a high rate.
+"""
+
+import array
+
+
+class _MonotonicDeque:
+    # Circular deque of the buffer slots of samples whose values are monotonic, used to track
+    # the extreme value in a sliding window. `keep_back(back_value, new_value)` returns True
+    # if the sample at the back of the deque should be kept when a new value is appended.
+    def __init__(self, capacity, keep_back):
+        self._indices = array.array("L", [0] * capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._length = 0
+        self._keep_back = keep_back
+
+    def clear(self):
+        """Removes every index from the deque."""
+        self._start = 0
+        self._length = 0
+
+    def front(self):
+        """Returns the slot of the extreme sample in the window."""
+        return self._indices[self._start]
+
+    def push(self, slot, values, value):
+        """Appends the slot of a new sample, given the buffer `values` it is stored in."""
+        capacity = self._capacity
+        # the front is the oldest sample in the deque, and leaves the window when the buffer
+        # wraps onto its slot
+        if self._length and self._indices[self._start] == slot:
+            self._start = (self._start + 1) % capacity
+            self._length -= 1
+        while self._length:
+            back = self._indices[(self._start + self._length - 1) % capacity]
+            if self._keep_back(values[back], value):
+                break
+            self._length -= 1
+        self._indices[(self._start + self._length) % capacity] = slot
+        self._length += 1
+
+
+def _keep_for_max(back_value, new_value):
+    return back_value > new_value
+
+
+def _keep_for_min(back_value, new_value):
+    return back_value < new_value
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of the most recent samples pushed to it, with constant-time running
+    statistics. The running sums are recomputed from the samples once per trip around the
+    buffer, so floating-point error does not accumulate.
+
+    `sample_period` is the time in seconds between consecutive samples, and is only needed
+    for the duration-based window queries. `typecode` is the `array` typecode used to store
+    the samples.
+    """
+
+    def __init__(self, capacity, sample_period=None, typecode="f"):
+        if capacity <= 0:
+            raise ValueError("RingBuffer capacity must be positive")
+        self._values = array.array(typecode, [0] * capacity)
+        self._capacity = capacity
+        self._sample_period = sample_period
+        self._count = 0
+        self._next = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._max_deque = _MonotonicDeque(capacity, _keep_for_max)
+        self._min_deque = _MonotonicDeque(capacity, _keep_for_min)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """The maximum number of samples held by the buffer."""
+        return self._capacity
+
+    def clear(self):
+        """Discards all samples held by the buffer."""
+        self._count = 0
+        self._next = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._max_deque.clear()
+        self._min_deque.clear()
+
+    def push(self, value):
+        """Adds a sample to the buffer, discarding the oldest sample if the buffer is full."""
+        slot = self._next
+        if self._count == self._capacity:
+            old = self._values[slot]
+            self._sum -= old
+            self._sum_sq -= old * old
+        else:
+            self._count += 1
+        self._max_deque.push(slot, self._values, value)
+        self._min_deque.push(slot, self._values, value)
+        self._values[slot] = value
+        # read back the stored value so the sums match what the array holds
+        value = self._values[slot]
+        self._sum += value
+        self._sum_sq += value * value
+        if slot == self._capacity - 1:
+            self._next = 0
+            self._recompute_sums()
+        else:
+            self._next = slot + 1
+
+    def _recompute_sums(self):
+        total = 0.0
+        total_sq = 0.0
+        for value in self._values:
+            total += value
+            total_sq += value * value
+        self._sum = total
+        self._sum_sq = total_sq
+
+    def latest(self):
+        """Returns the most recently pushed sample, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        return self._values[self._next - 1]
+
+    def sum(self):
+        """Returns the sum of the samples in the buffer."""
+        return self._sum
+
+    def mean(self):
+        """Returns the mean of the samples in the buffer, or 0 if the buffer is empty."""
+        count = len(self)
+        return self._sum / count if count else 0
+
+    def variance(self):
+        """Returns the population variance of the samples in the buffer, or 0 if empty."""
+        count = len(self)
+        if count == 0:
+            return 0
+        mean = self._sum / count
+        return max(0.0, self._sum_sq / count - mean * mean)
+
+    def max(self):
+        """Returns the largest sample in the buffer, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        return self._values[self._max_deque.front()]
+
+    def min(self):
+        """Returns the smallest sample in the buffer, or None if the buffer is empty."""
+        if self._count == 0:
+            return None
+        return self._values[self._min_deque.front()]
+
+    def _window_count(self, duration):
+        if self._sample_period is None:
+            raise ValueError("Duration-based queries require a sample period")
+        return min(len(self), int(duration / self._sample_period + 0.5))
+
+    def window_sum(self, duration):
+        """Returns the sum of the samples pushed in the most recent `duration` seconds."""
+        count = self._window_count(duration)
+        capacity = self._capacity
+        total = 0.0
+        for index in range(self._next - count, self._next):
+            total += self._values[index % capacity]
+        return total
+
+    def window_mean(self, duration):
+        """
+        Returns the mean of the samples pushed in the most recent `duration` seconds, or 0 if
+        there are none.
+        """
+        count = self._window_count(duration)
+        return self.window_sum(duration) / count if count else 0
+
+    def window_max(self, duration):
+        """
+        Returns the largest sample pushed in the most recent `duration` seconds, or None if
+        there are none.
+        """
+        count = self._window_count(duration)
+        capacity = self._capacity
+        res = None
+        for index in range(self._next - count, self._next):
+            value = self._values[index % capacity]
+            if res is None or value > res:
+                res = value
+        return res
@@ -0,0 +1,255 @@
+"""
+Compact, delta-encoded telemetry frames for the scalar fields of a datastore. Each field is
+quantized to an integer, and each frame only carries the fields which differ from a reference
+frame the receiver has acknowledged, as variable-length integers.
+"""
+
+import datastore_path
+
+SEQUENCE_MODULUS = 256
+DEFAULT_HISTORY = 8
+DEFAULT_FLOAT_SCALE = 1000
+HEADER_SIZE = 2
+MAX_VARINT_SIZE = 5  # enough for the difference between any two 32-bit values
+_FIXED_POINT_LIMIT = 2**31 - 1
+
+
+def _field_scales(fields, scales):
+    # floats are scaled by the scale of their attribute name, or of their path for list items
+    result = []
+    for path, field, kind in fields:
+        if kind == "f":
+            key = path if isinstance(field, int) else field
+            result.append(scales.get(key, DEFAULT_FLOAT_SCALE))
+        else:
+            result.append(None)
+    return result
+
+
+class _FieldBinding:
+    # Resolves the object holding each field of a datastore once per datastore, and converts
+    # between field values and quantized integers
+    def __init__(self, fields, scales):
+        self.fields = fields
+        self.scales = _field_scales(fields, scales)
+        self._datastore = None
+        self._targets = None
+
+    def targets(self, datastore):
+        """Returns the object holding each field in `datastore`"""
+        if datastore is not self._datastore:
+            self._targets = [datastore_path.resolve(datastore, path) for path, _, _ in self.fields]
+            self._datastore = datastore
+        return self._targets
+
+    def read(self, datastore, values):
+        """Quantizes the fields of `datastore` into `values`"""
+        targets = self.targets(datastore)
+        for i, (_, field, _) in enumerate(self.fields):
+            target = targets[i]
+            value = target[field] if isinstance(field, int) else getattr(target, field)
+            scale = self.scales[i]
+            # infinities and NaN are sent as None
+            if value is None or (scale is not None and value - value != 0):
+                values[i] = None
+            elif scale is not None:
+                value = round(value * scale)
+                values[i] = max(-_FIXED_POINT_LIMIT, min(_FIXED_POINT_LIMIT, value))
+            else:
+                values[i] = int(value)
+
+    def write(self, datastore, values):
+        """Places the quantized `values` into the fields of `datastore`"""
+        targets = self.targets(datastore)
+        for i, (_, field, kind) in enumerate(self.fields):
+            value = values[i]
+            if value is not None:
+                if kind == "f":
+                    value = value / self.scales[i]
+                elif kind == "?":
+                    value = bool(value)
+            if isinstance(field, int):
+                targets[i][field] = value
+            else:
+                setattr(targets[i], field, value)
+
+
+def _write_varint(buffer, offset, value):
+    while value > 0x7F:
+        buffer[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+    buffer[offset] = value
+    return offset + 1
+
+
+def _difference_token(value, reference):
+    if value is None:
+        return 0
+    delta = value - (reference or 0)
+    return (delta << 1) + 1 if delta >= 0 else -delta << 1
+
+
+class _FrameHistory:
+    # Quantized values of the most recent frames, indexed by sequence number
+    def __init__(self, field_count, history):
+        if SEQUENCE_MODULUS % history:
+            raise ValueError("History must divide the sequence number modulus")
+        self.history = history
+        self.values = [[None] * field_count for _ in range(history)]
+        self.sequences = [None] * history
+
+    def slot(self, sequence):
+        """Returns the values stored for `sequence`, whether or not they are valid"""
+        return self.values[sequence % self.history]
+
+    def invalidate(self, sequence):
+        """Marks the slot of `sequence` as holding no valid frame"""
+        self.sequences[sequence % self.history] = None
+
+    def store(self, sequence):
+        """Marks the slot of `sequence` as holding that frame, and returns its values"""
+        self.sequences[sequence % self.history] = sequence
+        return self.values[sequence % self.history]
+
+    def find(self, sequence):
+        """Returns the values of frame `sequence`, or None if it is no longer held"""
+        if self.sequences[sequence % self.history] != sequence:
+            return None
+        return self.values[sequence % self.history]
+
+
+class TelemetryEncoder:
+    """
+    Encodes delta-compressed telemetry frames of the `fields` of a datastore, given as for
+    `DatastoreSnapshot`. `scales` maps attribute names (or, for list items, object paths) to the
+    fixed-point scale of float fields, which otherwise default to `DEFAULT_FLOAT_SCALE`.
+
+    A frame holds its sequence number, the sequence number of its reference frame (its own in a
+    key frame, which is encoded against all zeros), a bitmask of the fields which differ from the
+    reference, and for each of those an unsigned LEB128 integer: zero for None, or one more than
+    the ZigZag-encoded difference. The encoder keeps its last `history` frames, and sends a key
+    frame when none of them has been acknowledged.
+    """
+
+    def __init__(self, fields, scales=None, history=DEFAULT_HISTORY):
+        self.binding = _FieldBinding(fields, scales or {})
+        self.field_count = len(fields)
+        self.mask_size = (self.field_count + 7) // 8
+        self.max_size = HEADER_SIZE + self.mask_size + self.field_count * MAX_VARINT_SIZE
+        self._history = _FrameHistory(self.field_count, history)
+        self._zeros = [None] * self.field_count
+        self._sequence = 0
+        self._acknowledged = None
+
+    def acknowledge(self, sequence):
+        """Records that the receiver has decoded the frame with the given sequence number"""
+        if self._history.find(sequence) is not None:
+            self._acknowledged = sequence
+
+    def reset(self):
+        """Forgets all acknowledgements, so that the next frame is a key frame"""
+        self._acknowledged = None
+
+    def encode_into(self, datastore, buffer, offset=0):
+        """
+        Encodes a frame of the current values in `datastore` into `buffer` at `offset`, which
+        must have room for `max_size` bytes, and returns the size of the frame.
+        """
+        sequence = self._sequence
+        self._sequence = (sequence + 1) % SEQUENCE_MODULUS
+        acknowledged = self._acknowledged
+        if acknowledged is None or (sequence - acknowledged) % SEQUENCE_MODULUS >= (
+            self._history.history
+        ):
+            # the acknowledged frame is about to be overwritten in the history, if it isn't yet
+            self._acknowledged = None
+            reference_sequence = sequence
+            reference = self._zeros
+        else:
+            reference_sequence = acknowledged
+            reference = self._history.slot(acknowledged)
+        values = self._history.store(sequence)
+        self.binding.read(datastore, values)
+
+        buffer[offset] = sequence
+        buffer[offset + 1] = reference_sequence
+        mask_offset = offset + HEADER_SIZE
+        end = mask_offset + self.mask_size
+        for i in range(self.mask_size):
+            buffer[mask_offset + i] = 0
+        for i in range(self.field_count):
+            value = values[i]
+            if value != reference[i]:
+                buffer[mask_offset + (i >> 3)] |= 1 << (i & 7)
+                end = _write_varint(buffer, end, _difference_token(value, reference[i]))
+        return end - offset
+
+
+class TelemetryDecoder:
+    """
+    Decodes frames produced by a TelemetryEncoder with the same `fields`, `scales`, and
+    `history`, placing the values into a datastore.
+    """
+
+    def __init__(self, fields, scales=None, history=DEFAULT_HISTORY):
+        self.binding = _FieldBinding(fields, scales or {})
+        self.field_count = len(fields)
+        self.mask_size = (self.field_count + 7) // 8
+        self._history = _FrameHistory(self.field_count, history)
+        self._zeros = [None] * self.field_count
+        self._position = 0
+
+    def _read_varint(self, buffer):
+        # reads the unsigned LEB128 integer at `_position`, leaving `_position` after it
+        value = 0
+        shift = 0
+        position = self._position
+        while position < len(buffer):
+            byte = buffer[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                self._position = position
+                return value
+            shift += 7
+        raise ValueError("Frame is truncated")
+
+    def decode_from(self, datastore, buffer, offset=0):
+        """
+        Decodes the frame in `buffer` at `offset` into `datastore` and returns its sequence
+        number, which should be acknowledged to the encoder. Raises ValueError if the frame is
+        truncated, or if the frame's reference frame has not been decoded, in which case the
+        encoder must be reset.
+        """
+        mask_offset = offset + HEADER_SIZE
+        if len(buffer) < mask_offset + self.mask_size:
+            raise ValueError("Frame is truncated")
+        sequence = buffer[offset]
+        reference_sequence = buffer[offset + 1]
+        if reference_sequence == sequence:
+            reference = self._zeros
+        else:
+            reference = self._history.find(reference_sequence)
+            if reference is None:
+                raise ValueError(f"Reference frame {reference_sequence} has not been decoded")
+        # the reference may share the slot being written when the history is full
+        values = self._history.slot(sequence)
+        if values is reference:
+            raise ValueError(f"Reference frame {reference_sequence} is too old")
+        self._history.invalidate(sequence)
+        self._position = mask_offset + self.mask_size
+        for i in range(self.field_count):
+            if not buffer[mask_offset + (i >> 3)] & (1 << (i & 7)):
+                values[i] = reference[i]
+                continue
+            token = self._read_varint(buffer)
+            if token == 0:
+                values[i] = None
+            else:
+                token -= 1
+                delta = (token >> 1) if not token & 1 else -((token + 1) >> 1)
+                values[i] = (reference[i] or 0) + delta
+        self._history.store(sequence)
+        self.binding.write(datastore, values)
+        return sequence
@@ -3,46 +3,20 @@ Determine an estimate of the attitude of the RAPID-0 satellite using a
 Multiplicative Extended Kalman Filter (MEKF).
 """
 
-# TODO: Create constants for constant matricies
+try:
+    import ulab.numpy as np  # type: ignore # For CircuitPython
+except ImportError:
+    import numpy as np  # For GitHub Actions / PC testing
 
-import ulab.numpy as np  # type: ignore
-from quaternion import Quaternion
+# longest step over which `propagate_to` integrates the attitude at constant rates
+MAX_STEP_NS = 100000000
 
-class StateEstimate:
-    """
-    Current Estimated State class + covariance as state uncertainty
-
-    q_ref (Quaternion): Body reference quaternion which the calculations are based on. 
-                        The closer ref is to the actual attitude, the less error resulting 
-                        from the MEKF. Assumed starting basis for which w_ref acts on
-    w_ref (np.ndarray): Angular acceleration vector in the body reference from gyroscopes
-    cv_matrix (np.ndarray): [Previously P] 3x3 Covariance matrix (ensure this isn't the 0 
-                             matrix when starting or the filter won't update effectively)
-    """
+# preallocated intermediates of `mekf_update`
+_IDENTITY = np.eye(3)
+_v_pred = np.zeros(3)
+_H = np.zeros((3, 3))
+_skew_rates = np.zeros((3, 3))
 
-    def __init__(self, q_ref, w_ref, cv_matrix):
-        self.q_ref: Quaternion = q_ref
-        self.w_ref: np.ndarray = w_ref
-        self.cv_matrix: np.ndarray = cv_matrix
-
-class SensorMeasurement:
-    """
-    Sensor Measurement class + Noise/bias matrices as sensor uncertainty
-
-    gyro_noise: [previously Q_noise] 3x3 Diagonal matrix representing noise/bias from the 
-                gyro sensor (given as sigma^2 * I_3)
-    measurement_noise: [previously R_meas] 3x3 Diagonal matrix representing noise/bias from 
-                       the measured body vector (given as sigma^2 * I_3)
-    v_body: Measured vector from body frame (from magnetometer or sun sensor)
-    v_inertial: Expected vector measurement at Quaternion(1,0,0,0) orientation
-    
-    """
-
-    def __init__(self, gyro_noise, r_meas, v_body, v_inertial):
-        self.gyro_noise = gyro_noise
-        self.r_meas = r_meas
-        self.v_body = v_body
-        self.v_inertial = v_inertial
 
 def skew(w: np.ndarray):
     """
@@ -53,83 +27,192 @@ def skew(w: np.ndarray):
 
     Returns:
         np.ndarray: 3x3 skew/cross-product matrix
-        [[  0,   w[2], w[1]],
+        [[  0,  -w[2], w[1]],
          [ w[2],  0,  -w[0]],
          [-w[1], w[0],  0 ]]
     """
-    return np.ndarray([[0, -w[2], w[1]], [w[2], 0, -w[0]], [-w[1], w[0], 0]])
+    return skew_into(np.zeros((3, 3)), w)
+
+
+def skew_into(out: np.ndarray, w: np.ndarray, scale=1.0):
+    """Fills the 3x3 matrix `out` with `scale` times the skew matrix of `w`, and returns it"""
+    x = scale * w[0]
+    y = scale * w[1]
+    z = scale * w[2]
+    out[0, 0] = 0.0
+    out[0, 1] = -z
+    out[0, 2] = y
+    out[1, 0] = z
+    out[1, 1] = 0.0
+    out[1, 2] = -x
+    out[2, 0] = -y
+    out[2, 1] = x
+    out[2, 2] = 0.0
+    return out
+
+
+def propagate_quaternion(q: np.ndarray, w: np.ndarray, dt: float):
+    """
+    Advances the [w, x, y, z] quaternion `q` in place by the body rates `w` over `dt`, with
+    q += 0.5 * dt * (Quaternion(0, *w) * q)
+    """
+    qw, qx, qy, qz = q[0], q[1], q[2], q[3]
+    wx, wy, wz = w[0], w[1], w[2]
+    half_dt = 0.5 * dt
+    q[0] = qw + half_dt * (-wx * qx - wy * qy - wz * qz)
+    q[1] = qx + half_dt * (wx * qw + wy * qz - wz * qy)
+    q[2] = qy + half_dt * (-wx * qz + wy * qw + wz * qx)
+    q[3] = qz + half_dt * (wx * qy - wy * qx + wz * qw)
+
+
+def rotate_into(out: np.ndarray, q: np.ndarray, v: np.ndarray):
+    """
+    Fills `out` with the vector `v` rotated by the [w, x, y, z] quaternion `q`, as
+    q * Quaternion(0, *v) * q.conjugate(), and returns it
+    """
+    qw, qx, qy, qz = q[0], q[1], q[2], q[3]
+    vx, vy, vz = v[0], v[1], v[2]
+    aw = -qx * vx - qy * vy - qz * vz
+    ax = qw * vx + qy * vz - qz * vy
+    ay = qw * vy - qx * vz + qz * vx
+    az = qw * vz + qx * vy - qy * vx
+    out[0] = -aw * qx + ax * qw - ay * qz + az * qy
+    out[1] = -aw * qy + ax * qz + ay * qw - az * qx
+    out[2] = -aw * qz - ax * qy + ay * qx + az * qw
+    return out
+
+
+def correct_quaternion(q: np.ndarray, delta_a: np.ndarray):
+    """
+    Applies the small-angle attitude correction `delta_a` to `q` in place, as
+    q = Quaternion(1, *(0.5 * delta_a)) * q, and normalizes it
+    """
+    qw, qx, qy, qz = q[0], q[1], q[2], q[3]
+    dx, dy, dz = 0.5 * delta_a[0], 0.5 * delta_a[1], 0.5 * delta_a[2]
+    w = qw - dx * qx - dy * qy - dz * qz
+    x = qx + dx * qw + dy * qz - dz * qy
+    y = qy - dx * qz + dy * qw + dz * qx
+    z = qz + dx * qy - dy * qx + dz * qw
+    norm = (w * w + x * x + y * y + z * z) ** 0.5
+    if norm == 0:
+        # Prevent divison by zero
+        w, x, y, z, norm = 1.0, 0.0, 0.0, 0.0, 1.0
+    q[0] = w / norm
+    q[1] = x / norm
+    q[2] = y / norm
+    q[3] = z / norm
+
 
 # pylint: disable=invalid-name
-def mekf_update(
-    state: StateEstimate,
-    measurement: SensorMeasurement,
-    dt: float,
-) -> Quaternion:
+def mekf_propagate(attitude, dt: float):
     """
-    Calculates the attitude using a Multiplicative Extended Kalman Filter (MEKF) based on:
+    Propagates the attitude quaternion and covariance in place over `dt` seconds at the body
+    rates in `attitude.rates`, following
     'Multiplicative vs. Additive Filtering for Spacecraft Attitude Determination' (Markley, 2003)
+    """
+
+    # Equation (9) from Markley paper
+    propagate_quaternion(attitude.quaternion, attitude.rates, dt)
+
+    # Equation (14) from Markley paper
+    F_a = skew_into(_skew_rates, attitude.rates, -1.0)
+    # Equation (21) from Markley paper without the measurement term, which is applied
+    # discretely by `mekf_correct`, and with G as the identity matrix
+    # Remember that the negative of skew is the transpose of the matrix
+    P = attitude.covariance
+    P += (np.dot(F_a, P) + np.dot(P, -F_a) + attitude.gyro_noise) * dt
+
+
+def propagate_to(attitude, gyroscope, time_ns: int):
+    """
+    Propagates the attitude from its time `attitude.updated_ns` to the `time.monotonic_ns()`
+    time `time_ns`, using the samples of the gyroscope in between. The interval is split at
+    each gyroscope sample, and at most every `MAX_STEP_NS`, and each part is propagated at the
+    rates interpolated at its middle.
+    If the gyroscope has no samples the attitude is left as it is. Sets `attitude.updated_ns`.
 
     Args:
-        state (StateEstimate): Current state, encapsulates state q, angular acceleration, and
-                               3x3 covariance matrix as uncertainty
-        measurement (SensorMeasurement): Measurement object, encapsulates measurements and their 
-                                         3x3 noise matrices
-        dt (float): Amount of time that has passed since a new estimate for q_ref has been made (ms)
+        attitude (AttitudeState): Current state from the ADCS datastore, updated in place
+        gyroscope (SensorSamples): Time-tagged samples of the body angular rates
+        time_ns (int): Time to propagate to, which must not be before `attitude.updated_ns`
+    """
+    start_ns = attitude.updated_ns
+    if start_ns is None:
+        start_ns = time_ns
+    while start_ns < time_ns:
+        end_ns = gyroscope.next_time_ns(start_ns)
+        if end_ns is None or end_ns > time_ns:
+            end_ns = time_ns
+        if end_ns - start_ns > MAX_STEP_NS:
+            end_ns = start_ns + MAX_STEP_NS
+        if gyroscope.interpolate_into(attitude.rates, (start_ns + end_ns) // 2):
+            mekf_propagate(attitude, (end_ns - start_ns) * 1e-9)
+        start_ns = end_ns
+    attitude.updated_ns = time_ns
+
+
+def mekf_correct(attitude, v_body: np.ndarray, v_inertial: np.ndarray):
+    """
+    Corrects the attitude quaternion and covariance in place with a vector measurement taken at
+    the attitude's time, following
+    'Multiplicative vs. Additive Filtering for Spacecraft Attitude Determination' (Markley, 2003)
 
-    Returns:
-        Quaternion: The estimated attitude Quaternion from the body frame to the inertial frame
+    Args:
+        attitude (AttitudeState): Current state from the ADCS datastore, updated in place
+        v_body (np.ndarray): Measured vector in the body frame (from magnetometer or sun sensor)
+        v_inertial (np.ndarray): Expected vector measurement at Quaternion(1,0,0,0) orientation
     """
 
     # Renaming long variables
-    P = state.cv_matrix
+    q = attitude.quaternion
+    P = attitude.covariance
+    R = attitude.measurement_noise
 
-    # Step 1: Calculate expected quaternion from kinematics
-    # Equation (9) from Markley paper
-    omega_q = Quaternion(0.0, *state.w_ref)
-    state.q_ref += 0.5 * dt * (omega_q * state.q_ref)
-
-    # Step 2: Predict measured vector
+    # Predict measured vector
     # Equation (18) from Markley paper
-    v_pred = state.q_ref.rotate_vector(measurement.v_inertial)
+    v_pred = rotate_into(_v_pred, q, v_inertial)
 
-    # Step 3: Measurement matrix (Jacobian)
+    # Measurement matrix (Jacobian)
     # Equation (19) from Markley paper
-    H = skew(v_pred)
-
-    # Step 4: Calculate covariance matrix
-    # Equation (14) from Markley paper
-    F_a = -skew(state.w_ref)
-    G = np.eye(3)
-    # Equation (21) from Markley paper
-    P += (
-        np.dot(F_a, P)
-        + np.dot(P, -F_a)
-        + np.dot(G, np.dot(measurement.gyro_noise, G))
-        - np.dot(P, np.dot(-H, np.dot(np.linalg.inv(measurement.r_meas), np.dot(H, P))))
-    ) * dt
-    # If G is just identity matrix, can reduce dot operations
-    # Remember that the negative of skew is the transpose of the matrix
+    H = skew_into(_H, v_pred)
 
     # TODO: Double check this part and following parts are right
-    # Step 5: Kalman Gain
+    # Kalman Gain
     # Equation (22) from Markley paper(?)
-    S = np.dot(H, np.dot(P, -H)) + measurement.r_meas
+    S = np.dot(H, np.dot(P, -H)) + R
     K = np.dot(
         P, np.dot(-H, np.linalg.inv(S))
     )  # TODO: Calculating the inverse matrix can result in singularities, should check
 
-    # Step 6: Delta_a calculation
-    v_perp = measurement.v_body - v_pred
+    # Delta_a calculation
+    v_perp = v_body - v_pred
     delta_a = np.dot(K, v_perp)  # 3x1 correction vector a
 
-    # Step 7: Covariance update
-    I = np.eye(3)
-    P = np.dot(I - np.dot(K, H), P)
+    # Covariance update, in place
+    P[:] = np.dot(_IDENTITY - np.dot(K, H), P)
 
-    # Step 8: Apply attitude correction using small-angle approximation
+    # Apply attitude correction using small-angle approximation
     # Equation (6) and (7) from Markley paper
-    dq = Quaternion(1.0, *(0.5 * delta_a))
-    state.q_ref = dq * state.q_ref
-    state.q_ref.normalize()
+    correct_quaternion(q, delta_a)
 
-    return state.q_ref
+
+def mekf_update(attitude, v_body: np.ndarray, v_inertial: np.ndarray, dt: float):
+    """
+    Updates the attitude using a Multiplicative Extended Kalman Filter (MEKF), propagating it
+    over `dt` seconds at `attitude.rates` with `mekf_propagate` and then correcting it with a
+    vector measurement with `mekf_correct`.
+
+    Args:
+        attitude (AttitudeState): Current state from the ADCS datastore, whose quaternion (the
+                                  reference attitude from the body frame to the inertial frame)
+                                  and 3x3 covariance matrix are updated in place. Its rates
+                                  are the body angular rates from the gyroscope, and its noise
+                                  matrices are the gyro noise (sigma^2 * I_3) and the noise of
+                                  the measured body vector (sigma^2 * I_3)
+        v_body (np.ndarray): Measured vector in the body frame (from magnetometer or sun sensor)
+        v_inertial (np.ndarray): Expected vector measurement at Quaternion(1,0,0,0) orientation
+        dt (float): Amount of time that has passed since a new estimate for the attitude has
+                    been made
+    """
+    mekf_propagate(attitude, dt)
+    mekf_correct(attitude, v_body, v_inertial)
@@ -2,28 +2,40 @@
 Module for ADCS to run nominal operations.
 """
 
+import math
+import time
+
+try:
+    import ulab.numpy as np  # For CircuitPython
+except ImportError:
+    import numpy as np  # For GitHub Actions / PC testing
+
 import triad as t
 import mekf as kf
 
 import datastore as ds
 
+# preallocated body vectors looked up from the sensor samples
+_sun = np.zeros(3)
+_magnetometer = np.zeros(3)
+
 def get_current_time():
     """
-    Placeholder function for getting the current time on satellite
+    Returns the current time on the satellite as `time.monotonic_ns()`, the time base in which
+    sensor samples are tagged
     """
 
-    return 0
+    return time.monotonic_ns()
 
-def get_sensor_data() -> tuple[float, ...]:
+def get_sensor_data(sensor: ds.SensorData):  # pylint: disable=unused-argument
     """
-    Polls sun sensor, magnetometer, and model data for sun and geomagnetic data;
-    Polls gyro for angular acceleration
-    Returns a tuple of 5 floats with the organisation:
-    [sun_sensor, sun_model, magnetometer, mag_model, gyro_alpha]
+    Polls model data for sun and geomagnetic data
+    Placeholder which should write the model vectors into the preallocated vectors of `sensor`
+    in place. The sun sensor, magnetometer, and gyro are each sampled by their own task at their
+    own rate, and record each sample with the time it was taken into their `SensorSamples`.
+    A sensor which is unavailable records no samples.
     """
 
-    return [0,0,0,0,0]
-
 def nominal_tasks(datastore: ds.Datastore):
     """
     Highest level nominal loop logic
@@ -31,63 +43,97 @@ def nominal_tasks(datastore: ds.Datastore):
 
     datastore.time.current_time = get_current_time()
 
-    diff = datastore.time.current_time - datastore.time.last_cdh_update
-    if diff > datastore.time.update_interval:
+    last_update = datastore.time.last_cdh_update
+    if last_update is None or (
+        (datastore.time.current_time - last_update) * 1e-9 > datastore.time.update_interval
+    ):
         update_attitude(datastore)
 
         datastore.time.last_cdh_update = datastore.time.current_time
 
-def update_attitude(datastore: ds.Datastore):
+def initialize_attitude(sensor: ds.SensorData, attitude: ds.AttitudeState):
     """
-    Using data from sensors and TRIAD algorithm
-    calculates and processes attitude to update datastore values
+    Determines the attitude with the TRIAD algorithm from sun sensor and magnetometer samples
+    aligned to the time of the older of the two latest samples, and sets it with that time
     """
 
-    [s_data, s_model,
-     mag_data, mag_model,
-     alpha] = get_sensor_data()
-
-    # sun data is preferred, will be overriden with mag data if not available
-    p_data = s_data
-
-    # if sun sensor is unavailable, transition to magnetometer, keep using old quaternion
-    if s_data is None:
-        p_data = mag_data
-
-        # no quaternion update (?) TODO for operations?
-        datastore.quaternion = datastore.quaternion
-    else:
-        # IFF sun sensor can be used, use TRIAD algorithm to determine
-        # attitude from sensor + model data
-        [triad_q, msg] = t.triad_algorithm(s_model, mag_model, s_data, mag_data)
-
-        match msg:
-            case t.SUCCESS: # success
-                datastore.quaternion = triad_q
-            case t.ANTI_PARALLEL: # anti-parallel
-                pass
-            case t.COLLINEAR: # FAIL : Colinear
-                pass
-            case t.SINGULAR: # FAIL : Singular (insufficient data)
-                pass
-            case t.NORM_ERR: # FAIL : Normalisation error (div by 0)
-                pass
-            case _: # catch None or weird case
-                pass
-
-    # Pulling state and measurement variable grouping objects from datastore
-    state: kf.StateEstimate = kf.StateEstimate(
-        datastore.quaternion,
-        alpha,
-        datastore.CV_MATRIX
-    )
+    if sensor.sun.time_ns is None or sensor.magnetometer.time_ns is None:
+        return
+    time_ns = min(sensor.sun.time_ns, sensor.magnetometer.time_ns)
+    sensor.sun.interpolate_into(_sun, time_ns)
+    sensor.magnetometer.interpolate_into(_magnetometer, time_ns)
 
-    measurement: kf.SensorMeasurement = kf.SensorMeasurement(
-        datastore.GYRO_NOISE,
-        datastore.MEAS_NOISE,
-        p_data,
-        datastore.v_inertial, # not sure how this will be implemented
+    # Use TRIAD algorithm to determine attitude from sensor + model data
+    [triad_q, msg] = t.triad_algorithm(
+        sensor.sun_model, sensor.magnetometer_model, _sun, _magnetometer
     )
 
-    # Clean, update data with MEKF
-    datastore.quaternion = kf.mekf_update(state, measurement, datastore.dt)
+    match msg:
+        case t.SUCCESS: # success
+            attitude.set_quaternion(triad_q.w, triad_q.x, triad_q.y, triad_q.z)
+            attitude.updated_ns = time_ns
+        case t.ANTI_PARALLEL: # anti-parallel
+            pass
+        case t.COLLINEAR: # FAIL : Colinear
+            pass
+        case t.SINGULAR: # FAIL : Singular (insufficient data)
+            pass
+        case t.NORM_ERR: # FAIL : Normalisation error (div by 0)
+            pass
+        case _: # catch None or weird case
+            pass
+
+def next_measurement_time(sensor: ds.SensorData, after_ns: int):
+    """
+    Returns the time of the earliest sun sensor or magnetometer sample taken after `after_ns`,
+    or None if there is none
+    """
+
+    sun_ns = sensor.sun.next_time_ns(after_ns)
+    magnetometer_ns = sensor.magnetometer.next_time_ns(after_ns)
+    if sun_ns is None or (magnetometer_ns is not None and magnetometer_ns < sun_ns):
+        return magnetometer_ns
+    return sun_ns
+
+def apply_measurement(attitude, samples, model, vector, time_ns: int):
+    """
+    Corrects the attitude with the sample of `samples` taken at `time_ns`, read into `vector`,
+    if there is one and its `model` vector is known
+    """
+
+    if samples.next_time_ns(time_ns - 1) != time_ns or math.isnan(model[0]):
+        return
+    samples.interpolate_into(vector, time_ns)
+    kf.mekf_correct(attitude, vector, model)
+
+def update_attitude(datastore: ds.Datastore):
+    """
+    Using data from sensors and TRIAD algorithm
+    calculates and processes attitude to update datastore values in place
+
+    Every sun sensor and magnetometer sample taken since the attitude's time is applied to the
+    MEKF in time order: the attitude is propagated with the gyro samples to the time of the
+    measurement, and then corrected with it. Samples taken before the attitude's time are not
+    used.
+    """
+
+    sensor = datastore.sensor
+    attitude = datastore.attitude
+    get_sensor_data(sensor)
+
+    if not attitude.valid:
+        initialize_attitude(sensor, attitude)
+        if not attitude.valid:
+            return
+
+    while True:
+        time_ns = next_measurement_time(sensor, attitude.updated_ns)
+        if time_ns is None:
+            break
+
+        # Clean, update data with MEKF, which updates the attitude in place
+        kf.propagate_to(attitude, sensor.gyroscope, time_ns)
+        apply_measurement(attitude, sensor.sun, sensor.sun_model, _sun, time_ns)
+        apply_measurement(
+            attitude, sensor.magnetometer, sensor.magnetometer_model, _magnetometer, time_ns
+        )
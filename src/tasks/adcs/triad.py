@@ -2,7 +2,10 @@
 Determines the attitude of the RAPID-0 satellite with two vectors from sensors.
 """
 
-import ulab.numpy as np
+try:
+    import ulab.numpy as np  # For CircuitPython
+except ImportError:
+    import numpy as np  # For GitHub Actions / PC testing
 from quaternion import Quaternion
 
 # Status codes for each case
@@ -0,0 +1,434 @@
+"""
+Module to move large objects, such as camera images and flash logs, from a node to CDH over the
+inter-subsystem RS485 bus. CDH pulls each object from the node's BulkSender with a
+BulkReceiver, one window of chunks at a time. The node answers each request with a burst of
+back-to-back frames, and only the chunks which were lost are requested again.
+"""
+
+import time
+import struct
+import asyncio
+
+from inter_subsystem_rs485 import (
+    HEADER_SIZE,
+    REPLY_FLAG,
+    MessageId,
+    Status,
+)
+
+WINDOW_SIZE = 16
+CHUNK_HEADER_SIZE = 4  # object ID, chunk index, frames left in the burst
+MAX_CHUNKS = 0x10000
+DEFAULT_TIMEOUT_S = 0.05
+REPLY_POLL_PERIOD_S = 0.0005
+MAX_IDLE_EXCHANGES = 5
+
+_INFO_FORMAT = "<BIIB"  # BULK_INFO reply: object ID, size, tag, chunk size
+_READ_FORMAT = "<BHH"  # BULK_READ request: object ID, first chunk, bitmap of the chunks needed
+_PROGRESS_MAGIC = 0xB7
+_PROGRESS_FORMAT = "<BBBIII"  # the next chunk reaches MAX_CHUNKS once a transfer completes
+PROGRESS_SIZE = struct.calcsize(_PROGRESS_FORMAT)
+
+
+class FlashRegion:
+    """
+    `size` bytes of `flash` starting at `address`, as a source or sink of a transfer. The flash
+    is accessed through the same interface as for a `flash_log.FlashLog`, and the region must
+    be erased before it is written.
+    """
+
+    def __init__(self, flash, address, size):
+        self.flash = flash
+        self.address = address
+        self.size = size
+
+    def erase(self):
+        """Erases every block holding part of the region"""
+        block_size = self.flash.block_size
+        for block in range(
+            self.address // block_size, (self.address + self.size - 1) // block_size + 1
+        ):
+            self.flash.erase(block)
+
+    def readinto(self, offset, buffer):
+        """Reads `len(buffer)` bytes from `offset` in the region into `buffer`"""
+        self.flash.read(self.address + offset, buffer)
+
+    def write(self, offset, data):
+        """Programs `data` at `offset` in the region, one page at a time"""
+        page_size = self.flash.page_size
+        address = self.address + offset
+        position = 0
+        while position < len(data):
+            count = min(len(data) - position, page_size - address % page_size)
+            self.flash.program(address, data[position : position + count])
+            address += count
+            position += count
+
+
+class MemoryRegion:
+    """A bytearray (or other writable buffer) as a source or sink of a transfer"""
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        self.size = len(buffer)
+
+    def readinto(self, offset, buffer):
+        """Copies `len(buffer)` bytes from `offset` in the region into `buffer`"""
+        buffer[:] = self.buffer[offset : offset + len(buffer)]
+
+    def write(self, offset, data):
+        """Copies `data` to `offset` in the region"""
+        self.buffer[offset : offset + len(data)] = data
+
+
+class TransferProgress:
+    """
+    The progress of a transfer, stored in the `nvm` bytearray (such as `microcontroller.nvm`)
+    at `offset` so that it survives a reset.
+    """
+
+    def __init__(self, nvm, offset=0):
+        self.nvm = nvm
+        self.offset = offset
+
+    def load(self, address, object_id, size, tag):
+        """
+        Returns the index of the first chunk not yet received of the object with the given
+        `size` and `tag`, or 0 if the stored progress is for a different object.
+        """
+        fields = struct.unpack(
+            _PROGRESS_FORMAT, bytes(self.nvm[self.offset : self.offset + PROGRESS_SIZE])
+        )
+        if fields[:5] != (_PROGRESS_MAGIC, address, object_id, size, tag):
+            return 0
+        return fields[5]
+
+    def save(self, address, object_id, size, tag, next_chunk):
+        """Stores the index of the first chunk not yet received of an object"""
+        self.nvm[self.offset : self.offset + PROGRESS_SIZE] = struct.pack(
+            _PROGRESS_FORMAT, _PROGRESS_MAGIC, address, object_id, size, tag, next_chunk
+        )
+
+
+def chunk_size_for(link):
+    """Returns the number of bytes of an object carried by each frame on `link`"""
+    # the chunk size is sent in a single byte
+    return min(0xFF, link.max_payload - HEADER_SIZE - CHUNK_HEADER_SIZE)
+
+
+class BulkSender:
+    """
+    Answers bulk transfer requests for the node at `address` on `link`. Requests are passed to
+    `handle()` by the node's frame handler, and the bursts of chunks they ask for are sent by
+    `send_burst()`, which the node's task should await after each poll of the link.
+    """
+
+    def __init__(self, link, address):
+        self.link = link
+        self.address = address
+        self.chunk_size = chunk_size_for(link)
+        self.objects = {}
+        self.chunks_sent = 0
+        data_start = HEADER_SIZE + CHUNK_HEADER_SIZE
+        self._data = link.tx_payload[data_start : data_start + self.chunk_size]
+        self._burst_id = None
+        self._burst_first = 0
+        self._burst_missing = 0
+        self._burst_bit = 0
+        self._burst_remaining = 0
+
+    def offer(self, object_id, source, tag=0):
+        """
+        Offers `source`, which has a `size` and a `readinto(offset, buffer)` method, as the object
+        with the given ID (0-255). The `tag`, such as a capture time, identifies its version.
+        """
+        if source.size > MAX_CHUNKS * self.chunk_size:
+            raise ValueError("Object is too large to transfer")
+        self.objects[object_id] = (source, tag)
+
+    def withdraw(self, object_id):
+        """Stops offering an object, abandoning any burst of it in progress"""
+        self.objects.pop(object_id, None)
+        if self._burst_id == object_id:
+            self._burst_missing = 0
+
+    @property
+    def burst_pending(self):
+        """True if chunks requested by the most recent `BULK_READ` are still to be sent"""
+        return self._burst_missing != 0
+
+    def handle(self, payload):
+        """
+        Answers `payload` if it is a bulk transfer request for this node, and returns whether
+        it was one.
+        """
+        if len(payload) < HEADER_SIZE or payload[0] != self.address:
+            return False
+        message_id = payload[1]
+        if message_id == MessageId.BULK_INFO:
+            if len(payload) != HEADER_SIZE + 1:
+                self._nack(message_id, Status.BAD_LENGTH)
+            elif payload[HEADER_SIZE] not in self.objects:
+                self._nack(message_id, Status.BAD_VALUE)
+            else:
+                object_id = payload[HEADER_SIZE]
+                source, tag = self.objects[object_id]
+                tx = self.link.tx_payload
+                tx[0] = self.address
+                tx[1] = MessageId.BULK_INFO | REPLY_FLAG
+                struct.pack_into(
+                    _INFO_FORMAT, tx, HEADER_SIZE, object_id, source.size, tag, self.chunk_size
+                )
+                self.link.queue_frame(
+                    self.link.encode_prepared(HEADER_SIZE + struct.calcsize(_INFO_FORMAT))
+                )
+            return True
+        if message_id == MessageId.BULK_READ:
+            self._start_burst(payload)
+            return True
+        return False
+
+    def _nack(self, message_id, status):
+        self.link.queue_frame(
+            self.link.encode(bytes([self.address, MessageId.NACK, message_id, status]))
+        )
+
+    def _start_burst(self, payload):
+        # a new request replaces any burst still in progress, whose request must have timed out
+        self._burst_missing = 0
+        if len(payload) != HEADER_SIZE + struct.calcsize(_READ_FORMAT):
+            self._nack(MessageId.BULK_READ, Status.BAD_LENGTH)
+            return
+        object_id, first, missing = struct.unpack_from(_READ_FORMAT, payload, HEADER_SIZE)
+        if object_id not in self.objects:
+            self._nack(MessageId.BULK_READ, Status.BAD_VALUE)
+            return
+        source = self.objects[object_id][0]
+        chunk_count = -(-source.size // self.chunk_size)
+        if chunk_count < WINDOW_SIZE + first:
+            missing &= (1 << max(0, chunk_count - first)) - 1
+        if not missing:
+            self._nack(MessageId.BULK_READ, Status.BAD_VALUE)
+            return
+        remaining = 0
+        for bit in range(WINDOW_SIZE):
+            if missing & (1 << bit):
+                remaining += 1
+        self._burst_id = object_id
+        self._burst_first = first
+        self._burst_missing = missing
+        self._burst_bit = 0
+        self._burst_remaining = remaining
+
+    async def send_chunk(self):
+        """Sends the next chunk of the burst in progress, returning False if there was none"""
+        if not self._burst_missing:
+            return False
+        while not self._burst_missing & (1 << self._burst_bit):
+            self._burst_bit += 1
+        self._burst_missing &= ~(1 << self._burst_bit)
+        self._burst_remaining -= 1
+        index = self._burst_first + self._burst_bit
+        source = self.objects[self._burst_id][0]
+        offset = index * self.chunk_size
+        count = min(self.chunk_size, source.size - offset)
+        tx = self.link.tx_payload
+        tx[0] = self.address
+        tx[1] = MessageId.BULK_READ | REPLY_FLAG
+        tx[2] = self._burst_id
+        tx[3] = index & 0xFF
+        tx[4] = index >> 8
+        tx[5] = self._burst_remaining
+        # the chunk is read straight into the link's transmit buffer
+        source.readinto(offset, self._data if count == self.chunk_size else self._data[:count])
+        await self.link.send_prepared(HEADER_SIZE + CHUNK_HEADER_SIZE + count)
+        self.chunks_sent += 1
+        return True
+
+    async def send_burst(self):
+        """
+        Sends any reply queued by `handle()`, then the rest of the burst in progress, yielding to
+        other tasks between chunks
+        """
+        await self.link.flush()
+        while await self.send_chunk():
+            await asyncio.sleep(0)
+
+
+class TransferStats:
+    """Counters for a BulkReceiver"""
+
+    def __init__(self):
+        self.requests = 0
+        self.chunks_received = 0
+        self.duplicate_chunks = 0
+        self.timeouts = 0
+        self.bytes_received = 0
+
+
+class BulkReceiver:
+    """
+    Pulls the object with `object_id` from the node at `address` into `sink`, which has a
+    `write(offset, data)` method. Each call to `exchange()` sends one request and handles its
+    reply, until the transfer is `done`. If `progress` is a TransferProgress, the transfer
+    resumes from the progress stored in it, provided the object's size and tag are unchanged.
+
+    The transfer `failed` if the node NACKs a request, in which case `status` holds the
+    `Status` of the NACK, or if `MAX_IDLE_EXCHANGES` exchanges in a row receive nothing new.
+    """
+
+    def __init__(
+        self, address, object_id, sink, *, progress=None, timeout_s=DEFAULT_TIMEOUT_S
+    ):
+        self.address = address
+        self.object_id = object_id
+        self.sink = sink
+        self.progress = progress
+        self.timeout_ns = int(timeout_s * 1e9)
+        self.size = None
+        self.tag = None
+        self.chunk_size = None
+        self.chunk_count = None
+        self.next_chunk = 0  # every chunk before this one has been received
+        self.done = False
+        self.failed = False
+        self.status = None
+        self.stats = TransferStats()
+        self._received = 0  # bit `i` is set if chunk `next_chunk + i` has been received
+        self._request = bytearray(HEADER_SIZE + struct.calcsize(_READ_FORMAT))
+        self._request_view = memoryview(self._request)
+        self._burst_done = False
+        self._new_chunks = 0
+        self._idle_exchanges = 0
+        self._frame_timeout_ns = self.timeout_ns
+
+    def _window_missing(self):
+        # bitmap of the chunks of the current window which are still needed
+        count = min(WINDOW_SIZE, self.chunk_count - self.next_chunk)
+        return ((1 << count) - 1) & ~self._received
+
+    async def exchange(self, link):
+        """
+        Sends the next request of the transfer on `link`, and receives its reply or burst of
+        chunks, until the burst is complete or the node stops sending.
+        """
+        if self.done or self.failed:
+            return
+        link.poll(self._on_frame)
+        self._request[0] = self.address
+        if self.size is None:
+            self._request[1] = MessageId.BULK_INFO
+            self._request[HEADER_SIZE] = self.object_id
+            length = HEADER_SIZE + 1
+        else:
+            self._request[1] = MessageId.BULK_READ
+            struct.pack_into(
+                _READ_FORMAT,
+                self._request,
+                HEADER_SIZE,
+                self.object_id,
+                self.next_chunk,
+                self._window_missing(),
+            )
+            length = len(self._request)
+        self._burst_done = False
+        self._new_chunks = 0
+        await link.send(self._request_view[:length])
+        self.stats.requests += 1
+        # the node may yield to other tasks between the frames of a burst, so the timeout is
+        # restarted by each frame received
+        self._frame_timeout_ns = self.timeout_ns + link.byte_time_ns * (link.max_payload + 8)
+        deadline_ns = time.monotonic_ns() + self.timeout_ns
+        while True:
+            received = link.poll(self._on_frame)
+            if self._burst_done:
+                break
+            now_ns = time.monotonic_ns()
+            if received:
+                deadline_ns = now_ns + self._frame_timeout_ns
+            elif now_ns >= deadline_ns:
+                self.stats.timeouts += 1
+                break
+            await asyncio.sleep(REPLY_POLL_PERIOD_S)
+        self._advance()
+
+    def _advance(self):
+        # moves the window past the chunks received in order, and records the progress
+        start = self.next_chunk
+        while self._received & 1:
+            self._received >>= 1
+            self.next_chunk += 1
+        if self.chunk_count is not None and self.next_chunk >= self.chunk_count:
+            self.done = True
+        if self.progress is not None and self.next_chunk != start:
+            self.progress.save(
+                self.address, self.object_id, self.size, self.tag, self.next_chunk
+            )
+        if self._new_chunks or self.done:
+            self._idle_exchanges = 0
+        else:
+            self._idle_exchanges += 1
+            if self._idle_exchanges >= MAX_IDLE_EXCHANGES:
+                self.failed = True
+
+    def _on_frame(self, payload):
+        if len(payload) < HEADER_SIZE + 1 or payload[0] != self.address:
+            return
+        message_id = payload[1]
+        if message_id == MessageId.BULK_READ | REPLY_FLAG:
+            self._on_chunk(payload)
+        elif message_id == MessageId.BULK_INFO | REPLY_FLAG:
+            self._on_info(payload)
+        elif message_id == MessageId.NACK and payload[HEADER_SIZE] in (
+            MessageId.BULK_INFO,
+            MessageId.BULK_READ,
+        ):
+            self.failed = True
+            self.status = payload[HEADER_SIZE + 1] if len(payload) > HEADER_SIZE + 1 else None
+            self._burst_done = True
+
+    def _on_info(self, payload):
+        if self.size is not None or len(payload) != HEADER_SIZE + struct.calcsize(
+            _INFO_FORMAT
+        ):
+            return
+        object_id, size, tag, chunk_size = struct.unpack_from(_INFO_FORMAT, payload, HEADER_SIZE)
+        if object_id != self.object_id or chunk_size == 0:
+            return
+        self.size = size
+        self.tag = tag
+        self.chunk_size = chunk_size
+        self.chunk_count = -(-size // chunk_size)
+        if self.progress is not None:
+            self.next_chunk = min(
+                self.progress.load(self.address, object_id, size, tag), self.chunk_count
+            )
+        self._new_chunks += 1
+        self._burst_done = True
+
+    def _on_chunk(self, payload):
+        if self.size is None or len(payload) < HEADER_SIZE + CHUNK_HEADER_SIZE:
+            return
+        if payload[2] != self.object_id:
+            return
+        index = payload[3] | (payload[4] << 8)
+        if payload[5] == 0:
+            self._burst_done = True
+        bit = index - self.next_chunk
+        offset = index * self.chunk_size
+        data = payload[HEADER_SIZE + CHUNK_HEADER_SIZE :]
+        if (
+            not 0 <= bit < WINDOW_SIZE
+            or index >= self.chunk_count
+            or len(data) != min(self.chunk_size, self.size - offset)
+        ):
+            return
+        if self._received & (1 << bit):
+            self.stats.duplicate_chunks += 1
+            return
+        self.sink.write(offset, data)
+        self._received |= 1 << bit
+        self._new_chunks += 1
+        self.stats.chunks_received += 1
+        self.stats.bytes_received += len(data)
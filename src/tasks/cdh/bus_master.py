@@ -0,0 +1,264 @@
+"""
+Module to poll the other subsystems from CDH over the multi-drop inter-subsystem RS485 bus. CDH
+sends each request to a single node and waits for its reply, following a schedule of periodic
+requests, and retries requests which time out within a budget for each node.
+"""
+
+import time
+import asyncio
+
+from loop_monitor import LoopMonitor
+from ring_buffer import RingBuffer
+from inter_subsystem_rs485 import (
+    HEADER_SIZE,
+    REPLY_FLAG,
+    MessageId,
+    Rs485Link,
+)
+
+# TODO: Tune these against the turnaround times of the flight subsystems
+DEFAULT_TIMEOUT_S = 0.05
+DEFAULT_RETRY_BUDGET = 10  # retries per RETRY_BUDGET_WINDOW_S
+MAX_RETRIES_PER_REQUEST = 2
+RETRY_BUDGET_WINDOW_S = 10
+OFFLINE_AFTER_FAILURES = 3
+OFFLINE_POLL_PERIOD_S = 5
+REPLY_POLL_PERIOD_S = 0.0005
+LATENCY_HISTORY = 64
+
+
+class NodeStats:
+    """
+    Counters for the requests sent to a single node, and the round-trip latency of its most
+    recent `LATENCY_HISTORY` replies in microseconds.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.replies = 0
+        self.nacks = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_us = RingBuffer(LATENCY_HISTORY, typecode="L")
+
+
+class Node:
+    """
+    A node on the bus at `address`. Requests to the node time out after `timeout_s` seconds,
+    and up to `retry_budget` retries are allowed every `RETRY_BUDGET_WINDOW_S` seconds.
+    """
+
+    def __init__(
+        self, name, address, *, timeout_s=DEFAULT_TIMEOUT_S, retry_budget=DEFAULT_RETRY_BUDGET
+    ):
+        self.name = name
+        self.address = address
+        self.timeout_ns = int(timeout_s * 1e9)
+        self.retry_budget = retry_budget
+        self.retry_tokens = retry_budget
+        self.consecutive_failures = 0
+        self.stats = NodeStats()
+        self._refilled_ns = None
+
+    @property
+    def online(self):
+        """False if the node has failed to answer `OFFLINE_AFTER_FAILURES` requests in a row"""
+        return self.consecutive_failures < OFFLINE_AFTER_FAILURES
+
+    def take_retry(self, now_ns):
+        """Spends one retry from the node's budget, returning False if none are left"""
+        if self._refilled_ns is None:
+            self._refilled_ns = now_ns
+        window_ns = RETRY_BUDGET_WINDOW_S * 1_000_000_000
+        refill = (now_ns - self._refilled_ns) * self.retry_budget // window_ns
+        if refill:
+            self.retry_tokens = min(self.retry_budget, self.retry_tokens + refill)
+            self._refilled_ns += refill * window_ns // self.retry_budget
+        if self.retry_tokens < 1:
+            return False
+        self.retry_tokens -= 1
+        return True
+
+
+class PollEntry:
+    """
+    A request for `message_id`, carrying `body`, sent to `node` once every `period_s` seconds.
+    `on_reply(message_id, body)` is called with the message ID and body of each reply, which is
+    either `message_id` with `REPLY_FLAG` set or a NACK. `body` is a memoryview which is only
+    valid until `on_reply` returns.
+    """
+
+    def __init__(self, node: Node, message_id, period_s, body=b"", on_reply=None):
+        self.node = node
+        self.message_id = message_id
+        self.period_ns = int(period_s * 1e9)
+        self.body = bytes(body)
+        self.on_reply = on_reply
+        self.next_due_ns = 0
+
+
+class BusMaster:
+    """
+    Polls the nodes in `schedule`, a list of PollEntries, over `link`, always sending the most
+    overdue entry first. A node which fails `OFFLINE_AFTER_FAILURES` requests in a row is only
+    polled every `OFFLINE_POLL_PERIOD_S` seconds until it answers again. Each reply is handed to
+    its entry's callback after the next request has been sent, so handling it overlaps with the
+    next node's turnaround. Bulk transfers use the bus whenever no poll is due.
+    """
+
+    def __init__(self, link: Rs485Link, schedule):
+        if not schedule:
+            raise ValueError("Schedule has no entries to poll")
+        self.link = link
+        self.schedule = schedule
+        self.nodes = []
+        for entry in schedule:
+            if entry.node not in self.nodes:
+                self.nodes.append(entry.node)
+        self.transfers = []
+        self.round_trips = 0
+        self.unexpected_frames = 0
+        self._request = bytearray(link.max_payload)
+        self._reply = bytearray(link.max_payload)
+        self._reply_view = memoryview(self._reply)
+        self._reply_length = 0
+        self._awaiting = None
+        self._sent_ns = 0
+        self._start_ns = time.monotonic_ns()
+
+    def round_trips_per_s(self, now_ns=None):
+        """Returns the average rate of completed round trips since the BusMaster was created"""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        elapsed_ns = now_ns - self._start_ns
+        return self.round_trips * 1e9 / elapsed_ns if elapsed_ns > 0 else 0.0
+
+    def start_transfer(self, receiver):
+        """
+        Queues a `bulk_transfer.BulkReceiver`, which is removed from `transfers` once it is
+        done or has failed.
+        """
+        self.transfers.append(receiver)
+
+    def next_entry(self):
+        """Returns the PollEntry due soonest, preferring earlier entries in the schedule"""
+        best = None
+        for entry in self.schedule:
+            if best is None or entry.next_due_ns < best.next_due_ns:
+                best = entry
+        return best
+
+    async def run(self):
+        """Polls the nodes in the schedule forever"""
+        loop_timer = LoopMonitor.get_instance().register(
+            "bus_master", min(entry.period_ns for entry in self.schedule) / 1e9, deadline_s=1.0
+        )
+        completed = None
+        while True:
+            loop_timer.tick()
+            entry = self.next_entry()
+            now_ns = time.monotonic_ns()
+            if entry.next_due_ns > now_ns:
+                self._deliver(completed)
+                completed = None
+                if self.transfers:
+                    await self._exchange_transfer()
+                else:
+                    await asyncio.sleep((entry.next_due_ns - now_ns) / 1e9)
+                continue
+            await self._send(entry)
+            # the previous reply is handled while the node turns the new request around
+            self._deliver(completed)
+            completed = None
+            replied = await self._await_reply(entry)
+            retries = 0
+            while not replied and retries < MAX_RETRIES_PER_REQUEST and self._may_retry(entry):
+                retries += 1
+                entry.node.stats.retries += 1
+                await self._send(entry)
+                replied = await self._await_reply(entry)
+            if replied:
+                completed = entry
+            else:
+                entry.node.stats.failures += 1
+                entry.node.consecutive_failures += 1
+            self._reschedule(entry)
+
+    async def _exchange_transfer(self):
+        transfer = self.transfers[0]
+        self._awaiting = None
+        await transfer.exchange(self.link)
+        if transfer.done or transfer.failed:
+            self.transfers.pop(0)
+
+    def _may_retry(self, entry: PollEntry):
+        # retries are not spent on nodes which are already known to be offline
+        return entry.node.online and entry.node.take_retry(time.monotonic_ns())
+
+    async def _send(self, entry: PollEntry):
+        # drains anything left on the bus, such as a reply which arrived after its timeout
+        self._awaiting = None
+        self.link.poll(self._on_frame)
+        length = HEADER_SIZE + len(entry.body)
+        self._request[0] = entry.node.address
+        self._request[1] = entry.message_id
+        self._request[HEADER_SIZE:length] = entry.body
+        await self.link.send(memoryview(self._request)[:length])
+        self._sent_ns = time.monotonic_ns()
+        self._awaiting = entry
+        entry.node.stats.requests += 1
+
+    async def _await_reply(self, entry: PollEntry):
+        # returns True once the reply to `entry` has been received, or False on timeout
+        deadline_ns = self._sent_ns + entry.node.timeout_ns
+        while True:
+            self.link.poll(self._on_frame)
+            if self._awaiting is None:
+                return True
+            if time.monotonic_ns() >= deadline_ns:
+                self._awaiting = None
+                entry.node.stats.timeouts += 1
+                return False
+            await asyncio.sleep(REPLY_POLL_PERIOD_S)
+
+    def _on_frame(self, payload):
+        entry = self._awaiting
+        if entry is None or not self._is_reply(entry, payload):
+            self.unexpected_frames += 1
+            return
+        now_ns = time.monotonic_ns()
+        length = len(payload)
+        self._reply_view[:length] = payload
+        self._reply_length = length
+        self._awaiting = None
+        node = entry.node
+        node.consecutive_failures = 0
+        node.stats.replies += 1
+        if payload[1] == MessageId.NACK:
+            node.stats.nacks += 1
+        node.stats.latency_us.push((now_ns - self._sent_ns) // 1000)
+        self.round_trips += 1
+
+    def _is_reply(self, entry: PollEntry, payload):
+        if len(payload) < HEADER_SIZE or payload[0] != entry.node.address:
+            return False
+        if payload[1] == entry.message_id | REPLY_FLAG:
+            return True
+        return (
+            payload[1] == MessageId.NACK
+            and len(payload) > HEADER_SIZE
+            and payload[HEADER_SIZE] == entry.message_id
+        )
+
+    def _deliver(self, entry):
+        # hands the buffered reply to the entry's callback, if there is a reply to hand over
+        if entry is not None and entry.on_reply is not None:
+            entry.on_reply(self._reply[1], self._reply_view[HEADER_SIZE : self._reply_length])
+
+    def _reschedule(self, entry: PollEntry):
+        now_ns = time.monotonic_ns()
+        if not entry.node.online:
+            entry.next_due_ns = now_ns + OFFLINE_POLL_PERIOD_S * 1_000_000_000
+            return
+        # a late entry is not sent repeatedly to catch up
+        entry.next_due_ns = max(entry.next_due_ns + entry.period_ns, now_ns)
@@ -2,9 +2,16 @@
 Module to operate the battery management system.
 """
 
+import time
 import asyncio
+import digitalio
 
 import datastore as ds
+import state_of_charge
+from loop_monitor import LoopMonitor
+from pin_manager import PinManager
+
+import board
 
 # TODO: Tune these thresholds based on testing and battery specs
 MEASURABLE_DIFF_V = None
@@ -16,23 +23,110 @@ DISCHARGING_TEMPERATURE_THRESHOLD_C = None
 CHARGING_VOLTAGE_THRESHOLD_V = None
 DISCHARGING_VOLTAGE_THRESHOLD_V = None
 BALANCING_VOLTAGE_THRESHOLD_V = None # for checking against each cell separately
+BALANCE_SHUNT_RESISTANCE_OHM = None
+
+BALANCE_FILTER_GAIN = 0.05  # weight given to each new reading by the balancing filters
+BALANCE_STEADY_CURRENT_A = 0.1  # current changes larger than this skip the voltage filter
+MAX_BALANCE_PERIOD_S = 900  # longest time a shunt is scheduled before re-evaluating
+
+BMS_RATE_HZ = 1  # TODO: Verify this value
+
+# (top balance, bottom balance, charge shutdown, discharge shutdown) pins for each string
+STRING_PINS = [
+    ("S1_TOP_BALANCE", "S1_BOTTOM_BALANCE", "S1_CHARGE_SHD", "S1_DISCHARGE_SHD"),
+    ("S2_TOP_BALANCE", "S2_BOTTOM_BALANCE", "S2_CHARGE_SHD", "S2_DISCHARGE_SHD"),
+    ("S3_TOP_BALANCE", "S3_BOTTOM_BALANCE", "S3_CHARGE_SHD", "S3_DISCHARGE_SHD"),
+]
+
+_wakeup = asyncio.Event()
+
 
-async def battery_management_task(datastore: ds.Datastore):
+def notify_battery_data():
     """
-    Asynchronous control loop for battery balancing.
+    Wakes the battery management task before its next tick is due. Should be called whenever
+    new battery readings are placed into the datastore or a threshold event occurs.
+    """
+    _wakeup.set()
+
+
+async def battery_management_task(datastore: ds.Datastore, rate_hz=BMS_RATE_HZ):
+    """
+    Asynchronous control loop for battery protection and balancing.
 
-    Uses the latest readings in `datastore` as inputs and updates
-    balancing control flags for each battery string accordingly.
+    Uses the latest readings in `datastore` as inputs and updates protection and balancing
+    control flags for every battery string on each tick. Ticks happen `rate_hz` times per
+    second, or sooner if `notify_battery_data()` is called. The flags are applied to the
+    protection and balancing pins for each string.
     """
-    for string in [
+    pm = PinManager.get_instance()
+    strings = [
         datastore.batteries.string_1,
         datastore.batteries.string_2,
-        datastore.batteries.string_3
-    ]:
-        string.discharging_enabled = string_discharge_check(string)
-        string.charging_enabled = string_charge_check(string)
-        balance_string(string)
-        await asyncio.sleep(1)  # run once per second
+        datastore.batteries.string_3,
+    ]
+    outputs = [StringOutputs(pm, pins) for pins in STRING_PINS]
+    balancers = [CellBalancer() for _ in strings]
+    loop_timer = LoopMonitor.get_instance().register("bms", 1 / rate_hz)
+    try:
+        while True:
+            loop_timer.tick()
+            now_s = time.monotonic()
+            for string, output, balancer in zip(strings, outputs, balancers):
+                update_string(string, datastore.batteries.temperatures, balancer, now_s)
+                output.apply(string)
+            try:
+                await asyncio.wait_for(_wakeup.wait(), 1 / rate_hz)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+    finally:
+        for output in outputs:
+            output.release()
+
+
+def update_string(string: ds.DsBatteryString, temperatures, balancer, now_s):
+    """
+    Updates the protection and balancing control flags for one battery string.
+    """
+    string.discharging_enabled = string_discharge_check(string, temperatures)
+    string.charging_enabled = string_charge_check(string, temperatures)
+    balance_string(string, balancer, now_s)
+
+
+class StringOutputs:
+    """
+    Protection and balancing pins for one battery string. The pins are held for the lifetime of
+    the object and are only written when the value to be written changes.
+    """
+
+    def __init__(self, pm: PinManager, pin_names):
+        self._m_pins = [pm.create_digital_in_out(getattr(board, name)) for name in pin_names]
+        self._pins = [m_pin.hold() for m_pin in self._m_pins]
+        self._values = [None] * len(self._pins)
+        for pin in self._pins:
+            pin.direction = digitalio.Direction.OUTPUT
+
+    def apply(self, string: ds.DsBatteryString):
+        """
+        Writes the control flags of `string` to the pins. Shutdown pins are active high, and
+        unknown flags leave balancing off and charging and discharging shut down.
+        """
+        self._write(0, string.top_balancing_shunt_enabled is True)
+        self._write(1, string.bottom_balancing_shunt_enabled is True)
+        self._write(2, string.charging_enabled is not True)
+        self._write(3, string.discharging_enabled is not True)
+
+    def _write(self, index, value):
+        if self._values[index] != value:
+            self._pins[index].value = value
+            self._values[index] = value
+
+    def release(self):
+        """
+        Releases the pins held by this object.
+        """
+        for m_pin in self._m_pins:
+            m_pin.release()
 
 # def balance_all_strings(datastore: ds.Datastore):
 #     """
@@ -45,61 +139,164 @@ async def battery_management_task(datastore: ds.Datastore):
 #     ]:
 #         balance_string(string)
 
-def string_charge_check(string: ds.DsBatteryString):
+def _exceeds(reading, threshold):
+    """
+    Returns True if a reading is above a threshold. Readings which have not been taken yet and
+    thresholds which have not been set are not compared, so that the battery is not cut off
+    from the rest of the system before its readings are available.
+    """
+    if threshold is None or reading is None:
+        return False
+    return reading > threshold
+
+def string_charge_check(string: ds.DsBatteryString, temperatures):
     """
     Check if a battery string is in a safe state for balancing during charging.
+
+    `temperatures` are the battery pack temperatures, which apply to every string.
     """
-    if string.output_current < -1*CHARGING_CURRENT_THRESHOLD_A:
+    if string.output_current is not None and _exceeds(-1*string.output_current, CHARGING_CURRENT_THRESHOLD_A):
         return False
-    if string.top_cell_voltage > CHARGING_VOLTAGE_THRESHOLD_V or string.bottom_cell_voltage > CHARGING_VOLTAGE_THRESHOLD_V:
+    if _exceeds(string.top_cell_voltage, CHARGING_VOLTAGE_THRESHOLD_V) or _exceeds(string.bottom_cell_voltage, CHARGING_VOLTAGE_THRESHOLD_V):
         return False
-    for i in string.temperatures:
-        if i > CHARGING_TEMPERATURE_THRESHOLD_C:
+    for i in temperatures:
+        if _exceeds(i, CHARGING_TEMPERATURE_THRESHOLD_C):
             return False
     return True
 
-def string_discharge_check(string: ds.DsBatteryString):
+def string_discharge_check(string: ds.DsBatteryString, temperatures):
     """
     Check if a battery string is in a safe state for balancing during discharging.
 
+    `temperatures` are the battery pack temperatures, which apply to every string.
+
     False to disable, True to enable discharge switch
     """
-    if string.output_current > DISCHARGING_CURRENT_THRESHOLD_A:
+    if _exceeds(string.output_current, DISCHARGING_CURRENT_THRESHOLD_A):
         return False
-    if string.top_cell_voltage > DISCHARGING_VOLTAGE_THRESHOLD_V or string.bottom_cell_voltage > DISCHARGING_VOLTAGE_THRESHOLD_V:
+    if _exceeds(string.top_cell_voltage, DISCHARGING_VOLTAGE_THRESHOLD_V) or _exceeds(string.bottom_cell_voltage, DISCHARGING_VOLTAGE_THRESHOLD_V):
         return False
-    for i in string.temperatures:
-        if i > DISCHARGING_TEMPERATURE_THRESHOLD_C:
+    for i in temperatures:
+        if _exceeds(i, DISCHARGING_TEMPERATURE_THRESHOLD_C):
             return False
     return True
 
-def balance_string(string: ds.DsBatteryString): # noqa: C901
+class CellBalancer:
+    """
+    Balancing state for one 2-cell battery string. The difference between the cell voltages is
+    filtered into an estimate of the charge imbalance, and a single shunt is scheduled for long
+    enough to bleed it off, so the shunts switch only a few times per charge cycle.
+
+    `shunt` is "top", "bottom", or None depending on which balancing shunt is scheduled to be
+    on, and `shunt_end_s` is the `time.monotonic()` at which the schedule ends.
+    """
+
+    def __init__(self):
+        self.filtered_diff_v = None
+        self.filtered_current = None
+        self.shunt = None
+        self.shunt_end_s = 0
+        self.switch_count = 0
+
+    def observe(self, string: ds.DsBatteryString):
+        """
+        Updates the filtered cell voltage difference (top minus bottom) with new readings.
+        Readings taken while the string current is changing are not used for the voltage
+        difference, since the cells' internal resistances may not respond identically.
+        """
+        diff = string.top_cell_voltage - string.bottom_cell_voltage
+        # a shunt diverts charging current from its cell, lowering that cell's terminal
+        # voltage by the shunt current times the internal resistance
+        ir_drop = _shunt_current(max(string.top_cell_voltage, string.bottom_cell_voltage)) * (
+            state_of_charge.CELL_INTERNAL_RESISTANCE_OHM
+        )
+        if self.shunt == "top":
+            diff += ir_drop
+        elif self.shunt == "bottom":
+            diff -= ir_drop
+        current = string.output_current if string.output_current is not None else 0.0
+        if self.filtered_diff_v is None:
+            self.filtered_diff_v = diff
+            self.filtered_current = current
+            return
+        steady = abs(current - self.filtered_current) < BALANCE_STEADY_CURRENT_A
+        self.filtered_current += BALANCE_FILTER_GAIN * (current - self.filtered_current)
+        if steady:
+            self.filtered_diff_v += BALANCE_FILTER_GAIN * (diff - self.filtered_diff_v)
+
+    def imbalance_mah(self, string: ds.DsBatteryString):
+        """
+        Returns the estimated charge by which the top cell exceeds the bottom cell.
+        """
+        mean_v = (string.top_cell_voltage + string.bottom_cell_voltage) / 2
+        slope = state_of_charge.ocv_slope(state_of_charge.soc_from_ocv(mean_v))
+        return self.filtered_diff_v / slope * state_of_charge.STRING_CAPACITY_MAH
+
+    def plan(self, string: ds.DsBatteryString, now_s):
+        """
+        Schedules the shunt on the higher cell for long enough to remove the estimated
+        imbalance, or schedules no shunt if the cells are balanced. A new schedule needs a
+        significant difference to start, but continues as long as the difference is measurable.
+        """
+        threshold = MEASURABLE_DIFF_V if self.shunt is not None else SIGNIFICANT_DIFF_V
+        shunt = None
+        duration = MAX_BALANCE_PERIOD_S
+        if abs(self.filtered_diff_v) > threshold:
+            shunt = "top" if self.filtered_diff_v > 0 else "bottom"
+            high_v = max(string.top_cell_voltage, string.bottom_cell_voltage)
+            duration = min(
+                abs(self.imbalance_mah(string)) * 3.6 / _shunt_current(high_v),
+                MAX_BALANCE_PERIOD_S,
+            )
+        self._set_shunt(shunt)
+        self.shunt_end_s = now_s + duration
+
+    def stop(self):
+        """
+        Cancels any balancing schedule.
+        """
+        self._set_shunt(None)
+        self.shunt_end_s = 0
+
+    def _set_shunt(self, shunt):
+        if shunt != self.shunt:
+            self.shunt = shunt
+            self.switch_count += 1
+
+
+def _shunt_current(cell_voltage):
+    return cell_voltage / BALANCE_SHUNT_RESISTANCE_OHM
+
+
+def balance_string(string: ds.DsBatteryString, balancer: CellBalancer, now_s):
     """Apply balancing logic to one 2-cell battery string."""
     v_a, v_b = string.top_cell_voltage, string.bottom_cell_voltage
-    if v_a is None or v_b is None:
+    if v_a is None or v_b is None or None in (
+        BALANCING_VOLTAGE_THRESHOLD_V,
+        SIGNIFICANT_DIFF_V,
+        MEASURABLE_DIFF_V,
+        BALANCE_SHUNT_RESISTANCE_OHM,
+    ):
+        balancer.stop()
+        disable_balance(string, "both")
         return
 
+    balancer.observe(string)
+
     # Check if charging and at least one of the cells are almost fully charged
-    if not string.charging_enabled or not max(string.top_cell_voltage, string.top_cell_voltage) > BALANCING_VOLTAGE_THRESHOLD_V:
+    if not string.charging_enabled or not max(v_a, v_b) > BALANCING_VOLTAGE_THRESHOLD_V:
+        balancer.stop()
         disable_balance(string, "both")
         return
 
-    a_on, b_on = string.top_balancing_shunt_enabled, string.bottom_balancing_shunt_enabled
-
-    diff = v_a - v_b
+    if now_s >= balancer.shunt_end_s:
+        balancer.plan(string, now_s)
 
-    if diff > SIGNIFICANT_DIFF_V:
-        disable_balance(string, "b")
-    elif diff < -1* SIGNIFICANT_DIFF_V: # making sure it doesn't think I'm doing unary operator
-        disable_balance(string, "a")
-    elif a_on and diff > MEASURABLE_DIFF_V:
-        # diff greater than measurable, a enable b disable
+    if balancer.shunt == "top":
         disable_balance(string, "b")
-    elif b_on and diff < -1*MEASURABLE_DIFF_V:
-        # otherwise if diff is negative where b>a, a disable b enable
+    elif balancer.shunt == "bottom":
         disable_balance(string, "a")
     else:
-        # disable balance if no conditions met
         disable_balance(string, "both")
 
 def disable_balance(string: ds.DsBatteryString, disabled_cell: str):
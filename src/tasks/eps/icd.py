@@ -1,127 +1,467 @@
-"""
-Module to implement the EPS ICD.
-
-Part of the EPS ICD is intersubsystem communication over RS485 between CDH and EPS. This module
-implements responses to requests for data that are received over the bus. It also stores
-information that causes the subsystem control to comply with operation contraints sent from CDH.
-
-An additional part of the EPS ICD is the startup timing of the output buses and the current limits
-enforced on those output buses during satellite operation. This module also uses the current known
-information about bus operation and mission state to enable and disable output buses as appropriate.
-"""
-
-import asyncio
-import digitalio
-
-import datastore as ds
-from pin_manager import PinManager
-
-import board
-
-
-async def intersubsystem_communication_task(datastore: ds.Datastore):
-    """
-    Task to communicate with CDH.
-
-    Appropriately loads all buffers to be received by CDH and sent in return at the appropriate
-    times. Controls inter-subsystem communication hardware in accordance with the protocol's
-    specification. Transmitted data is pulled from the `datastore` and received commands are
-    placed into the `datastore`.
-    """
-    while True:
-        print(datastore)
-        await asyncio.sleep(0)
-
-
-async def output_bus_control_task(datastore: ds.Datastore):
-    """
-    Task which controls output buses to the rest of the satellite.
-
-    Uses the most recent data in the `datastore` as inputs. Controls enable pins for the 3V3,
-    5V, 12VLP, and 12VHP power supplies. Manages startup sequence, overcurrent conditions,
-    and any relevant commands from CDH that should activate or deactivate a particular bus.
-
-    See ICD at https://docs.google.com/document/d/1HDuXOEv7kC0Kjawf4W1BYVr5GzJt19YBkcu_MvHa1mw
-    """
-    pm = PinManager.get_instance()
-    m_en_3v3 = pm.create_digital_in_out(board.EN_3V3_BUS)
-    m_en_5v = pm.create_digital_in_out(board.EN_5V_BUS)
-    m_en_12vlp = pm.create_digital_in_out(board.EN_12VLP_BUS)
-    m_en_12vhp = pm.create_digital_in_out(board.EN_12VHP_BUS)
-    with m_en_3v3 as en_3v3, m_en_5v as en_5v, m_en_12vlp as en_12vlp, m_en_12vhp as en_12vhp:
-        en_3v3.direction = digitalio.Direction.OUTPUT
-        en_5v.direction = digitalio.Direction.OUTPUT
-        en_12vlp.direction = digitalio.Direction.OUTPUT
-        en_12vhp.direction = digitalio.Direction.OUTPUT
-        while True:
-            datastore.bus_3v3.enabled = _control_tick_3v3_bus(datastore)
-            datastore.bus_5v.enabled = _control_tick_5v_bus(datastore)
-            datastore.bus_12vlp.enabled = _control_tick_12vlp_bus(datastore)
-            datastore.bus_12vhp.enabled = _control_tick_12vhp_bus(datastore)
-            en_3v3.value = datastore.bus_3v3.enabled
-            en_5v.value = datastore.bus_5v.enabled
-            en_12vlp.value = datastore.bus_12vlp.enabled
-            en_12vhp.value = datastore.bus_12vhp.enabled
-            await asyncio.sleep(0.1)
-
-
-TICK_RATE_HZ = 5  # TODO: Verify this value
-WINDOW_SECONDS = 20
-WINDOW_SIZE = TICK_RATE_HZ * WINDOW_SECONDS  # 100
-
-_control_tick_3v3_bus_data = {
-    "tick_count": 0,
-    "output_currents": [0] * 2 * WINDOW_SIZE,
-}
-
-
-def avg(x):
-    """Calculates the average value for an array x"""
-    return sum(x) / len(x)
-
-
-def circ_recent(arr, count, stop):
-    """Returns a vector from arr as a circular buffer from count to stop"""
-    if stop < count:
-        return arr[stop - count :] + arr[:stop]
-    return arr[stop - count : stop]
-
-
-def _control_tick_3v3_bus(datastore: ds.Datastore):
-    """Determines if the 3v3 bus should be disabled based on the battery charge and output current"""
-    avg_output_current_20s = avg(_control_tick_3v3_bus_data["output_currents"])
-    if avg_output_current_20s > 0.5 * 4 / 3:
-        return False
-    battery_soc = (
-        datastore.batteries.filled_capacity_mah / datastore.batteries.pack_capacity_mah
-    )
-    if battery_soc < 0.01:
-        return False
-    if battery_soc < 0.1 and avg_output_current_20s < 0.1 * 4 / 3:
-        return False
-    if _control_tick_3v3_bus_data["tick_count"] >= WINDOW_SIZE:
-        # Reduces size of buffer every 50 ticks
-        _control_tick_3v3_bus_data["output_currents"] = _control_tick_3v3_bus_data[
-            "output_currents"
-        ][-WINDOW_SIZE:]
-        _control_tick_3v3_bus_data["tick_count"] = -1
-    _control_tick_3v3_bus_data["tick_count"] += 1
-    return True
-
-
-def _control_tick_5v_bus(datastore: ds.Datastore):
-    # TODO: implement this logic
-    print(datastore.control_commands.bus_5v_enabled)
-    return True
-
-
-def _control_tick_12vlp_bus(datastore: ds.Datastore):
-    # TODO: implement this logic
-    print(datastore.control_commands.bus_12vlp_enabled)
-    return True
-
-
-def _control_tick_12vhp_bus(datastore: ds.Datastore):
-    # TODO: implement this logic
-    print(datastore.control_commands.bus_12vhp_enabled)
-    return True
+"""
+Module to implement the EPS ICD.
+
+Part of the EPS ICD is intersubsystem communication over RS485 between CDH and EPS. This module
+implements responses to requests for data that are received over the bus. It also stores
+information that causes the subsystem control to comply with operation contraints sent from CDH.
+
+An additional part of the EPS ICD is the startup timing of the output buses and the current limits
+enforced on those output buses during satellite operation. This module also uses the current known
+information about bus operation and mission state to enable and disable output buses as appropriate.
+"""
+
+import time
+import asyncio
+import digitalio
+
+import datastore as ds
+from loop_monitor import LoopMonitor
+from pin_manager import PinManager
+from ring_buffer import RingBuffer
+from telemetry_codec import TelemetryEncoder
+from inter_subsystem_rs485 import (
+    CRC_SIZE,
+    HEADER_SIZE,
+    REPLY_FLAG,
+    Address,
+    MessageId,
+    Rs485Link,
+    Status,
+    encode_frame_into,
+    max_frame_size,
+)
+
+import board
+
+
+async def intersubsystem_communication_task(datastore: ds.Datastore):
+    """
+    Task to communicate with CDH.
+
+    Appropriately loads all buffers to be received by CDH and sent in return at the appropriate
+    times. Controls inter-subsystem communication hardware in accordance with the protocol's
+    specification. Transmitted data is pulled from the `datastore` and received commands are
+    placed into the `datastore`. Requests are answered on whichever of the two RS485 buses they
+    arrive on.
+    """
+    links = [Rs485Link(*(getattr(board, name) for name in pins)) for pins in RS485_LINK_PINS]
+    engine = IcdEngine(datastore)
+    handlers = [engine.frame_handler(link) for link in links]
+    loop_timer = LoopMonitor.get_instance().register("icd", ICD_POLL_PERIOD_S, deadline_s=1.0)
+    refresh_period_ns = int(1e9 / TELEMETRY_REFRESH_HZ)
+    next_refresh_ns = time.monotonic_ns() + refresh_period_ns
+    try:
+        while True:
+            loop_timer.tick()
+            for link, handler in zip(links, handlers):
+                link.poll(handler)
+                await link.flush()
+            now_ns = time.monotonic_ns()
+            if now_ns >= next_refresh_ns:
+                next_refresh_ns = max(next_refresh_ns + refresh_period_ns, now_ns)
+                engine.refresh()
+            await asyncio.sleep(ICD_POLL_PERIOD_S)
+    finally:
+        for link in links:
+            link.close()
+
+
+async def output_bus_control_task(datastore: ds.Datastore):
+    """
+    Task which controls output buses to the rest of the satellite.
+
+    Uses the most recent data in the `datastore` as inputs. Controls enable pins for the 3V3,
+    5V, 12VLP, and 12VHP power supplies. Manages startup sequence, overcurrent conditions,
+    and any relevant commands from CDH that should activate or deactivate a particular bus.
+    The limits enforced on each bus are declared in `OUTPUT_BUSES`.
+
+    See ICD at https://docs.google.com/document/d/1HDuXOEv7kC0Kjawf4W1BYVr5GzJt19YBkcu_MvHa1mw
+    """
+    pm = PinManager.get_instance()
+    m_enables = [
+        pm.create_digital_in_out(getattr(board, bus.enable_pin)) for bus in OUTPUT_BUSES
+    ]
+    enables = [m_en.hold() for m_en in m_enables]
+    try:
+        for en in enables:
+            en.direction = digitalio.Direction.OUTPUT
+            en.value = False
+        controller = OutputBusController(datastore, enables)
+        loop_timer = LoopMonitor.get_instance().register("output_bus_control", 1 / TICK_RATE_HZ)
+        while True:
+            loop_timer.tick()
+            controller.tick()
+            await asyncio.sleep(1 / TICK_RATE_HZ)
+    finally:
+        for m_en in m_enables:
+            m_en.release()
+
+
+TICK_RATE_HZ = 10  # TODO: Verify this value
+WINDOW_SECONDS = 20
+
+
+class OutputBus:
+    """
+    Description of a single output bus and the policy used to control it.
+
+    `enable_pin` names the pin in `board` which enables the bus, `datastore_field` names the
+    DsOutputBus in the Datastore which holds the bus's state, and `command_field` names the
+    flag in DsCommands through which CDH can force the bus off.
+
+    If a single output current sample exceeds `trip_current_a`, the bus is turned off immediately
+    and latched off. The latch is cleared `trip_retry_s` seconds after the trip, or when CDH
+    commands the bus off if `trip_retry_s` is None.
+
+    The bus is held off until `startup_delay_s` seconds after the control task starts. Once
+    started, the bus is turned off if its output current averaged over `window_s` seconds
+    exceeds `max_avg_current_a`, if the battery state of charge is below `shutdown_soc`, or if
+    the state of charge is below `low_soc` while the average output current is below
+    `low_soc_min_current_a`. Limits which are None are not enforced, so a bus without limits
+    follows the CDH command and its trip latch.
+    """
+
+    def __init__(
+        self,
+        name,
+        enable_pin,
+        datastore_field,
+        command_field,
+        *,
+        startup_delay_s=0,
+        window_s=WINDOW_SECONDS,
+        max_avg_current_a=None,
+        shutdown_soc=None,
+        low_soc=None,
+        low_soc_min_current_a=None,
+        trip_current_a=None,
+        trip_retry_s=None,
+    ):
+        self.name = name
+        self.enable_pin = enable_pin
+        self.datastore_field = datastore_field
+        self.command_field = command_field
+        self.startup_delay_s = startup_delay_s
+        self.window_s = window_s
+        self.max_avg_current_a = max_avg_current_a
+        self.shutdown_soc = shutdown_soc
+        self.low_soc = low_soc
+        self.low_soc_min_current_a = low_soc_min_current_a
+        self.trip_current_a = trip_current_a
+        self.trip_retry_s = trip_retry_s
+
+
+# The buses start one second apart so that each one's inrush current has settled before the next
+# starts, beginning with the 3V3 bus which powers the logic of the other subsystems
+OUTPUT_BUSES = [
+    OutputBus(
+        "3v3",
+        "EN_3V3_BUS",
+        "bus_3v3",
+        "bus_3v3_enabled",
+        startup_delay_s=0,
+        max_avg_current_a=0.5 * 4 / 3,
+        shutdown_soc=0.01,
+        low_soc=0.1,
+        low_soc_min_current_a=0.1 * 4 / 3,
+        # twice the ICD's average current limit, above the bus's load transients, and held off
+        # until CDH commands the bus off so that a short is not powered again automatically
+        trip_current_a=2 * 0.5 * 4 / 3,
+        trip_retry_s=None,
+    ),
+    OutputBus("5v", "EN_5V_BUS", "bus_5v", "bus_5v_enabled", startup_delay_s=1),
+    OutputBus("12vlp", "EN_12VLP_BUS", "bus_12vlp", "bus_12vlp_enabled", startup_delay_s=2),
+    OutputBus("12vhp", "EN_12VHP_BUS", "bus_12vhp", "bus_12vhp_enabled", startup_delay_s=3),
+]
+
+OUTPUT_BUSES_BY_NAME = {bus.name: bus for bus in OUTPUT_BUSES}
+
+# most recent output current samples for each bus, one per control tick
+output_current_windows = {
+    bus.name: RingBuffer(int(bus.window_s * TICK_RATE_HZ), 1 / TICK_RATE_HZ)
+    for bus in OUTPUT_BUSES
+}
+
+
+def battery_soc(datastore: ds.Datastore):
+    """Returns the battery pack state of charge as a fraction, or None if it is unknown"""
+    batteries = datastore.batteries
+    if batteries.filled_capacity_mah is None or not batteries.pack_capacity_mah:
+        return None
+    return batteries.filled_capacity_mah / batteries.pack_capacity_mah
+
+
+class OutputBusController:
+    """
+    Evaluates the policy in `OUTPUT_BUSES` for every bus in a single pass per tick.
+
+    Each tick records the latest output current of each bus, decides whether each bus should
+    be enabled, and stores the decision in the `datastore`. Enable pins are only written when
+    a bus changes state. `enables` holds the enable pin DigitalInOut for each bus, in the same
+    order as `OUTPUT_BUSES`.
+    """
+
+    def __init__(self, datastore: ds.Datastore, enables):
+        self._datastore = datastore
+        self._buses = [
+            (
+                bus,
+                getattr(datastore, bus.datastore_field),
+                output_current_windows[bus.name],
+                en,
+            )
+            for bus, en in zip(OUTPUT_BUSES, enables)
+        ]
+        self._enabled = [False] * len(self._buses)
+        self._start_time = time.monotonic()
+
+    def tick(self):
+        """Runs one control tick for all buses"""
+        elapsed_s = time.monotonic() - self._start_time
+        soc = battery_soc(self._datastore)
+        commands = self._datastore.control_commands
+        for i, (bus, bus_ds, window, en) in enumerate(self._buses):
+            if bus_ds.output_current is not None:
+                window.push(bus_ds.output_current)
+            commanded = getattr(commands, bus.command_field)
+            if bus_ds.tripped:
+                _update_trip_latch(bus, bus_ds, commanded)
+            enabled = (
+                commanded
+                and not bus_ds.tripped
+                and _bus_policy_allows(bus, window.mean(), soc, elapsed_s)
+            )
+            bus_ds.enabled = enabled
+            if enabled != self._enabled[i]:
+                en.value = enabled
+                self._enabled[i] = enabled
+
+
+def _bus_policy_allows(bus: OutputBus, avg_output_current, soc, elapsed_s):
+    """Determines if a bus may be enabled based on its startup delay, current and battery charge"""
+    if elapsed_s < bus.startup_delay_s:
+        return False
+    if bus.max_avg_current_a is not None and avg_output_current > bus.max_avg_current_a:
+        return False
+    if soc is None:
+        return True
+    if bus.shutdown_soc is not None and soc < bus.shutdown_soc:
+        return False
+    if (
+        bus.low_soc is not None
+        and soc < bus.low_soc
+        and avg_output_current < bus.low_soc_min_current_a
+    ):
+        return False
+    return True
+
+
+def record_output_current_sample(
+    datastore: ds.Datastore, bus_name, current_a, sample_time_ns
+):
+    """
+    Records a new output current sample for the named bus as soon as it is read from the ADC.
+
+    If the sample exceeds the bus's instantaneous trip current, the bus enable pin is driven
+    low immediately through the PinManager and the bus is latched off. The trip count and the
+    latency from `sample_time_ns` (the `time.monotonic_ns()` at which the sample was taken) to
+    the pin being driven low are recorded in the `datastore`.
+    """
+    bus = OUTPUT_BUSES_BY_NAME[bus_name]
+    bus_ds = getattr(datastore, bus.datastore_field)
+    bus_ds.output_current = current_a
+    if bus.trip_current_a is None or current_a <= bus.trip_current_a or bus_ds.tripped:
+        return
+    _drive_enable_low(bus)
+    now_ns = time.monotonic_ns()
+    bus_ds.tripped = True
+    bus_ds.enabled = False
+    bus_ds.trip_count += 1
+    bus_ds.last_trip_time_ns = now_ns
+    bus_ds.last_trip_latency_ns = now_ns - sample_time_ns
+
+
+def _drive_enable_low(bus: OutputBus):
+    """Turns off a bus without waiting for the output bus control task"""
+    m_en = PinManager.get_instance().create_digital_in_out(getattr(board, bus.enable_pin))
+    # if the control task holds the pin, entering is only a counter bump and the pin is
+    # already an output
+    was_running = m_en.is_running()
+    with m_en as en:
+        if not was_running:
+            en.direction = digitalio.Direction.OUTPUT
+        en.value = False
+
+
+def _update_trip_latch(bus: OutputBus, bus_ds: ds.DsOutputBus, commanded):
+    """Clears the trip latch on a bus once its retry time has passed or CDH commands it off"""
+    if bus.trip_retry_s is None:
+        if not commanded:
+            bus_ds.tripped = False
+    elif time.monotonic_ns() - bus_ds.last_trip_time_ns >= bus.trip_retry_s * 1e9:
+        bus_ds.tripped = False
+
+
+ICD_POLL_PERIOD_S = 0.002
+# (TX, RX, DE) pins of the link on each of the two RS485 buses
+RS485_LINK_PINS = [
+    ("RS485_1_TX", "RS485_1_RX", "RS485_1_DE"),
+    ("RS485_2_TX", "RS485_2_RX", "RS485_2_DE"),
+]
+TELEMETRY_REFRESH_HZ = 10  # TODO: Match this to the rate at which CDH polls for telemetry
+
+# top-level datastore fields included in each telemetry reply
+TELEMETRY_GROUPS = {
+    MessageId.EPS_BATTERY_TELEMETRY: ("batteries",),
+    MessageId.EPS_BUS_TELEMETRY: (
+        "bus_3v3",
+        "bus_5v",
+        "bus_12vlp",
+        "bus_12vhp",
+        "control_commands",
+    ),
+    MessageId.EPS_SOLAR_TELEMETRY: ("mppt", "solar_array"),
+    MessageId.EPS_HEALTH_TELEMETRY: ("health",),
+}
+
+
+def telemetry_snapshot(message_id):
+    """Returns the DatastoreSnapshot of the fields carried by a telemetry reply"""
+    groups = TELEMETRY_GROUPS[message_id]
+    return ds.DatastoreSnapshot(
+        [field for field in ds.SNAPSHOT_FIELDS if field[0].split(".")[0] in groups]
+    )
+
+
+class PrepackedReply:
+    """
+    A reply frame which is packed and encoded ahead of time, so that it can be sent as soon as
+    it is requested. The frame is double-buffered: `refresh()` encodes a new frame into the
+    buffer not currently being served and then swaps the buffers, so `frame()` always returns
+    a complete frame.
+    """
+
+    def __init__(self, message_id, snapshot: ds.DatastoreSnapshot):
+        self.snapshot = snapshot
+        self._payload = bytearray(HEADER_SIZE + snapshot.size + CRC_SIZE)
+        self._payload[0] = Address.EPS
+        self._payload[1] = message_id | REPLY_FLAG
+        size = max_frame_size(HEADER_SIZE + snapshot.size)
+        self._frames = [bytearray(size), bytearray(size)]
+        self._views = [memoryview(frame) for frame in self._frames]
+        self._lengths = [0, 0]
+        self._front = 0
+
+    def refresh(self, datastore: ds.Datastore):
+        """Packs and encodes a reply from the current contents of the `datastore`"""
+        back = 1 - self._front
+        self.snapshot.pack_into(datastore, self._payload, HEADER_SIZE)
+        self._lengths[back] = encode_frame_into(
+            self._payload, HEADER_SIZE + self.snapshot.size, self._frames[back]
+        )
+        self._front = back
+
+    def frame(self):
+        """Returns the most recently encoded reply frame"""
+        return self._views[self._front][: self._lengths[self._front]]
+
+
+class IcdEngine:
+    """
+    Answers requests from CDH on behalf of EPS. Requests are dispatched by message ID through
+    `handlers`, and each handler returns the frame to reply with. Telemetry replies are served
+    from PrepackedReplies, which `refresh()` re-encodes from the `datastore` in the background,
+    and delta telemetry replies are encoded by one TelemetryEncoder per telemetry group.
+    """
+
+    def __init__(self, datastore: ds.Datastore):
+        self.datastore = datastore
+        self.replies = {
+            message_id: PrepackedReply(message_id, telemetry_snapshot(message_id))
+            for message_id in TELEMETRY_GROUPS
+        }
+        self.encoders = {
+            message_id: TelemetryEncoder(
+                telemetry_snapshot(message_id).fields, ds.TELEMETRY_SCALES
+            )
+            for message_id in TELEMETRY_GROUPS
+        }
+        max_delta_size = max(encoder.max_size for encoder in self.encoders.values())
+        self._delta_payload = bytearray(HEADER_SIZE + 1 + max_delta_size + CRC_SIZE)
+        self._delta_payload[0] = Address.EPS
+        self._delta_payload[1] = MessageId.EPS_DELTA_TELEMETRY | REPLY_FLAG
+        self.handlers = {
+            MessageId.PING: self._ping,
+            MessageId.EPS_DELTA_TELEMETRY: self._delta_telemetry,
+            MessageId.EPS_SET_BUS_ENABLES: self._set_bus_enables,
+        }
+        for message_id in self.replies:
+            self.handlers[message_id] = self._telemetry
+        self.requests = 0
+        self.unknown_requests = 0
+        self.refresh()
+
+    def refresh(self):
+        """Re-encodes every telemetry reply from the datastore"""
+        for reply in self.replies.values():
+            reply.refresh(self.datastore)
+
+    def frame_handler(self, link: Rs485Link):
+        """
+        Returns a callback for `link.poll()` which queues the answer to each request received on
+        `link`, to be sent by `link.flush()`
+        """
+
+        def on_frame(payload):
+            if len(payload) < HEADER_SIZE or payload[0] != Address.EPS:
+                return
+            self.requests += 1
+            message_id = payload[1]
+            handler = self.handlers.get(message_id)
+            if handler is None:
+                self.unknown_requests += 1
+                link.queue_frame(_reply(link, MessageId.NACK, message_id, Status.UNKNOWN_MESSAGE))
+            else:
+                link.queue_frame(handler(link, message_id, payload[HEADER_SIZE:]))
+
+        return on_frame
+
+    def _telemetry(self, _link, message_id, _body):
+        return self.replies[message_id].frame()
+
+    def _delta_telemetry(self, link, message_id, body):
+        # the body holds a telemetry group ID, and the sequence number of the last frame of that
+        # group CDH decoded, if there is one
+        if not 1 <= len(body) <= 2:
+            return _reply(link, MessageId.NACK, message_id, Status.BAD_LENGTH)
+        encoder = self.encoders.get(body[0])
+        if encoder is None:
+            return _reply(link, MessageId.NACK, message_id, Status.BAD_VALUE)
+        if len(body) == 2:
+            encoder.acknowledge(body[1])
+        else:
+            encoder.reset()
+        self._delta_payload[HEADER_SIZE] = body[0]
+        size = encoder.encode_into(self.datastore, self._delta_payload, HEADER_SIZE + 1)
+        return link.encode(memoryview(self._delta_payload)[: HEADER_SIZE + 1 + size])
+
+    def _ping(self, link, message_id, _body):
+        return _reply(link, message_id | REPLY_FLAG)
+
+    def _set_bus_enables(self, link, message_id, body):
+        # one bit per bus, in the order of `OUTPUT_BUSES`
+        if len(body) != 1:
+            return _reply(link, MessageId.NACK, message_id, Status.BAD_LENGTH)
+        for i, bus in enumerate(OUTPUT_BUSES):
+            setattr(self.datastore.control_commands, bus.command_field, bool(body[0] >> i & 1))
+        self.replies[MessageId.EPS_BUS_TELEMETRY].refresh(self.datastore)
+        return _reply(link, message_id | REPLY_FLAG, Status.OK)
+
+
+def _reply(link: Rs485Link, message_id, *body):
+    # encodes a small reply from EPS into the link's transmit buffer
+    payload = bytearray(HEADER_SIZE + len(body))
+    payload[0] = Address.EPS
+    payload[1] = message_id
+    payload[HEADER_SIZE:] = bytes(body)
+    return link.encode(payload)
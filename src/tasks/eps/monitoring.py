@@ -5,15 +5,537 @@ Module to monitor the health and state of the EPS system. This includes
 * recording reliability metrics related to system memory faults and restarts as necessary
 """
 
+import gc
+import time
+import struct
 import asyncio
+import digitalio
+import microcontroller
 
+import board
+
+import bms
+import icd
+import state_of_charge
 import datastore as ds
+import datastore_path
+from ads1118 import Ads1118, InputRange, MuxSelection, SamplingRate
+from loop_monitor import LoopMonitor
+from pin_manager import PinManager
+from ring_buffer import RingBuffer
+
+STATISTICS_RATE_HZ = 1
+RATE_WINDOW_SAMPLES = 16  # number of sample intervals averaged for the achieved rate
+
+# TODO: Verify these against the flatsat schematic and characterization testing
+CELL_VOLTAGE_SCALE = 2.0  # voltage divider ratio on cell voltage channels
+STRING_CURRENT_A_PER_V = 1.0
+BUS_CURRENT_A_PER_V = 1.0
+BUS_VOLTAGE_SCALE = 4.0
+MPPT_CURRENT_A_PER_V = 1.0
+MPPT_VOLTAGE_SCALE = 6.0
+TEMPERATURE_OFFSET_V = 0.5
+TEMPERATURE_V_PER_C = 0.01
+
+
+class Measurement:
+    """
+    Declaration of a single scheduled analog measurement.
 
+    The measurement is read from `channel` of the ADC whose chip-select pin is named `adc` in
+    `board`, using `input_range` and `sample_rate`, once every `period_s` seconds. The voltage
+    read is converted to `voltage * scale + offset` and placed into `field` (an attribute name,
+    or an index for lists) of the datastore object at the dotted path `target`.
 
-async def data_recording_task(datastore: ds.Datastore):
+    If `on_sample` is given, it is called with the datastore, the converted value, and the
+    `time.monotonic_ns()` at which its conversion was started, as soon as the sample is read.
+    If `notify` is given, it is called once after each round of samples from the ADC that
+    includes this measurement.
     """
-    Task to read all analog and digital data in the system and place it into the `datastore`.
+
+    def __init__(
+        self,
+        name,
+        adc,
+        channel,
+        target,
+        field,
+        *,
+        period_s,
+        input_range=InputRange.FSR_4_096V,
+        sample_rate=SamplingRate.RATE_860,
+        scale=1.0,
+        offset=0.0,
+        on_sample=None,
+        notify=None,
+    ):
+        self.name = name
+        self.adc = adc
+        self.channel = channel
+        self.target = target
+        self.field = field
+        self.period_s = period_s
+        self.input_range = input_range
+        self.sample_rate = sample_rate
+        self.scale = scale
+        self.offset = offset
+        self.on_sample = on_sample
+        self.notify = notify
+
+
+def _notify_string_current():
+    bms.notify_battery_data()
+    state_of_charge.notify_string_current()
+
+
+def _string_measurements(number, adc):
+    target = f"batteries.string_{number}"
+    return [
+        Measurement(
+            f"string_{number}_top_cell_voltage",
+            adc,
+            MuxSelection.CH0_SINGLE_END,
+            target,
+            "top_cell_voltage",
+            period_s=0.1,
+            scale=CELL_VOLTAGE_SCALE,
+            notify=bms.notify_battery_data,
+        ),
+        Measurement(
+            f"string_{number}_bottom_cell_voltage",
+            adc,
+            MuxSelection.CH1_SINGLE_END,
+            target,
+            "bottom_cell_voltage",
+            period_s=0.1,
+            scale=CELL_VOLTAGE_SCALE,
+            notify=bms.notify_battery_data,
+        ),
+        Measurement(
+            f"string_{number}_output_current",
+            adc,
+            MuxSelection.CH2_SINGLE_END,
+            target,
+            "output_current",
+            period_s=0.1,
+            input_range=InputRange.FSR_2_048V,
+            scale=STRING_CURRENT_A_PER_V,
+            notify=_notify_string_current,
+        ),
+    ]
+
+
+def _temperature_measurement(index, adc, channel):
+    return Measurement(
+        f"pack_temperature_{index}",
+        adc,
+        channel,
+        "batteries.temperatures",
+        index,
+        period_s=1.0,
+        input_range=InputRange.FSR_2_048V,
+        sample_rate=SamplingRate.RATE_128,
+        scale=1 / TEMPERATURE_V_PER_C,
+        offset=-TEMPERATURE_OFFSET_V / TEMPERATURE_V_PER_C,
+    )
+
+
+def _record_output_current(bus_name):
+    def on_sample(datastore, current_a, time_ns):
+        icd.record_output_current_sample(datastore, bus_name, current_a, time_ns)
+
+    return on_sample
+
+
+def _bus_measurements(bus, channel):
+    target = bus.datastore_field
+    return [
+        Measurement(
+            f"{target}_input_current",
+            "ADC_CS5",
+            channel,
+            target,
+            "input_current",
+            period_s=0.1,
+            input_range=InputRange.FSR_2_048V,
+            scale=BUS_CURRENT_A_PER_V,
+        ),
+        Measurement(
+            f"{target}_output_current",
+            "ADC_CS6",
+            channel,
+            target,
+            "output_current",
+            period_s=0.02,
+            input_range=InputRange.FSR_2_048V,
+            scale=BUS_CURRENT_A_PER_V,
+            on_sample=_record_output_current(bus.name),
+        ),
+        Measurement(
+            f"{target}_output_voltage",
+            "ADC_CS7",
+            channel,
+            target,
+            "output_voltage",
+            period_s=0.1,
+            scale=BUS_VOLTAGE_SCALE,
+        ),
+    ]
+
+
+_SINGLE_END_CHANNELS = [
+    MuxSelection.CH0_SINGLE_END,
+    MuxSelection.CH1_SINGLE_END,
+    MuxSelection.CH2_SINGLE_END,
+    MuxSelection.CH3_SINGLE_END,
+]
+
+# every analog measurement, with the ADC and channel it is read from, its settings and rate, and
+# where its result is placed in the datastore
+# TODO: Verify the ADC and channel of each measurement against the flatsat schematic
+SCHEDULE = (
+    _string_measurements(1, "ADC_CS1")
+    + _string_measurements(2, "ADC_CS2")
+    + _string_measurements(3, "ADC_CS3")
+    + [
+        _temperature_measurement(0, "ADC_CS1", MuxSelection.CH3_SINGLE_END),
+        _temperature_measurement(1, "ADC_CS2", MuxSelection.CH3_SINGLE_END),
+        _temperature_measurement(2, "ADC_CS3", MuxSelection.CH3_SINGLE_END),
+        _temperature_measurement(3, "ADC_CS4", MuxSelection.CH3_SINGLE_END),
+        Measurement(
+            "mppt_input_voltage",
+            "ADC_CS4",
+            MuxSelection.CH0_SINGLE_END,
+            "mppt",
+            "input_voltage",
+            period_s=0.1,
+            scale=MPPT_VOLTAGE_SCALE,
+        ),
+        Measurement(
+            "mppt_input_current",
+            "ADC_CS4",
+            MuxSelection.CH1_SINGLE_END,
+            "mppt",
+            "input_current",
+            period_s=0.1,
+            input_range=InputRange.FSR_2_048V,
+            scale=MPPT_CURRENT_A_PER_V,
+        ),
+        Measurement(
+            "mppt_output_current",
+            "ADC_CS4",
+            MuxSelection.CH2_SINGLE_END,
+            "mppt",
+            "output_current",
+            period_s=0.1,
+            input_range=InputRange.FSR_2_048V,
+            scale=MPPT_CURRENT_A_PER_V,
+        ),
+    ]
+    + [
+        measurement
+        for bus, channel in zip(icd.OUTPUT_BUSES, _SINGLE_END_CHANNELS)
+        for measurement in _bus_measurements(bus, channel)
+    ]
+)
+
+
+class ChannelStatistics:
+    """
+    Keeps the sampling statistics of one measurement in a DsChannelSampling, with the achieved
+    sampling rate averaged over the most recent `RATE_WINDOW_SAMPLES` sample intervals.
+    """
+
+    def __init__(self, sampling: ds.DsChannelSampling):
+        self.sampling = sampling
+        self._intervals = RingBuffer(RATE_WINDOW_SAMPLES)
+
+    def record(self, time_ns):
+        """Records a sample taken at `time_ns`"""
+        sampling = self.sampling
+        if sampling.last_time_ns is not None:
+            self._intervals.push((time_ns - sampling.last_time_ns) / 1e9)
+            mean_interval = self._intervals.mean()
+            sampling.achieved_rate_hz = 1 / mean_interval if mean_interval > 0 else None
+        sampling.last_time_ns = time_ns
+        sampling.samples += 1
+        sampling.staleness_s = 0.0
+
+    def update_staleness(self, now_ns):
+        """Updates the time since the most recent sample, as of `now_ns`"""
+        if self.sampling.last_time_ns is not None:
+            self.sampling.staleness_s = (now_ns - self.sampling.last_time_ns) / 1e9
+
+
+class AdcSchedule:
+    """
+    The scheduled measurements read from a single ADC, which are sampled by `run()`. Each ADC
+    runs its own schedule, so conversions on different ADCs overlap, and measurements due
+    together are taken in order of their settings.
+    """
+
+    def __init__(self, adc, measurements, datastore: ds.Datastore, statistics):
+        self.adc = adc
+        self.datastore = datastore
+        self.measurements = sorted(
+            measurements, key=lambda m: (m.input_range, m.sample_rate, m.channel)
+        )
+        self.targets = [datastore_path.resolve(datastore, m.target) for m in self.measurements]
+        self.statistics = [statistics[m.name] for m in self.measurements]
+        self.next_due_s = [0.0] * len(self.measurements)
+
+    async def sample_due(self, now_s):
+        """
+        Takes every measurement due at `now_s` and returns the time at which the next
+        measurement is due.
+        """
+        notifications = []
+        for i, m in enumerate(self.measurements):
+            if now_s < self.next_due_s[i]:
+                continue
+            # the conversion starts as soon as take_sample() is called, so that is when the
+            # sample is taken
+            time_ns = time.monotonic_ns()
+            voltage = await self.adc.take_sample(m.channel, m.input_range, m.sample_rate)
+            value = voltage * m.scale + m.offset
+            if isinstance(m.field, int):
+                self.targets[i][m.field] = value
+            else:
+                setattr(self.targets[i], m.field, value)
+            self.statistics[i].record(time_ns)
+            if m.on_sample is not None:
+                m.on_sample(self.datastore, value, time_ns)
+            if m.notify is not None and m.notify not in notifications:
+                notifications.append(m.notify)
+            # keep to the schedule, but skip samples that were missed entirely
+            self.next_due_s[i] += m.period_s
+            if self.next_due_s[i] < now_s:
+                self.next_due_s[i] = now_s + m.period_s
+        for notify in notifications:
+            notify()
+        return min(self.next_due_s)
+
+    async def run(self, name="adc"):
+        """Samples the scheduled measurements forever"""
+        period_s = min(m.period_s for m in self.measurements)
+        loop_timer = LoopMonitor.get_instance().register(name, period_s)
+        while True:
+            loop_timer.tick()
+            next_due_s = await self.sample_due(time.monotonic())
+            await asyncio.sleep(max(0, next_due_s - time.monotonic()))
+
+
+def create_adc_schedules(datastore: ds.Datastore, schedule=None):
     """
+    Creates an AdcSchedule for each ADC used in `schedule` (`SCHEDULE` if None), registering
+    the sampling statistics of each measurement in `datastore.sampling`. Returns a dict of the
+    schedules keyed by the name of their ADC's chip-select pin, and a list of every
+    measurement's ChannelStatistics.
+    """
+    schedule = SCHEDULE if schedule is None else schedule
+    statistics = {}
+    by_adc = {}
+    for m in schedule:
+        datastore.sampling[m.name] = ds.DsChannelSampling(m.period_s)
+        statistics[m.name] = ChannelStatistics(datastore.sampling[m.name])
+        by_adc.setdefault(m.adc, []).append(m)
+    schedules = {
+        adc: AdcSchedule(
+            Ads1118(board.ADC_SCK, board.ADC_MOSI, board.ADC_MISO, getattr(board, adc)),
+            measurements,
+            datastore,
+            statistics,
+        )
+        for adc, measurements in by_adc.items()
+    }
+    return schedules, list(statistics.values())
+
+
+async def _statistics_task(statistics):
     while True:
-        print(datastore)
-        await asyncio.sleep(0)
+        now_ns = time.monotonic_ns()
+        for channel in statistics:
+            channel.update_staleness(now_ns)
+        await asyncio.sleep(1 / STATISTICS_RATE_HZ)
+
+
+async def data_recording_task(datastore: ds.Datastore, schedule=None):
+    """
+    Task to read all analog and digital data in the system and place it into the `datastore`,
+    following `schedule` (`SCHEDULE` if None).
+    """
+    schedules, statistics = create_adc_schedules(datastore, schedule)
+    await asyncio.gather(
+        *[adc_schedule.run(adc) for adc, adc_schedule in schedules.items()],
+        _statistics_task(statistics),
+    )
+
+
+HEALTH_RATE_HZ = 5  # TODO: Verify this against the external watchdog timeout
+METRICS_PERIOD_S = 1
+HEAP_CHECK_PERIOD_S = 60
+HEAP_HISTORY_CHECKS = 60
+FRAGMENTATION_PROBE_BYTES = 4096
+NVM_HEALTH_OFFSET = 0
+
+# reset reasons in the order of their codes in `DsHealth.reset_reason` and `reset_counts`
+RESET_REASONS = [
+    "POWER_ON",
+    "BROWNOUT",
+    "SOFTWARE",
+    "DEEP_SLEEP_ALARM",
+    "RESET_PIN",
+    "WATCHDOG",
+    "UNKNOWN",
+    "RESCUE_DEBUG",
+]
+_NVM_MAGIC = 0x5A
+_NVM_FORMAT = f"<BI{len(RESET_REASONS)}H"
+
+
+def reset_reason_code(reset_reason):
+    """Returns the index in `RESET_REASONS` of a `microcontroller.ResetReason`"""
+    for code, name in enumerate(RESET_REASONS):
+        if reset_reason == getattr(microcontroller.ResetReason, name, None):
+            return code
+    return RESET_REASONS.index("UNKNOWN")
+
+
+def record_boot(nvm, reason_code, offset=NVM_HEALTH_OFFSET):
+    """
+    Increments the boot count and the count of resets with `reason_code` stored in the `nvm`
+    bytearray, starting both from zero if nothing has been stored yet. Returns the boot count
+    and the list of reset counts.
+    """
+    size = struct.calcsize(_NVM_FORMAT)
+    fields = struct.unpack(_NVM_FORMAT, bytes(nvm[offset : offset + size]))
+    if fields[0] == _NVM_MAGIC:
+        boot_count = fields[1]
+        reset_counts = list(fields[2:])
+    else:
+        boot_count = 0
+        reset_counts = [0] * len(RESET_REASONS)
+    boot_count += 1
+    reset_counts[reason_code] = min(reset_counts[reason_code] + 1, 0xFFFF)
+    nvm[offset : offset + size] = struct.pack(_NVM_FORMAT, _NVM_MAGIC, boot_count, *reset_counts)
+    return boot_count, reset_counts
+
+
+class HeapMonitor:
+    """
+    Tracks the free heap, and the heap in use after each garbage collection over the most recent
+    `HEAP_HISTORY_CHECKS` checks, to estimate how fast the heap in use is growing. The `gc`
+    functions used are only available on CircuitPython; elsewhere, heap metrics are left unset.
+    """
+
+    def __init__(self):
+        self._available = hasattr(gc, "mem_free") and hasattr(gc, "mem_alloc")
+        self._allocated = RingBuffer(HEAP_HISTORY_CHECKS, typecode="L")
+
+    def sample(self, health: ds.DsHealth):
+        """Places the current and minimum free heap into `health`"""
+        if not self._available:
+            return
+        free = gc.mem_free()  # pylint: disable=no-member
+        health.mem_free = free
+        if health.mem_free_min is None or free < health.mem_free_min:
+            health.mem_free_min = free
+
+    def check(self, health: ds.DsHealth, period_s=HEAP_CHECK_PERIOD_S):
+        """
+        Collects garbage, then places the heap growth rate and whether a block of
+        `FRAGMENTATION_PROBE_BYTES` could be allocated into `health`. Should be called once
+        every `period_s` seconds.
+        """
+        if not self._available:
+            return
+        gc.collect()
+        self._allocated.push(gc.mem_alloc())  # pylint: disable=no-member
+        count = len(self._allocated)
+        if count > 1:
+            # for steady growth, the latest value leads the mean by half the window
+            growth = self._allocated.latest() - self._allocated.mean()
+            health.heap_growth_bph = int(growth / ((count - 1) / 2 * period_s) * 3600)
+        try:
+            probe = bytearray(FRAGMENTATION_PROBE_BYTES)
+            del probe
+            health.heap_fragmented = False
+        except MemoryError:
+            health.heap_fragmented = True
+        self.sample(health)
+
+
+class HealthSupervisor:
+    """
+    Feeds the watchdog and publishes health metrics into a DsHealth. `tick()` is called at
+    `rate_hz`, and toggles `feed_pin` to feed the watchdog unless a loop registered with
+    `loops` has stalled.
+    """
+
+    def __init__(
+        self, health: ds.DsHealth, loops: LoopMonitor, heap: HeapMonitor, feed_pin, rate_hz
+    ):
+        self.health = health
+        self.loops = loops
+        self.heap = heap
+        self.feed_pin = feed_pin
+        self.period_ns = int(1e9 / rate_hz)
+        self._start_ns = time.monotonic_ns()
+        self._expected_ns = None
+        self._max_latency_ns = 0
+        self._next_metrics_ns = self._start_ns
+        self._next_heap_check_ns = self._start_ns + int(HEAP_CHECK_PERIOD_S * 1e9)
+
+    def tick(self):
+        """Feeds the watchdog if no task has stalled, and publishes metrics when due"""
+        now_ns = time.monotonic_ns()
+        if self._expected_ns is not None:
+            self._max_latency_ns = max(self._max_latency_ns, now_ns - self._expected_ns)
+        self._expected_ns = now_ns + self.period_ns
+
+        stalled = self.loops.stalled_timer(now_ns)
+        if stalled is None:
+            self.feed_pin.value = not self.feed_pin.value
+        else:
+            self.health.stalled_task = stalled.name
+
+        if now_ns >= self._next_metrics_ns:
+            self._next_metrics_ns += int(METRICS_PERIOD_S * 1e9)
+            self._publish(now_ns)
+        if now_ns >= self._next_heap_check_ns:
+            self._next_heap_check_ns += int(HEAP_CHECK_PERIOD_S * 1e9)
+            self.heap.check(self.health)
+
+    def _publish(self, now_ns):
+        health = self.health
+        health.uptime_s = (now_ns - self._start_ns) // 1_000_000_000
+        health.scheduler_latency_ms = self._max_latency_ns // 1_000_000
+        self._max_latency_ns = 0
+        for timer in self.loops.timers:
+            health.task_overrun_ms[timer.name] = timer.take_max_overrun_ms()
+        self.heap.sample(health)
+
+
+async def health_task(datastore: ds.Datastore, rate_hz=HEALTH_RATE_HZ):
+    """
+    Task to feed the external watchdog and to record reliability metrics in the `datastore`.
+    """
+    health = datastore.health
+    health.reset_reason = reset_reason_code(microcontroller.cpu.reset_reason)
+    if microcontroller.nvm is not None:
+        health.boot_count, health.reset_counts = record_boot(
+            microcontroller.nvm, health.reset_reason
+        )
+    m_feed = PinManager.get_instance().create_digital_in_out(board.WATCHDOG_FEED)
+    feed = m_feed.hold()
+    try:
+        feed.direction = digitalio.Direction.OUTPUT
+        feed.value = False
+        supervisor = HealthSupervisor(
+            health, LoopMonitor.get_instance(), HeapMonitor(), feed, rate_hz
+        )
+        while True:
+            supervisor.tick()
+            await asyncio.sleep(1 / rate_hz)
+    finally:
+        m_feed.release()
@@ -0,0 +1,214 @@
+"""
+Module to supervise the MPPT and to record the power harvested by the solar array. Panel
+currents are sampled every tick and panel temperatures less often, and the energy harvested is
+accumulated into bins covering the last orbit.
+"""
+
+import time
+import asyncio
+import digitalio
+
+import datastore as ds
+from ads1118 import Ads1118, MuxSelection, SamplingRate
+from loop_monitor import LoopMonitor
+from pin_manager import PinManager
+from ring_buffer import RingBuffer
+
+import board
+
+SOLAR_RATE_HZ = 10
+TEMPERATURE_DIVIDER = 10  # panel temperatures are sampled once every this many ticks
+
+# TODO: Verify these against the solar array schematic and sensor datasheets
+PANEL_ADC_CS_PINS = ["SA_ADC_CS1", "SA_ADC_CS2", "SA_ADC_CS3", "SA_ADC_CS4"]
+PANEL_CURRENT_CHANNEL = MuxSelection.CH3_SINGLE_END
+# (ADC channel, panel attribute) of each temperature sensor on a panel
+PANEL_TEMPERATURE_CHANNELS = [
+    (MuxSelection.CH0_SINGLE_END, "top_temperature"),
+    (MuxSelection.CH1_SINGLE_END, "middle_temperature"),
+    (MuxSelection.CH2_SINGLE_END, "bottom_temperature"),
+]
+PANEL_CURRENT_A_PER_V = 1.0
+PANEL_TEMPERATURE_OFFSET_V = 0.5
+PANEL_TEMPERATURE_V_PER_C = 0.01
+
+POWER_WINDOW_S = 60  # window for average and peak array power
+HARVEST_BIN_S = 10
+HARVEST_WINDOW_S = 5400  # TODO: Match this to the orbital period
+
+# TODO: Verify the MPPT status pin behavior against the MPPT datasheet
+STATUS_WINDOW_S = 4
+STATUS_FAULT_MIN_CHANGES = 2
+
+
+class MpptChargingStage:
+    """
+    Charging stages of the MPPT, as decoded from its status pin and stored in
+    `DsMppt.charging_stage`.
+    """
+
+    NOT_CHARGING = 0
+    CHARGING = 1
+    FAULTED = 2
+
+
+class MpptStatusDecoder:
+    """
+    Decodes the charging stage and fault state of the MPPT from successive samples of its
+    status pin taken at `rate_hz`. The pin is low while charging, high when not charging, and
+    blinks when the MPPT has faulted.
+    """
+
+    def __init__(self, rate_hz=SOLAR_RATE_HZ):
+        self._changes = RingBuffer(int(STATUS_WINDOW_S * rate_hz), typecode="B")
+        self._last_level = None
+
+    def update(self, level, mppt: ds.DsMppt):
+        """Records a sample of the status pin and places the decoded state into `mppt`"""
+        changed = self._last_level is not None and level != self._last_level
+        self._last_level = level
+        self._changes.push(1 if changed else 0)
+        if self._changes.sum() >= STATUS_FAULT_MIN_CHANGES:
+            mppt.charging_stage = MpptChargingStage.FAULTED
+            mppt.fault = "status pin blinking"
+        else:
+            mppt.charging_stage = (
+                MpptChargingStage.NOT_CHARGING if level else MpptChargingStage.CHARGING
+            )
+            mppt.fault = None
+
+
+class HarvestAccumulator:
+    """
+    Accumulates the energy harvested by the solar array, both in total and over the most recent
+    `HARVEST_WINDOW_S` seconds. Energy is added to a bin until the bin spans `HARVEST_BIN_S`
+    seconds, at which point the bin is pushed into a ring buffer of recent bins.
+    """
+
+    def __init__(self):
+        self.total_wh = 0.0
+        self._bins = RingBuffer(HARVEST_WINDOW_S // HARVEST_BIN_S, sample_period=HARVEST_BIN_S)
+        self._bin_wh = 0.0
+        self._bin_s = 0.0
+
+    def add(self, power_w, duration_s):
+        """Adds the energy harvested at `power_w` watts over `duration_s` seconds"""
+        energy_wh = power_w * duration_s / 3600
+        self.total_wh += energy_wh
+        self._bin_wh += energy_wh
+        self._bin_s += duration_s
+        if self._bin_s >= HARVEST_BIN_S:
+            self._bins.push(self._bin_wh)
+            self._bin_wh = 0.0
+            self._bin_s -= HARVEST_BIN_S
+
+    def recent_wh(self, duration_s=None):
+        """
+        Returns the energy harvested over the most recent `duration_s` seconds, in whole bins, or
+        over the full window if `duration_s` is None.
+        """
+        if duration_s is None:
+            return self._bins.sum() + self._bin_wh
+        return self._bins.window_sum(duration_s) + self._bin_wh
+
+
+def panel_current(voltage):
+    """Converts the voltage measured on a panel's current sense channel to amps"""
+    return voltage * PANEL_CURRENT_A_PER_V
+
+
+def panel_temperature(voltage):
+    """Converts the voltage measured on a panel's temperature channel to degrees Celsius"""
+    return (voltage - PANEL_TEMPERATURE_OFFSET_V) / PANEL_TEMPERATURE_V_PER_C
+
+
+class SolarArrayMonitor:
+    """
+    Computes panel and array power from the panel currents in the datastore and accumulates the
+    energy harvested by the array, placing the results back into the datastore.
+    """
+
+    def __init__(self, datastore: ds.Datastore, rate_hz=SOLAR_RATE_HZ):
+        self.datastore = datastore
+        self.harvest = HarvestAccumulator()
+        self.panel_harvests = [0.0] * len(datastore.solar_array.panels)
+        self.power_window = RingBuffer(int(POWER_WINDOW_S * rate_hz), sample_period=1 / rate_hz)
+        self._last_time_ns = None
+
+    def update(self, time_ns):
+        """Updates power and harvest statistics for readings taken at `time_ns`"""
+        array = self.datastore.solar_array
+        voltage = self.datastore.mppt.input_voltage
+        dt = 0 if self._last_time_ns is None else (time_ns - self._last_time_ns) / 1e9
+        self._last_time_ns = time_ns
+        total_w = 0.0
+        for i, panel in enumerate(array.panels):
+            if voltage is None or panel.output_current is None:
+                panel.power_w = None
+                continue
+            panel.power_w = voltage * panel.output_current
+            total_w += panel.power_w
+            self.panel_harvests[i] += panel.power_w * dt / 3600
+            panel.energy_harvested_wh = self.panel_harvests[i]
+        array.power_w = total_w
+        self.power_window.push(total_w)
+        self.harvest.add(total_w, dt)
+        array.average_power_w = self.power_window.mean()
+        array.peak_power_w = self.power_window.max()
+        array.energy_harvested_wh = self.harvest.total_wh
+        array.recent_energy_wh = self.harvest.recent_wh()
+
+
+async def sample_panel(adc: Ads1118, panel: ds.DsSolarPanel, temperatures=False):
+    """
+    Samples the output current of a panel, and its temperatures if `temperatures` is True,
+    placing the readings into `panel`.
+    """
+    voltage = await adc.take_sample(PANEL_CURRENT_CHANNEL, sample_rate=SamplingRate.RATE_860)
+    panel.output_current = panel_current(voltage)
+    if temperatures:
+        for channel, field in PANEL_TEMPERATURE_CHANNELS:
+            voltage = await adc.take_sample(channel, sample_rate=SamplingRate.RATE_860)
+            setattr(panel, field, panel_temperature(voltage))
+
+
+async def solar_array_task(datastore: ds.Datastore, rate_hz=SOLAR_RATE_HZ):
+    """
+    Task which enables the MPPT, decodes its status, samples the solar array ADCs, and records
+    panel power and harvested energy in the `datastore`.
+    """
+    pm = PinManager.get_instance()
+    adcs = [
+        Ads1118(board.ADC_SCK, board.ADC_MOSI, board.ADC_MISO, getattr(board, cs))
+        for cs in PANEL_ADC_CS_PINS
+    ]
+    m_enable = pm.create_digital_in_out(board.MPPT_EN)
+    m_status = pm.create_digital_in_out(board.MPPT_STATUS)
+    enable = m_enable.hold()
+    status = m_status.hold()
+    try:
+        enable.direction = digitalio.Direction.OUTPUT
+        enable.value = True
+        status.direction = digitalio.Direction.INPUT
+        datastore.mppt.enabled = True
+        decoder = MpptStatusDecoder(rate_hz)
+        monitor = SolarArrayMonitor(datastore, rate_hz)
+        panels = datastore.solar_array.panels
+        loop_timer = LoopMonitor.get_instance().register("solar_array", 1 / rate_hz)
+        tick = 0
+        while True:
+            loop_timer.tick()
+            start_s = time.monotonic()
+            decoder.update(status.value, datastore.mppt)
+            await asyncio.gather(
+                *[
+                    sample_panel(adc, panel, tick % TEMPERATURE_DIVIDER == 0)
+                    for adc, panel in zip(adcs, panels)
+                ]
+            )
+            monitor.update(time.monotonic_ns())
+            tick += 1
+            await asyncio.sleep(max(0, 1 / rate_hz - (time.monotonic() - start_s)))
+    finally:
+        m_enable.release()
+        m_status.release()
@@ -0,0 +1,249 @@
+"""
+Module to estimate the state of charge of the EPS battery pack by coulomb counting, corrected
+against the open-circuit voltage of the cells.
+"""
+
+import asyncio
+
+import datastore as ds
+from loop_monitor import LoopMonitor
+
+# TODO: Verify these values against the cell datasheet and characterization testing
+STRING_CAPACITY_MAH = 3000
+CELL_INTERNAL_RESISTANCE_OHM = 0.05
+CELLS_PER_STRING = 2
+STRING_COUNT = 3
+# open-circuit cell voltage at 0%, 10%, ..., 100% state of charge
+OCV_TABLE_V = [3.00, 3.45, 3.55, 3.62, 3.68, 3.74, 3.80, 3.87, 3.95, 4.05, 4.20]
+
+SOC_RATE_HZ = 1  # rate at which the task runs if no new string current readings arrive
+PROCESS_NOISE_PER_S = 1e-7  # variance added to the estimate per second
+MEASUREMENT_NOISE_V2 = 1e-3  # variance of the OCV measurement model
+INITIAL_VARIANCE = 0.05
+REST_CURRENT_A = 0.05  # pack currents below this are treated as resting
+MIN_CAPACITY_SOC_SPAN = 0.2  # smallest SOC change used to re-estimate capacity
+CAPACITY_GAIN = 0.1  # weight given to each new capacity estimate
+CURRENT_SMOOTHING = 0.05  # weight given to each new current sample for time-to-empty
+
+# names of the string current measurements in `Datastore.sampling`
+STRING_CURRENT_MEASUREMENTS = [
+    "string_1_output_current",
+    "string_2_output_current",
+    "string_3_output_current",
+]
+
+_SOC_STEP = 1 / (len(OCV_TABLE_V) - 1)
+
+_wakeup = asyncio.Event()
+
+
+def notify_string_current():
+    """
+    Wakes the state of charge task before its next tick is due. Should be called whenever new
+    string current readings are placed into the datastore.
+    """
+    _wakeup.set()
+
+
+def _build_energy_table():
+    # energy (in volt-fractions of capacity) stored in a cell between 0% and each table point,
+    # by trapezoidal integration of the OCV curve
+    res = [0.0]
+    for i in range(1, len(OCV_TABLE_V)):
+        res.append(res[-1] + (OCV_TABLE_V[i - 1] + OCV_TABLE_V[i]) / 2 * _SOC_STEP)
+    return res
+
+
+_ENERGY_TABLE = _build_energy_table()
+
+
+def _table_index(soc):
+    index = int(soc / _SOC_STEP)
+    return min(max(index, 0), len(OCV_TABLE_V) - 2)
+
+
+def ocv_from_soc(soc):
+    """Returns the open-circuit cell voltage at a state of charge, by linear interpolation"""
+    index = _table_index(soc)
+    fraction = soc / _SOC_STEP - index
+    return OCV_TABLE_V[index] + fraction * (OCV_TABLE_V[index + 1] - OCV_TABLE_V[index])
+
+
+def ocv_slope(soc):
+    """Returns the derivative of open-circuit cell voltage with respect to state of charge"""
+    index = _table_index(soc)
+    return (OCV_TABLE_V[index + 1] - OCV_TABLE_V[index]) / _SOC_STEP
+
+
+def soc_from_ocv(voltage):
+    """Returns the state of charge at an open-circuit cell voltage, clamped to [0, 1]"""
+    if voltage <= OCV_TABLE_V[0]:
+        return 0.0
+    for i in range(1, len(OCV_TABLE_V)):
+        if voltage <= OCV_TABLE_V[i]:
+            fraction = (voltage - OCV_TABLE_V[i - 1]) / (OCV_TABLE_V[i] - OCV_TABLE_V[i - 1])
+            return (i - 1 + fraction) * _SOC_STEP
+    return 1.0
+
+
+def cell_energy_fraction(soc):
+    """Returns the energy stored in a cell at a state of charge, in volts times capacity"""
+    index = _table_index(soc)
+    fraction = soc / _SOC_STEP - index
+    v_at_soc = ocv_from_soc(soc)
+    return _ENERGY_TABLE[index] + (OCV_TABLE_V[index] + v_at_soc) / 2 * fraction * _SOC_STEP
+
+
+class SocEstimator:
+    """
+    Extended Kalman filter estimating the state of charge of the battery pack. The usable
+    capacity is re-estimated whenever the pack rests at two sufficiently different states of
+    charge, so that capacity fade is tracked.
+
+    Currents are in amps and are positive when the pack is discharging.
+    """
+
+    def __init__(self, capacity_mah=STRING_CAPACITY_MAH * STRING_COUNT):
+        self.capacity_mah = capacity_mah
+        self.soc = None
+        self.variance = INITIAL_VARIANCE
+        self.average_current = 0.0
+        self._last_current = None
+        self._last_time_ns = None
+        self._rest_soc = None
+        self._charge_since_rest_mah = 0.0
+
+    def update(self, pack_current, cell_voltage, time_ns):
+        """
+        Updates the estimate with a new pack current and average cell voltage measured at
+        `time_ns` (from `time.monotonic_ns()`).
+        """
+        if self.soc is None:
+            self.soc = soc_from_ocv(cell_voltage + self._cell_ir_drop(pack_current))
+        else:
+            self._predict(pack_current, time_ns)
+            self._correct(pack_current, cell_voltage)
+        self._last_current = pack_current
+        self._last_time_ns = time_ns
+        self.average_current += CURRENT_SMOOTHING * (pack_current - self.average_current)
+        if abs(pack_current) < REST_CURRENT_A:
+            self._update_capacity()
+
+    def _cell_ir_drop(self, pack_current):
+        return pack_current / STRING_COUNT * CELL_INTERNAL_RESISTANCE_OHM
+
+    def _predict(self, pack_current, time_ns):
+        dt = (time_ns - self._last_time_ns) / 1e9
+        if dt <= 0:
+            return
+        charge_mah = (self._last_current + pack_current) / 2 * dt / 3.6
+        self._charge_since_rest_mah += charge_mah
+        self.soc = min(max(self.soc - charge_mah / self.capacity_mah, 0.0), 1.0)
+        self.variance += PROCESS_NOISE_PER_S * dt
+
+    def _correct(self, pack_current, cell_voltage):
+        predicted = ocv_from_soc(self.soc) - self._cell_ir_drop(pack_current)
+        slope = ocv_slope(self.soc)
+        gain = self.variance * slope / (slope * slope * self.variance + MEASUREMENT_NOISE_V2)
+        self.soc = min(max(self.soc + gain * (cell_voltage - predicted), 0.0), 1.0)
+        self.variance *= 1 - gain * slope
+
+    def _update_capacity(self):
+        if self._rest_soc is not None:
+            soc_span = self._rest_soc - self.soc
+            if abs(soc_span) < MIN_CAPACITY_SOC_SPAN:
+                return
+            measured = self._charge_since_rest_mah / soc_span
+            if measured > 0:
+                self.capacity_mah += CAPACITY_GAIN * (measured - self.capacity_mah)
+        self._rest_soc = self.soc
+        self._charge_since_rest_mah = 0.0
+
+    def remaining_energy_wh(self):
+        """Returns the energy remaining in the pack, in watt-hours"""
+        return (
+            cell_energy_fraction(self.soc)
+            * CELLS_PER_STRING
+            * self.capacity_mah
+            / 1000
+        )
+
+    def time_to_empty_s(self):
+        """
+        Returns the time until the pack is empty at the recent average discharge current, in
+        seconds, or None if the pack is not discharging.
+        """
+        if self.average_current < REST_CURRENT_A:
+            return None
+        return self.soc * self.capacity_mah * 3.6 / self.average_current
+
+    def publish(self, batteries: ds.DsBatteryPack):
+        """Places the current estimate into the battery pack datastore"""
+        batteries.pack_capacity_mah = self.capacity_mah
+        batteries.filled_capacity_mah = self.soc * self.capacity_mah
+        batteries.state_of_charge = self.soc
+        batteries.remaining_energy_wh = self.remaining_energy_wh()
+        batteries.time_to_empty_s = self.time_to_empty_s()
+
+
+def pack_measurements(batteries: ds.DsBatteryPack):
+    """
+    Returns the total pack current and the average cell voltage from the battery strings in
+    the datastore, or None if any of the readings needed have not been taken yet.
+    """
+    current = 0.0
+    voltage = 0.0
+    for string in [batteries.string_1, batteries.string_2, batteries.string_3]:
+        if (
+            string.output_current is None
+            or string.top_cell_voltage is None
+            or string.bottom_cell_voltage is None
+        ):
+            return None
+        current += string.output_current
+        voltage += string.top_cell_voltage + string.bottom_cell_voltage
+    return current, voltage / (STRING_COUNT * CELLS_PER_STRING)
+
+
+def pack_sample_time_ns(datastore: ds.Datastore, since_ns=None):
+    """
+    Returns the time (from `time.monotonic_ns()`) at which the latest string current readings
+    in the `datastore` were completed, or None unless every string current has been sampled
+    after `since_ns`.
+    """
+    res = None
+    for name in STRING_CURRENT_MEASUREMENTS:
+        sampling = datastore.sampling.get(name)
+        if sampling is None or sampling.last_time_ns is None:
+            return None
+        if since_ns is not None and sampling.last_time_ns <= since_ns:
+            return None
+        if res is None or sampling.last_time_ns > res:
+            res = sampling.last_time_ns
+    return res
+
+
+async def state_of_charge_task(datastore: ds.Datastore, rate_hz=SOC_RATE_HZ):
+    """
+    Task to estimate the battery pack state of charge from the battery readings in the
+    `datastore`, and to place the estimate back into the `datastore`.
+
+    The estimate is updated once every string current has been sampled again, which wakes the
+    task through `notify_string_current()`, using the time at which the readings were taken.
+    """
+    estimator = SocEstimator()
+    loop_timer = LoopMonitor.get_instance().register("state_of_charge", 1 / rate_hz)
+    last_time_ns = None
+    while True:
+        loop_timer.tick()
+        time_ns = pack_sample_time_ns(datastore, last_time_ns)
+        measurements = pack_measurements(datastore.batteries)
+        if time_ns is not None and measurements is not None:
+            estimator.update(measurements[0], measurements[1], time_ns)
+            estimator.publish(datastore.batteries)
+            last_time_ns = time_ns
+        try:
+            await asyncio.wait_for(_wakeup.wait(), 1 / rate_hz)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
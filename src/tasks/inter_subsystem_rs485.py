@@ -1,6 +1,375 @@
 """
 Task to communicate with other subsystems over an RS485 bus.
+
+Each frame carries a payload and its CRC-16, COBS-encoded and surrounded by zero bytes, so a
+receiver resynchronizes at the next zero byte after a corrupted frame. Every payload starts with
+the address of a subsystem and a message ID, and replies carry the ID of their request with
+`REPLY_FLAG` set.
 """
 
-# annie has some code for this on her laptop that she was testing, once it's
-# ready and encapsulated into a task it should go here.
+import time
+import array
+import asyncio
+import digitalio
+
+from pin_manager import PinManager
+
+# TODO: Agree on the baud rate and maximum payload with the other subsystems
+RS485_BAUDRATE = 115200
+MAX_PAYLOAD_SIZE = 256
+POLL_PERIOD_S = 0.005
+UART_RECEIVE_BUFFER_SIZE = 1024  # about 90 ms of data at 115200 baud
+RECEIVE_CHUNK_SIZE = 128
+TX_GUARD_S = 0.002  # end of each transmission waited out without yielding to other tasks
+
+CRC_SIZE = 2
+HEADER_SIZE = 2
+REPLY_FLAG = 0x80
+
+
+class Address:
+    """Addresses of the nodes on the inter-subsystem bus"""
+
+    CDH = 0x01
+    EPS = 0x02
+    ADCS = 0x03
+
+
+class MessageId:
+    """
+    IDs of the messages in the inter-subsystem ICD. Telemetry replies carry the fields of the
+    matching group of `DatastoreSnapshot` fields, and commands are acknowledged with a single
+    `Status` byte. A delta telemetry request carries the ID of a telemetry group, followed by
+    the sequence number of the last delta frame of that group received (if any), and is answered
+    with the group's ID and a `telemetry_codec` frame. The `BULK_` messages are described in the
+    `bulk_transfer` module. A request which cannot be handled is answered with a `NACK` carrying
+    the ID of the request and a `Status`.
+    """
+
+    PING = 0x01
+    NACK = 0x7F
+    EPS_BATTERY_TELEMETRY = 0x10
+    EPS_BUS_TELEMETRY = 0x11
+    EPS_SOLAR_TELEMETRY = 0x12
+    EPS_HEALTH_TELEMETRY = 0x13
+    EPS_DELTA_TELEMETRY = 0x14
+    EPS_SET_BUS_ENABLES = 0x20
+    BULK_INFO = 0x30
+    BULK_READ = 0x31
+
+
+class Status:
+    """Result codes carried in command acknowledgements and NACKs"""
+
+    OK = 0
+    UNKNOWN_MESSAGE = 1
+    BAD_LENGTH = 2
+    BAD_VALUE = 3
+
+
+def max_frame_size(max_payload):
+    """Returns the size of the largest encoded frame for payloads of up to `max_payload` bytes"""
+    # COBS adds one byte, plus one more per 254 bytes of data, and delimiters surround the frame
+    data_size = max_payload + CRC_SIZE
+    return data_size + data_size // 254 + 3
+
+
+def _build_crc_table():
+    table = array.array("H", [0] * 256)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[i] = crc & 0xFFFF
+    return table
+
+
+_CRC_TABLE = _build_crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """Returns the CRC-16/CCITT-FALSE of `data`, continuing from `crc`"""
+    table = _CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def cobs_encode_into(data, length, out):
+    """
+    Encodes the first `length` bytes of `data` with COBS into `out`, without the trailing zero
+    delimiter, and returns the number of bytes written.
+    """
+    code_index = 0
+    out_index = 1
+    code = 1
+    for i in range(length):
+        byte = data[i]
+        if byte:
+            out[out_index] = byte
+            out_index += 1
+            code += 1
+        if not byte or code == 0xFF:
+            out[code_index] = code
+            code_index = out_index
+            out_index += 1
+            code = 1
+    out[code_index] = code
+    return out_index
+
+
+def encode_frame_into(payload, length, out):
+    """
+    Encodes a frame carrying the first `length` bytes of the bytearray `payload` into `out`,
+    including the CRC and both delimiters, and returns the size of the frame. `payload` must
+    have room for the CRC after its first `length` bytes.
+    """
+    crc = crc16(memoryview(payload)[:length])
+    payload[length] = crc >> 8
+    payload[length + 1] = crc & 0xFF
+    out[0] = 0
+    size = cobs_encode_into(payload, length + CRC_SIZE, memoryview(out)[1:])
+    out[size + 1] = 0
+    return size + 2
+
+
+def cobs_decode_in_place(buffer, length):
+    """
+    Decodes the first `length` bytes of `buffer`, which hold a COBS-encoded frame without its
+    delimiter, in place. Returns the decoded length, or -1 if the encoding is invalid.
+    """
+    view = memoryview(buffer)
+    read = 0
+    write = 0
+    while read < length:
+        code = buffer[read]
+        if code == 0 or read + code > length:
+            return -1
+        read += 1
+        count = code - 1
+        # decoded data never gets ahead of the encoded data, so copying forward is safe
+        view[write : write + count] = view[read : read + count]
+        write += count
+        read += count
+        if code < 0xFF and read < length:
+            buffer[write] = 0
+            write += 1
+    return write
+
+
+class LinkStats:
+    """
+    Counters for a Rs485Link. Includes frames sent and received, frames discarded for a bad
+    CRC, an invalid encoding, or exceeding the maximum frame size, and the number of times the
+    UART's receive buffer was found full when polled (which means bytes may have been lost).
+    """
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.crc_errors = 0
+        self.framing_errors = 0
+        self.oversize_frames = 0
+        self.receive_buffer_full = 0
+
+
+class Rs485Link:
+    """
+    Link layer over a half-duplex RS485 transceiver connected to the `tx`, `rx`, and `de` pins.
+    DE is raised only while a frame is transmitted, and transmitting yields to other tasks for
+    all but the last `TX_GUARD_S` of each frame. Frame callbacks cannot await, so they queue their
+    reply for the next `flush()`. Polling never blocks, and receiving allocates no memory.
+
+    The UART and DE pin are held for the lifetime of the link; call `close()` to release them.
+    """
+
+    def __init__(self, tx, rx, de, *, baudrate=RS485_BAUDRATE, max_payload=MAX_PAYLOAD_SIZE):
+        pm = PinManager.get_instance()
+        self._m_uart = pm.create_uart(
+            tx,
+            rx,
+            baudrate=baudrate,
+            timeout=0,
+            receiver_buffer_size=UART_RECEIVE_BUFFER_SIZE,
+        )
+        self._m_de = pm.create_digital_in_out(de)
+        self.uart = self._m_uart.hold()
+        self.de = self._m_de.hold()
+        self.de.direction = digitalio.Direction.OUTPUT
+        self.de.value = False
+        # rounded up, so the bus is never released before the last bit has left (8N1 framing)
+        self.byte_time_ns = -(-10_000_000_000 // baudrate)
+        self.max_payload = max_payload
+        self.stats = LinkStats()
+
+        frame_size = max_frame_size(max_payload)
+        self._tx_payload = bytearray(max_payload + CRC_SIZE)
+        self.tx_payload = memoryview(self._tx_payload)[:max_payload]
+        self._tx_frame = bytearray(frame_size)
+        self._tx_view = memoryview(self._tx_frame)
+        self._tx_pending = None
+        self._transmitting = False
+        self._rx_chunk = bytearray(RECEIVE_CHUNK_SIZE)
+        self._rx_chunk_view = memoryview(self._rx_chunk)
+        self._rx_frame = bytearray(frame_size)
+        self._rx_view = memoryview(self._rx_frame)
+        self._rx_length = 0
+        self._rx_overflowed = False
+
+    def close(self):
+        """Releases the UART and DE pin"""
+        self._m_uart.release()
+        self._m_de.release()
+
+    def encode(self, payload):
+        """
+        Encodes `payload` into the link's transmit buffer and returns a memoryview of the
+        complete frame, including its delimiters.
+        """
+        length = len(payload)
+        if length > self.max_payload:
+            raise ValueError("Payload exceeds the maximum payload size")
+        self._tx_payload[:length] = payload
+        return self._tx_view[: encode_frame_into(self._tx_payload, length, self._tx_frame)]
+
+    def encode_prepared(self, length):
+        """
+        Encodes the first `length` bytes of `tx_payload`, which the caller has filled in place,
+        and returns a memoryview of the complete frame. This avoids copying payloads which can
+        be read straight into the link's transmit buffer.
+        """
+        if length > self.max_payload:
+            raise ValueError("Payload exceeds the maximum payload size")
+        return self._tx_view[: encode_frame_into(self._tx_payload, length, self._tx_frame)]
+
+    async def send(self, payload):
+        """Transmits `payload` as a single frame, after any frame queued before it"""
+        await self.flush()
+        await self.write_frame(self.encode(payload))
+
+    async def send_prepared(self, length):
+        """
+        Transmits the first `length` bytes of `tx_payload` as a single frame, after any frame
+        queued before it. See `encode_prepared()`.
+        """
+        await self.flush()
+        await self.write_frame(self.encode_prepared(length))
+
+    def queue_frame(self, frame):
+        """
+        Queues an already-encoded frame to be transmitted by the next `flush()`, for callers
+        such as frame callbacks which cannot await. Replaces any frame queued before it. A
+        frame returned by `encode()` must be flushed before the link encodes another.
+        """
+        self._tx_pending = frame
+
+    async def flush(self):
+        """Transmits the frame queued by `queue_frame()`, if there is one"""
+        frame = self._tx_pending
+        if frame is not None:
+            self._tx_pending = None
+            await self.write_frame(frame)
+
+    async def write_frame(self, frame):
+        """
+        Transmits an already-encoded frame, driving the bus only while it is sent. Other tasks
+        run while the frame is sent, except for the last `TX_GUARD_S`; a task which holds the
+        event loop past that point keeps the bus driven until it yields.
+        """
+        if self._transmitting:
+            raise RuntimeError("Link is already transmitting a frame")
+        self._transmitting = True
+        try:
+            start_ns = time.monotonic_ns()
+            self.de.value = True
+            self.uart.write(frame)
+            # the UART may return while the frame is still being shifted out, so hold the bus
+            # until the whole frame has had time to leave
+            end_ns = start_ns + len(frame) * self.byte_time_ns
+            remaining_s = (end_ns - time.monotonic_ns()) / 1e9
+            if remaining_s > TX_GUARD_S:
+                await asyncio.sleep(remaining_s - TX_GUARD_S)
+            # resuming from an await may be late, so the end of the frame is waited out here
+            remaining_s = (end_ns - time.monotonic_ns()) / 1e9
+            if remaining_s > 0:
+                time.sleep(remaining_s)
+            self.de.value = False
+        finally:
+            self._transmitting = False
+        self.stats.frames_sent += 1
+
+    def poll(self, on_frame):
+        """
+        Reads the bytes waiting in the UART without blocking, and calls `on_frame` with a
+        memoryview of the payload of each valid frame completed by those bytes. The memoryview
+        is only valid until `on_frame` returns. Returns the number of frames received.
+        """
+        received = 0
+        while True:
+            waiting = self.uart.in_waiting
+            if not waiting:
+                return received
+            if waiting >= UART_RECEIVE_BUFFER_SIZE:
+                self.stats.receive_buffer_full += 1
+            count = self.uart.readinto(self._rx_chunk_view[: min(waiting, RECEIVE_CHUNK_SIZE)])
+            if not count:
+                return received
+            received += self._consume(count, on_frame)
+
+    def _consume(self, count, on_frame):
+        received = 0
+        chunk = self._rx_chunk
+        start = 0
+        for i in range(count):
+            if chunk[i]:
+                continue
+            self._append(start, i)
+            if self._finish_frame(on_frame):
+                received += 1
+            start = i + 1
+        self._append(start, count)
+        return received
+
+    def _append(self, start, end):
+        # copies part of the chunk onto the frame being received, noting if it no longer fits
+        length = end - start
+        if self._rx_overflowed or length == 0:
+            return
+        if self._rx_length + length > len(self._rx_frame):
+            self._rx_overflowed = True
+            return
+        self._rx_view[self._rx_length : self._rx_length + length] = self._rx_chunk_view[
+            start:end
+        ]
+        self._rx_length += length
+
+    def _finish_frame(self, on_frame):
+        length = self._rx_length
+        overflowed = self._rx_overflowed
+        self._rx_length = 0
+        self._rx_overflowed = False
+        if overflowed:
+            self.stats.oversize_frames += 1
+            return False
+        if length == 0:
+            return False
+        decoded = cobs_decode_in_place(self._rx_frame, length)
+        if decoded < CRC_SIZE:
+            self.stats.framing_errors += 1
+            return False
+        if crc16(self._rx_view[:decoded]) != 0:
+            self.stats.crc_errors += 1
+            return False
+        self.stats.frames_received += 1
+        on_frame(self._rx_view[: decoded - CRC_SIZE])
+        return True
+
+    async def run(self, on_frame, poll_period_s=POLL_PERIOD_S):
+        """
+        Polls the link forever, calling `on_frame` with the payload of each frame received and
+        sending any reply it queues
+        """
+        while True:
+            self.poll(on_frame)
+            await self.flush()
+            await asyncio.sleep(poll_period_s)
@@ -0,0 +1,77 @@
+"""
+Host-side micro-benchmark for the PinManager context fast path.
+
+Measures how many contexts per second can be opened and closed on an already-running
+ManagedDevice, both through `with` blocks and through the explicit hold()/release() API,
+as well as the cost of looking up a cached device. Run from the root of the repository:
+
+    python tools/pin_manager_benchmark.py
+"""
+
+import argparse
+import os
+import sys
+import time
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.join(".", "src", "lib"))
+sys.path.append(os.path.join(".", "unit_tests", "lib"))
+
+# custom_module_mocking registers stand-ins for digitalio and busio on import
+import custom_module_mocking  # noqa: E402
+
+sys.modules.setdefault("analogio", MagicMock())
+custom_module_mocking.busio.SPI = custom_module_mocking.SPI_Test
+
+import pin_manager  # noqa: E402
+
+
+def _rate(label, iterations, function):
+    t0 = time.perf_counter()
+    function(iterations)
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<32} {iterations / elapsed:>14,.0f} /s")
+
+
+def bench_with_blocks(iterations):
+    spi = pin_manager.PinManager().create_spi("SCK", "MOSI", "MISO")
+    for _ in range(iterations):
+        with spi:
+            pass
+
+
+def bench_hold_release(iterations):
+    spi = pin_manager.PinManager().create_spi("SCK", "MOSI", "MISO")
+    for _ in range(iterations):
+        spi.hold()
+        spi.release()
+
+
+def bench_device_lookup(iterations):
+    pm = pin_manager.PinManager()
+    for _ in range(iterations):
+        pm.create_spi("SCK", "MOSI", "MISO")
+
+
+def bench_pin_swapping(iterations):
+    pm = pin_manager.PinManager()
+    spi = pm.create_spi("SCK", "MOSI", "MISO")
+    drdy = pm.create_digital_in_out("MISO")
+    for _ in range(iterations):
+        with spi:
+            pass
+        with drdy:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure PinManager context overhead on the host."
+    )
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    _rate("with-block contexts", args.iterations, bench_with_blocks)
+    _rate("hold()/release() contexts", args.iterations, bench_hold_release)
+    _rate("cached device lookups", args.iterations, bench_device_lookup)
+    _rate("SPI <-> GPIO swaps", args.iterations // 10, bench_pin_swapping)
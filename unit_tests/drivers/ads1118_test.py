@@ -1,10 +1,15 @@
 import unittest
 
 import ads1118
+import custom_module_mocking
+import pin_manager
 
 
 class ADS1118_Test(unittest.TestCase):
 
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
     _NON_BYTE_OBJECTS = [object(), {}, [], 3.0, -1, 256]
 
     def test_channel_parameter_validation(self):
@@ -245,6 +250,76 @@ class ADS1118_Test(unittest.TestCase):
                 -fsr[1],
             )
 
+    def test_simulated_sampling(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        with custom_module_mocking.HardwareSimulation() as sim:
+            sim.attach_spi_device(
+                "SCK",
+                custom_module_mocking.SimulatedAds1118(
+                    "CS", "MISO", channels={4: 1.5, 1: -0.25}, temperature=30.0
+                ),
+            )
+            adc = ads1118.Ads1118("SCK", "MOSI", "MISO", "CS")
+            self.assertAlmostEqual(
+                sim.run(adc.take_sample(ads1118.MuxSelection.CH0_SINGLE_END)),
+                1.5,
+                places=3,
+            )
+            self.assertAlmostEqual(
+                sim.run(
+                    adc.take_sample(
+                        ads1118.MuxSelection.CH0_CH3_DIFF,
+                        input_range=ads1118.InputRange.FSR_0_512V,
+                    )
+                ),
+                -0.25,
+                places=4,
+            )
+            self.assertAlmostEqual(
+                sim.run(adc.take_sample(ads1118.MuxSelection.TEMPERATURE)), 30.0
+            )
+
+    def test_spi_bus_kept_running_between_samples(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        pin_manager.PinManager.get_instance().enable_stats()
+        with custom_module_mocking.HardwareSimulation() as sim:
+            sim.attach_spi_device(
+                "SCK", custom_module_mocking.SimulatedAds1118("CS", "MISO")
+            )
+            adc = ads1118.Ads1118("SCK", "MOSI", "MISO", "CS")
+
+            async def sample_repeatedly():
+                for _ in range(10):
+                    await adc.take_sample(ads1118.MuxSelection.CH0_SINGLE_END)
+
+            sim.run(sample_repeatedly())
+            stats = adc.spi_device._bus.spi.stats
+            self.assertEqual(stats.inits, 1)
+            self.assertEqual(stats.deinits, 0)
+
+    def test_simulated_throughput(self):
+        samples = 50
+        rates = {}
+        for poll_drdy in [True, False]:
+            custom_module_mocking.simulate_pin_manager_hardware()
+            with custom_module_mocking.HardwareSimulation() as sim:
+                sim.attach_spi_device(
+                    "SCK", custom_module_mocking.SimulatedAds1118("CS", "MISO")
+                )
+                adc = ads1118.Ads1118("SCK", "MOSI", "MISO", "CS", poll_drdy=poll_drdy)
+
+                async def sample_repeatedly():
+                    for _ in range(samples):
+                        await adc.take_sample(
+                            ads1118.MuxSelection.CH0_SINGLE_END,
+                            sample_rate=ads1118.SamplingRate.RATE_860,
+                        )
+
+                sim.run(sample_repeatedly())
+                rates[poll_drdy] = samples / sim.clock.monotonic()
+        self.assertGreater(rates[False], 400)
+        self.assertGreaterEqual(rates[False], rates[True])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+
+import camera
+import custom_module_mocking
+
+
+def jpeg(size):
+    return b"\xff\xd8" + bytes(i * 7 % 256 for i in range(size - 4)) + b"\xff\xd9"
+
+
+class ArduCam_Test(unittest.TestCase):
+
+    def setUp(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def attach(
+        self, sim, image=b"", capture_time=0.25, chunk_size=camera.DEFAULT_CHUNK_SIZE, plus=False
+    ):
+        device = custom_module_mocking.SimulatedArduCam("CS", image, capture_time, plus)
+        sim.attach_spi_device("SCK", device)
+        return device, camera.ArduCam("SCK", "MOSI", "MISO", "CS", chunk_size=chunk_size, plus=plus)
+
+    def test_registers(self):
+        with custom_module_mocking.HardwareSimulation() as sim:
+            device, cam = self.attach(sim, plus=True)
+            self.assertTrue(cam.probe())
+            self.assertEqual(device.registers[camera.ARDUCHIP_TEST], 0xAA)
+            self.assertEqual(cam.read_register(camera.ARDUCHIP_VERSION), 0x73)
+            self.assertRaises(ValueError, cam.fifo_length)
+        with custom_module_mocking.HardwareSimulation():
+            # nothing answers on the bus
+            self.assertFalse(cam.probe())
+
+    def test_capture_yields_while_polling(self):
+        image = jpeg(3000)
+        ticks = []
+
+        async def other_task():
+            while True:
+                ticks.append(sim.clock.monotonic())
+                await asyncio.sleep(0.005)
+
+        async def run():
+            task = asyncio.create_task(other_task())
+            length = await cam.capture()
+            task.cancel()
+            return length
+
+        with custom_module_mocking.HardwareSimulation() as sim:
+            device, cam = self.attach(sim, image, capture_time=0.25)
+            self.assertEqual(sim.run(run()), len(image))
+            elapsed = sim.clock.monotonic()
+        self.assertEqual(device.captures, 1)
+        self.assertGreaterEqual(elapsed, 0.25)
+        self.assertLess(elapsed, 0.25 + 2 * camera.CAPTURE_POLL_PERIOD_S)
+        self.assertGreaterEqual(len(ticks), 45)
+
+    def test_capture_timeout(self):
+        with custom_module_mocking.HardwareSimulation() as sim:
+            _, cam = self.attach(sim, jpeg(100), capture_time=5)
+            with self.assertRaises(asyncio.TimeoutError):
+                sim.run(cam.capture(timeout=1))
+            self.assertLess(sim.clock.monotonic(), 1.1)
+
+    def test_stream_in_chunks(self):
+        image = jpeg(10000)
+        received = bytearray()
+        chunk_sizes = []
+        buffers = set()
+
+        def sink(position, chunk):
+            self.assertEqual(position, len(received))
+            received.extend(chunk)
+            chunk_sizes.append(len(chunk))
+            buffers.add(id(chunk.obj))
+            # the bus is free for other transactions between chunks
+            self.assertTrue(cam.probe())
+
+        with custom_module_mocking.HardwareSimulation() as sim:
+            device, cam = self.attach(sim, image, chunk_size=512)
+            self.assertEqual(sim.run(cam.capture()), len(image))
+            self.assertEqual(sim.run(cam.stream(sink)), len(image))
+            self.assertEqual(bytes(received), image)
+            self.assertEqual(chunk_sizes, [512] * 19 + [10000 - 19 * 512])
+            self.assertEqual(len(buffers), 1)
+            self.assertEqual(device.largest_burst, 512)
+
+            # streaming again starts from the beginning of the frame
+            again = bytearray()
+            sim.run(cam.stream(lambda position, chunk: again.extend(chunk)))
+            self.assertEqual(bytes(again), image)
+
+    def test_stream_discards_dummy_bytes(self):
+        image = jpeg(2000)
+        for plus in (False, True):
+            received = bytearray()
+            with custom_module_mocking.HardwareSimulation() as sim:
+                device, cam = self.attach(sim, image, chunk_size=512, plus=plus)
+                sim.run(cam.capture())
+                sim.run(cam.stream(lambda position, chunk: received.extend(chunk)))
+            self.assertEqual(bytes(received), image)
+            # only the 5MP Mini sends a dummy byte, so no FIFO byte is skipped on either camera
+            self.assertEqual(device.bytes_read, len(image))
+
+    def test_stream_with_header_offset(self):
+        image = jpeg(1000)
+        frames = []
+        buffer = bytearray(2 + 200)
+
+        def sink(position, chunk):
+            chunk[0] = position // 200
+            chunk[1] = len(chunk) - 2
+            frames.append(bytes(chunk))
+
+        with custom_module_mocking.HardwareSimulation() as sim:
+            _, cam = self.attach(sim, image)
+            sim.run(cam.capture())
+            sim.run(cam.stream(sink, buffer, offset=2))
+        self.assertEqual([f[0] for f in frames], [0, 1, 2, 3, 4])
+        self.assertEqual(b"".join(f[2:] for f in frames), image)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import custom_module_mocking
+import reaction_wheel
+
+
+async def count_tach_edges(tach, duration_s, poll_period_s=0.0001):
+    edges = 0
+    level = tach.value
+    end_s = time.monotonic() + duration_s
+    while time.monotonic() < end_s:
+        await asyncio.sleep(poll_period_s)
+        if tach.value != level:
+            level = not level
+            edges += 1
+    return edges
+
+
+class ReactionWheel_Test(unittest.TestCase):
+
+    def test_simulated_wheel(self):
+        with patch.object(
+            reaction_wheel.pwmio, "PWMOut", custom_module_mocking.PWMOut_Test
+        ), patch.object(
+            reaction_wheel.digitalio, "DigitalInOut", custom_module_mocking.DigitalInOut_Test
+        ), custom_module_mocking.HardwareSimulation() as sim:
+            model = custom_module_mocking.SimulatedReactionWheel("UNSOLL", "DIRO", "FG")
+            model.attach(sim)
+            wheel = reaction_wheel.ReactionWheel("UNSOLL", "DIRO", "FG")
+            tach = custom_module_mocking.DigitalInOut_Test("FG")
+
+            wheel.set_speed_pc(50)
+            self.assertTrue(sim.pin_levels["DIRO"])
+            self.assertEqual(sim.pwm_duty_cycles["UNSOLL"], wheel.get_speed())
+            self.assertAlmostEqual(model.commanded_rpm(), 6000, places=0)
+            sim.run(asyncio.sleep(5))
+            model.update()
+            self.assertAlmostEqual(model.rpm, 6000, delta=1)
+
+            # 6 tachometer pulses, so 12 edges, per revolution
+            edges = sim.run(count_tach_edges(tach, 1.0))
+            self.assertAlmostEqual(edges / 12 * 60, 6000, delta=60)
+
+            wheel.set_speed_pc(-25)
+            self.assertFalse(sim.pin_levels["DIRO"])
+            sim.run(asyncio.sleep(5))
+            model.update()
+            self.assertAlmostEqual(model.rpm, -3000, delta=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
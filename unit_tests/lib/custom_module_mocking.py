@@ -1,5 +1,611 @@
+"""
+Host-side stand-ins for CircuitPython hardware modules, used by unit tests.
+
+By default the stand-ins only track whether they have been deinitialized, and data written
+to them is discarded. Inside a HardwareSimulation context, they are connected to simulated
+peripherals instead: SPI transfers are routed to the SimulatedSpiDevice whose chip-select pin
+is low, UART traffic is exchanged with a SimulatedUartPeer, GPIO reads return levels driven
+by simulated hardware, and PWM outputs are visible to the simulation. A virtual clock
+replaces `time.monotonic()`, `time.monotonic_ns()` and `time.sleep()` and drives an asyncio
+event loop in which sleeping advances virtual time instantly, so driver timing and throughput
+can be measured deterministically:
+```py
+with custom_module_mocking.HardwareSimulation() as sim:
+    sim.attach_spi_device("SCK", custom_module_mocking.SimulatedAds1118("CS", "MISO"))
+    value = sim.run(adc.take_sample(ads1118.MuxSelection.CH0_SINGLE_END))
+    elapsed = sim.clock.monotonic()
+```
+"""
+
+import os
 import sys
+import math
+import mmap
+import random
+import asyncio
+import selectors
 from types import ModuleType
+from unittest.mock import patch
+
+# the HardwareSimulation that is currently active, or None
+simulation = None
+
+
+class VirtualClock:
+    """
+    A monotonic clock which only advances when told to, either explicitly or by the event
+    loop it creates running out of ready tasks.
+    """
+
+    def __init__(self):
+        self.ns = 0
+
+    def monotonic_ns(self):
+        """Stand-in for `time.monotonic_ns()`."""
+        return self.ns
+
+    def monotonic(self):
+        """Stand-in for `time.monotonic()`."""
+        return self.ns / 1e9
+
+    def advance(self, seconds):
+        """Advances virtual time by the given number of seconds, rounded up to the next ns."""
+        self.ns += math.ceil(seconds * 1e9)
+
+    def new_event_loop(self):
+        """Creates an asyncio event loop which uses and advances virtual time."""
+        return _VirtualTimeEventLoop(self)
+
+
+class _VirtualTimeSelector:
+    def __init__(self, clock):
+        self._clock = clock
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Simulation deadlocked: no task will ever become ready")
+        self._clock.advance(timeout)
+        return self._selector.select(0)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class _VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        self._clock = clock
+        super().__init__(_VirtualTimeSelector(clock))
+
+    def time(self):
+        return self._clock.monotonic()
+
+
+class HardwareSimulation:
+    """
+    A set of simulated peripherals attached to pins, along with the virtual clock shared by
+    those peripherals. Use as a context manager to connect the stand-in hardware classes in
+    this module to the simulation and to replace `time.monotonic()`/`time.monotonic_ns()`.
+    """
+
+    # time taken by one GPIO read, which also keeps busy-wait loops from stalling time
+    GPIO_READ_TIME = 1e-6
+
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.pin_levels = {}
+        self.pin_drivers = {}
+        self.pwm_duty_cycles = {}
+        self.spi_devices = {}
+        self.uart_peers = {}
+        self._patches = []
+        self._previous_simulation = None
+
+    def __enter__(self):
+        global simulation
+        self._previous_simulation = simulation
+        simulation = self
+        self._patches = [
+            patch("time.monotonic_ns", self.clock.monotonic_ns),
+            patch("time.monotonic", self.clock.monotonic),
+            patch("time.sleep", self.clock.advance),
+        ]
+        for p in self._patches:
+            p.start()
+        return self
+
+    def __exit__(self, exc_type, exc, exc_trace):
+        global simulation
+        for p in self._patches:
+            p.stop()
+        simulation = self._previous_simulation
+
+    def run(self, coroutine):
+        """Runs a coroutine to completion in virtual time and returns its result."""
+        loop = self.clock.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def attach_spi_device(self, clock_pin, device):
+        """Attaches a SimulatedSpiDevice to the SPI bus with the given clock pin."""
+        self.spi_devices.setdefault(clock_pin, []).append(device)
+        device.simulation = self
+
+    def attach_uart_peer(self, tx_pin, peer):
+        """Attaches a SimulatedUartPeer to the UART transmitting on the given pin."""
+        self.uart_peers[tx_pin] = peer
+        peer.simulation = self
+
+    def drive_pin(self, pin, level_function):
+        """Makes reads of the given pin return the result of calling `level_function()`."""
+        self.pin_drivers[pin] = level_function
+
+    def write_pin(self, pin, value):
+        """Records the level written to a pin by the software under test."""
+        if value is False and self.pin_levels.get(pin) is not False:
+            for devices in self.spi_devices.values():
+                for device in devices:
+                    if device.cs == pin:
+                        device.select()
+        self.pin_levels[pin] = value
+
+    def read_pin(self, pin):
+        """Returns the level of a pin as seen by the software under test."""
+        self.clock.advance(HardwareSimulation.GPIO_READ_TIME)
+        if pin in self.pin_drivers:
+            return self.pin_drivers[pin]()
+        return self.pin_levels.get(pin)
+
+    def selected_spi_device(self, clock_pin):
+        """Returns the device on the given SPI bus with its chip-select low, if any."""
+        for device in self.spi_devices.get(clock_pin, []):
+            if self.pin_levels.get(device.cs) is False:
+                return device
+        return None
+
+
+class SimulatedSpiDevice:
+    """
+    Base class for a simulated peripheral selected by a chip-select pin on a SPI bus.
+    Subclasses override `transfer()` to model the peripheral's registers.
+    """
+
+    def __init__(self, cs):
+        self.cs = cs
+        self.simulation = None
+
+    def select(self):
+        """Called when the chip-select pin goes low, starting a transaction."""
+
+    def transfer(self, out_data, in_buffer):
+        """
+        Called for each full-duplex transfer while selected, with the bytes clocked out to
+        the device. Fills `in_buffer` with the bytes clocked in from the device.
+        """
+        for i in range(len(in_buffer)):
+            in_buffer[i] = 0xFF
+
+
+class SimulatedAds1118(SimulatedSpiDevice):
+    """
+    Register-level model of an ADS1118 in single-shot mode. Channel inputs are given as a dict
+    from the 3-bit MUX value to either a voltage or a function of time in seconds returning a
+    voltage, and the temperature in degrees Celsius is given the same way. When selected, the
+    DOUT/DRDY line on the MISO pin reads low once a conversion has completed.
+    """
+
+    FULL_SCALE_VOLTAGES = [6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256]
+    SAMPLE_RATES = [8, 16, 32, 64, 128, 250, 475, 860]
+
+    def __init__(self, cs, miso, channels=None, temperature=25.0):
+        super().__init__(cs)
+        self.miso = miso
+        self.channels = channels if channels is not None else {}
+        self.temperature = temperature
+        self.conversion_register = 0
+        self.conversions = 0
+        self._conversion_done_ns = None
+        self._pending = None
+
+    def _evaluate(self, source):
+        return source(self.simulation.clock.monotonic()) if callable(source) else source
+
+    def _convert(self, mux, pga, temperature_mode):
+        if temperature_mode:
+            code = round(self._evaluate(self.temperature) / 0.03125) << 2
+        else:
+            voltage = self._evaluate(self.channels.get(mux, 0.0))
+            code = round(voltage * 32768 / SimulatedAds1118.FULL_SCALE_VOLTAGES[pga])
+        return max(-32768, min(32767, code)) & 0xFFFF
+
+    def data_ready(self):
+        """Returns whether the most recently started conversion has completed."""
+        if self._conversion_done_ns is None:
+            return True
+        return self.simulation.clock.monotonic_ns() >= self._conversion_done_ns
+
+    def drdy_level(self):
+        """Level of the DOUT/DRDY line, which is only driven while the device is selected."""
+        if self.simulation.pin_levels.get(self.cs) is not False:
+            return True
+        return not self.data_ready()
+
+    def transfer(self, out_data, in_buffer):
+        if self.simulation is not None and self.miso not in self.simulation.pin_drivers:
+            self.simulation.drive_pin(self.miso, self.drdy_level)
+        if self._pending is not None and self.data_ready():
+            self.conversion_register = self._convert(*self._pending)
+            self._pending = None
+            self._conversion_done_ns = None
+        result = self.conversion_register.to_bytes(2, "big")
+        for i in range(min(len(in_buffer), 2)):
+            in_buffer[i] = result[i]
+        if len(out_data) < 2:
+            return
+        config = (out_data[0] << 8) | out_data[1]
+        if config & 0x8000:
+            mux = (config >> 12) & 0b111
+            pga = (config >> 9) & 0b111
+            rate = SimulatedAds1118.SAMPLE_RATES[(config >> 5) & 0b111]
+            self._pending = (mux, pga, bool(config & 0x10))
+            self._conversion_done_ns = self.simulation.clock.monotonic_ns() + int(
+                1e9 / rate
+            )
+            self.conversions += 1
+
+
+class SimulatedArduCam(SimulatedSpiDevice):
+    """
+    Register-level model of the ArduChip on an ArduCam 5MP Mini. Starting a capture makes
+    `image` (a bytes-like JPEG) the contents of the FIFO once `capture_time` seconds have passed,
+    after which it can be read out with single or burst FIFO reads. Unless `plus`, the first
+    byte of each burst read is a dummy byte rather than FIFO data, as on the 5MP Mini. Reads
+    past the end of the image return zeros. `bytes_read` counts the FIFO bytes read out, and
+    `largest_burst` is the most FIFO bytes read in a single burst transaction.
+    """
+
+    def __init__(self, cs, image=b"", capture_time=0.25, plus=False):
+        super().__init__(cs)
+        self.image = image
+        self.capture_time = capture_time
+        self.plus = plus
+        self.registers = bytearray(0x80)
+        if plus:
+            self.registers[0x40] = 0x73  # ArduChip version of the 5MP Mini Plus
+        self.captures = 0
+        self.bytes_read = 0
+        self.largest_burst = 0
+        self._fifo = b""
+        self._capture_done_ns = None
+        self._read_pointer = 0
+        self._command = None
+        self._burst_length = 0
+        self._dummy_pending = False
+
+    def _captured(self):
+        return (
+            self._capture_done_ns is not None
+            and self.simulation.clock.monotonic_ns() >= self._capture_done_ns
+        )
+
+    def _read_fifo(self):
+        fifo = self.image if self._captured() else self._fifo
+        value = fifo[self._read_pointer] if self._read_pointer < len(fifo) else 0
+        self._read_pointer += 1
+        self.bytes_read += 1
+        return value
+
+    def _read_register(self, address):
+        if address == 0x41:
+            return 0x08 if self._captured() else 0
+        if 0x42 <= address <= 0x44:
+            length = len(self.image) if self._captured() else 0
+            return (length >> (8 * (address - 0x42))) & 0xFF
+        return self.registers[address]
+
+    def _write_register(self, address, value):
+        if address != 0x04:
+            self.registers[address] = value
+            return
+        if value & 0x01:
+            if self._captured():
+                self._fifo = self.image
+            self._capture_done_ns = None
+        if value & 0x10:
+            self._read_pointer = 0
+        if value & 0x02:
+            self._capture_done_ns = self.simulation.clock.monotonic_ns() + int(
+                self.capture_time * 1e9
+            )
+            self.captures += 1
+
+    def select(self):
+        self._command = None
+        self._burst_length = 0
+        self._dummy_pending = not self.plus
+
+    def transfer(self, out_data, in_buffer):
+        for i in range(len(out_data)):
+            value = 0
+            if self._command is None:
+                self._command = out_data[i]
+            elif self._command == 0x3C and self._dummy_pending:
+                self._dummy_pending = False
+            elif self._command == 0x3C:
+                value = self._read_fifo()
+                self._burst_length += 1
+                self.largest_burst = max(self.largest_burst, self._burst_length)
+            elif self._command == 0x3D:
+                value = self._read_fifo()
+                self._command = 0x00
+            elif self._command & 0x80:
+                self._write_register(self._command & 0x7F, out_data[i])
+                self._command = 0x00
+            else:
+                value = self._read_register(self._command)
+            if i < len(in_buffer):
+                in_buffer[i] = value
+
+
+class SimulatedUartPeer:
+    """
+    A simulated device on the other end of a UART. Bytes written by the software under test
+    are passed to `on_receive()`, which subclasses may override to respond. Bytes passed to
+    `send()` arrive at the software under test after their transmission time at the UART's
+    baud rate has elapsed.
+    """
+
+    def __init__(self):
+        self.simulation = None
+        self.received = bytearray()
+        self._outgoing = []
+
+    def on_receive(self, data):
+        """
+        Called with each chunk of bytes written by the software under test, as it is written.
+        The bytes finish arriving after their transmission time at the UART's baud rate.
+        """
+        self.received.extend(data)
+
+    def send(self, data, baudrate=115200, start_ns=None):
+        """
+        Queues bytes for transmission to the software under test, starting at `start_ns` on
+        the simulation clock (or now, if None).
+        """
+        if start_ns is None:
+            start_ns = self.simulation.clock.monotonic_ns()
+        for i, byte in enumerate(data):
+            # 10 bit times per byte for 8N1 framing
+            self._outgoing.append((start_ns + int((i + 1) * 10e9 / baudrate), byte))
+
+    def available(self):
+        """Returns the number of bytes which have arrived at the software under test."""
+        now_ns = self.simulation.clock.monotonic_ns()
+        count = 0
+        for arrival_ns, _ in self._outgoing:
+            if arrival_ns > now_ns:
+                break
+            count += 1
+        return count
+
+    def take(self, count):
+        """Removes and returns up to `count` bytes which have arrived."""
+        count = min(count, self.available())
+        data = bytes(byte for _, byte in self._outgoing[:count])
+        del self._outgoing[:count]
+        return data
+
+    def drop_overflow(self, capacity):
+        """
+        Discards bytes which have arrived beyond the first `capacity` bytes, as a full receive
+        buffer would, and returns the number of bytes discarded.
+        """
+        overflow = self.available() - capacity
+        if overflow <= 0:
+            return 0
+        del self._outgoing[capacity : capacity + overflow]
+        return overflow
+
+
+class SimulatedRs485Bus:
+    """
+    A simulated multi-drop, half-duplex RS485 bus. Each UART attached to the bus receives the
+    bytes written by every other attached UART.
+
+    Each bit is flipped in transit with probability `bit_error_rate`, drawn from a random
+    generator seeded with `seed`. Transmissions which overlap in time are counted as
+    collisions, and the bytes of the later transmission which overlap the earlier one are
+    garbled. The end time of every transmission corrupted either way is kept in `corrupted_ns`.
+    """
+
+    def __init__(self, baudrate=115200, bit_error_rate=0.0, seed=None):
+        self.baudrate = baudrate
+        self.bit_error_rate = bit_error_rate
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.collisions = 0
+        self.bit_errors = 0
+        self.bytes_transmitted = 0
+        self.corrupted_ns = []
+        self._busy_until_ns = 0
+
+    def attach(self, simulation, tx_pin):
+        """Attaches the UART transmitting on the given pin to the bus."""
+        node = _SimulatedRs485Node(self)
+        simulation.attach_uart_peer(tx_pin, node)
+        self.nodes.append(node)
+        return node
+
+    def transmit(self, sender, data):
+        """Delivers bytes written by one node, which have just started transmitting."""
+        start_ns = sender.simulation.clock.monotonic_ns()
+        byte_time_ns = 10e9 / self.baudrate
+        end_ns = start_ns + int(len(data) * byte_time_ns)
+        corrupted = False
+        if start_ns < self._busy_until_ns:
+            self.collisions += 1
+            overlap = min(len(data), math.ceil((self._busy_until_ns - start_ns) / byte_time_ns))
+            data = bytearray(data)
+            for i in range(overlap):
+                data[i] ^= self.random.randrange(1, 256)
+            corrupted = True
+        if self.bit_error_rate:
+            data = bytearray(data)
+            for i in range(len(data)):
+                for bit in range(8):
+                    if self.random.random() < self.bit_error_rate:
+                        data[i] ^= 1 << bit
+                        self.bit_errors += 1
+                        corrupted = True
+        if corrupted:
+            self.corrupted_ns.append(end_ns)
+        self._busy_until_ns = max(self._busy_until_ns, end_ns)
+        self.bytes_transmitted += len(data)
+        for node in self.nodes:
+            if node is not sender:
+                node.send(data, self.baudrate, start_ns)
+
+
+class _SimulatedRs485Node(SimulatedUartPeer):
+    def __init__(self, bus):
+        super().__init__()
+        self.bus = bus
+
+    def on_receive(self, data):
+        self.bus.transmit(self, data)
+
+
+class SimulatedReactionWheel:
+    """
+    First-order model of a reaction wheel behind a PWM speed controller. The wheel speed
+    approaches the speed commanded by the PWM duty cycle and direction pin with the given time
+    constant, and the tachometer pin toggles `tach_pulses_per_rev` times per revolution.
+    """
+
+    def __init__(
+        self,
+        unsoll,
+        diro,
+        fg,
+        max_rpm=12000,
+        time_constant=0.5,
+        tach_pulses_per_rev=6,
+    ):
+        self.unsoll = unsoll
+        self.diro = diro
+        self.fg = fg
+        self.max_rpm = max_rpm
+        self.time_constant = time_constant
+        self.tach_pulses_per_rev = tach_pulses_per_rev
+        self.rpm = 0.0
+        self.revolutions = 0.0
+        self.simulation = None
+        self._last_update_ns = 0
+
+    def attach(self, simulation):
+        """Attaches the wheel's tachometer output to a HardwareSimulation."""
+        self.simulation = simulation
+        self._last_update_ns = simulation.clock.monotonic_ns()
+        simulation.drive_pin(self.fg, self.tach_level)
+
+    def commanded_rpm(self):
+        """Returns the speed commanded by the current PWM duty cycle and direction pin."""
+        duty = self.simulation.pwm_duty_cycles.get(self.unsoll, 0)
+        direction = 1 if self.simulation.pin_levels.get(self.diro, True) else -1
+        return direction * self.max_rpm * abs(duty) / 65535
+
+    def update(self):
+        """Integrates the wheel dynamics up to the current virtual time."""
+        now_ns = self.simulation.clock.monotonic_ns()
+        dt = (now_ns - self._last_update_ns) / 1e9
+        self._last_update_ns = now_ns
+        if dt <= 0:
+            return
+        alpha = min(1.0, dt / self.time_constant)
+        self.rpm += alpha * (self.commanded_rpm() - self.rpm)
+        self.revolutions += abs(self.rpm) * dt / 60
+
+    def tach_level(self):
+        """Level of the tachometer output pin."""
+        self.update()
+        return int(self.revolutions * self.tach_pulses_per_rev * 2) % 2 == 1
+
+
+class SimulatedFlash:
+    """
+    A NOR flash chip backed by a memory-mapped image file at `path`, which is created erased if
+    it does not exist and so persists across instances. Programming can only clear bits, must
+    stay within a page, and takes `program_time` seconds per page; erasing sets every byte of a
+    block to 0xFF and takes `erase_time` seconds. Inside a HardwareSimulation, these times
+    advance the virtual clock. Program and erase operations are counted, per block for erases,
+    so that wear can be checked.
+    """
+
+    def __init__(
+        self,
+        path,
+        block_size=4096,
+        block_count=16,
+        page_size=256,
+        program_time=0.0007,
+        erase_time=0.045,
+    ):
+        self.path = path
+        self.block_size = block_size
+        self.block_count = block_count
+        self.page_size = page_size
+        self.program_time = program_time
+        self.erase_time = erase_time
+        self.programs = 0
+        self.bytes_programmed = 0
+        self.erase_counts = [0] * block_count
+        size = block_size * block_count
+        if not os.path.exists(path):
+            with open(path, "wb") as image:
+                image.write(b"\xff" * size)
+        self._file = open(path, "r+b")
+        self.image = mmap.mmap(self._file.fileno(), size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, exc_trace):
+        self.close()
+
+    def close(self):
+        """Flushes the image to its file and unmaps it."""
+        self.image.flush()
+        self.image.close()
+        self._file.close()
+
+    def _elapse(self, seconds):
+        if simulation is not None:
+            simulation.clock.advance(seconds)
+
+    def read(self, address, buffer):
+        """Reads `len(buffer)` bytes starting at `address` into `buffer`."""
+        buffer[:] = self.image[address : address + len(buffer)]
+
+    def program(self, address, data):
+        """Programs `data` at `address`, clearing the bits which are clear in `data`."""
+        data = bytes(data)
+        if address // self.page_size != (address + len(data) - 1) // self.page_size:
+            raise ValueError("Program crosses a page boundary")
+        current = self.image[address : address + len(data)]
+        self.image[address : address + len(data)] = bytes(a & b for a, b in zip(current, data))
+        self.programs += 1
+        self.bytes_programmed += len(data)
+        self._elapse(self.program_time)
+
+    def erase(self, block):
+        """Erases a block, setting all of its bytes to 0xFF."""
+        start = block * self.block_size
+        self.image[start : start + self.block_size] = b"\xff" * self.block_size
+        self.erase_counts[block] += 1
+        self._elapse(self.erase_time)
+
 
 class Direction:
     INPUT = 0
@@ -22,6 +628,7 @@ class HardwareIO_Test:
 class DigitalInOut_Test(HardwareIO_Test):
     def __init__(self, gpio):
         super().__init__()
+        self._pin = gpio
         self._direction = None
         self._value = None
 
@@ -29,6 +636,8 @@ class DigitalInOut_Test(HardwareIO_Test):
     def value(self):
         if not self._is_alive:
             raise RuntimeError("Device already deinit")
+        if simulation is not None and self._pin in simulation.pin_drivers:
+            return simulation.read_pin(self._pin)
         return self._value
 
     @value.setter
@@ -36,6 +645,8 @@ class DigitalInOut_Test(HardwareIO_Test):
         if not self._is_alive:
             raise RuntimeError("Device already deinit")
         self._value = pin_state
+        if simulation is not None:
+            simulation.write_pin(self._pin, pin_state)
 
     @property
     def direction(self):
@@ -53,7 +664,9 @@ class DigitalInOut_Test(HardwareIO_Test):
 class SPI_Test(HardwareIO_Test):
     def __init__(self, clock, mosi, miso):
         super().__init__()
+        self._clock = clock
         self._locked = False
+        self._baudrate = 100000
 
     def try_lock(self):
         if not (self._is_alive):
@@ -71,6 +684,7 @@ class SPI_Test(HardwareIO_Test):
     def configure(self, *, baudrate=100000, polarity=0, phase=0, bits=8):
         if not (self._is_alive and self._locked):
             raise RuntimeError("device not available")
+        self._baudrate = baudrate
 
     def write_readinto(
         self,
@@ -84,6 +698,27 @@ class SPI_Test(HardwareIO_Test):
     ):
         if not (self._is_alive and self._locked):
             raise RuntimeError("device not available")
+        if simulation is None:
+            return
+        out_data = bytes(out_buffer[out_start:out_end])
+        in_view = memoryview(in_buffer)[in_start : min(in_end, len(in_buffer))]
+        simulation.clock.advance(8 * len(out_data) / self._baudrate)
+        device = simulation.selected_spi_device(self._clock)
+        if device is None:
+            for i in range(len(in_view)):
+                in_view[i] = 0xFF
+        else:
+            device.transfer(out_data, in_view)
+
+    def write(self, buffer, *, start=0, end=sys.maxsize):
+        out_data = bytes(buffer[start:end])
+        self.write_readinto(out_data, bytearray(len(out_data)))
+
+    def readinto(self, buffer, *, start=0, end=sys.maxsize, write_value=0):
+        count = min(end, len(buffer)) - start
+        self.write_readinto(
+            bytes([write_value]) * count, buffer, in_start=start, in_end=start + count
+        )
 
     @property
     def frequency(self):
@@ -92,22 +727,81 @@ class SPI_Test(HardwareIO_Test):
         return 0
     
 class UART_Test(HardwareIO_Test):
-    def __init__(self, tx, rx, *, baudrate=115200, bits=8, parity=None, stop=1):
+    def __init__(
+        self,
+        tx,
+        rx,
+        *,
+        baudrate=115200,
+        bits=8,
+        parity=None,
+        stop=1,
+        timeout=1,
+        receiver_buffer_size=64,
+    ):
         super().__init__()
+        self._tx = tx
+        self._baudrate = baudrate
+        self.timeout = timeout
+        self.receiver_buffer_size = receiver_buffer_size
+        self.overflowed_bytes = 0
+
+    def _peer(self):
+        if simulation is None:
+            return None
+        peer = simulation.uart_peers.get(self._tx)
+        if peer is not None:
+            self.overflowed_bytes += peer.drop_overflow(self.receiver_buffer_size)
+        return peer
 
     def write(self, buffer):
         if not (self._is_alive):
             raise RuntimeError("device not available")
+        peer = self._peer()
+        if peer is None:
+            return None
+        data = bytes(buffer)
+        # the bytes are transmitted from the UART's buffer after the write returns
+        peer.on_receive(data)
+        return len(data)
 
     def readinto(self, buffer):
         if not (self._is_alive):
             raise RuntimeError("device not available")
-        
+        peer = self._peer()
+        if peer is None:
+            return None
+        data = peer.take(len(buffer))
+        if not data:
+            return None
+        buffer[: len(data)] = data
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        if not (self._is_alive):
+            raise RuntimeError("device not available")
+        peer = self._peer()
+        return 0 if peer is None else peer.available()
+
+    def reset_input_buffer(self):
+        if not (self._is_alive):
+            raise RuntimeError("device not available")
+        peer = self._peer()
+        if peer is not None:
+            peer.take(peer.available())
+
     @property
     def baudrate(self):
         if not (self._is_alive):
             raise RuntimeError("device not available")
-        return 0
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        if not (self._is_alive):
+            raise RuntimeError("device not available")
+        self._baudrate = baudrate
     
     @property
     def bits(self):
@@ -127,6 +821,61 @@ class UART_Test(HardwareIO_Test):
             raise RuntimeError("device not available")
         return 0
 
+class PWMOut_Test(HardwareIO_Test):
+    def __init__(self, pin, *, duty_cycle=0, frequency=500, variable_frequency=False):
+        super().__init__()
+        self._pin = pin
+        self.frequency = frequency
+        self.duty_cycle = duty_cycle
+
+    @property
+    def duty_cycle(self):
+        if not (self._is_alive):
+            raise RuntimeError("device not available")
+        return self._duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, duty_cycle):
+        if not (self._is_alive):
+            raise RuntimeError("device not available")
+        self._duty_cycle = duty_cycle
+        if simulation is not None:
+            simulation.pwm_duty_cycles[self._pin] = duty_cycle
+
+# Routing the pin manager's peripherals through the stand-ins
+
+_pin_manager_patches = []
+
+
+def simulate_pin_manager_hardware():
+    """
+    Makes the pin manager create its peripherals from the stand-ins in this module, so that
+    they connect to an active HardwareSimulation, and starts from a fresh PinManager so that no
+    peripherals are cached from earlier tests. Undone by `restore_pin_manager_hardware()`.
+    """
+    import pin_manager
+
+    restore_pin_manager_hardware()
+    _pin_manager_patches.extend(
+        [
+            patch.object(pin_manager.digitalio, "DigitalInOut", DigitalInOut_Test),
+            patch.object(pin_manager.busio, "SPI", SPI_Test, create=True),
+            patch.object(pin_manager.busio, "UART", UART_Test, create=True),
+        ]
+    )
+    for p in _pin_manager_patches:
+        p.start()
+    pin_manager.PinManager._instance = None
+
+
+def restore_pin_manager_hardware():
+    """Undoes `simulate_pin_manager_hardware()`, and discards the PinManager it used."""
+    import pin_manager
+
+    while _pin_manager_patches:
+        _pin_manager_patches.pop().stop()
+    pin_manager.PinManager._instance = None
+
 # Mapping custom modules
 
 digitalio = ModuleType('digitalio')
@@ -137,4 +886,8 @@ sys.modules['digitalio'] = digitalio
 busio = ModuleType('busio')
 busio.uart = UART_Test
 busio.spi = SPI_Test
-sys.modules['busio'] = busio
\ No newline at end of file
+sys.modules['busio'] = busio
+
+pwmio = ModuleType('pwmio')
+pwmio.PWMOut = PWMOut_Test
+sys.modules['pwmio'] = pwmio
\ No newline at end of file
@@ -0,0 +1,24 @@
+import unittest
+
+import datastore_path
+
+
+class _Node:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class DatastorePath_Test(unittest.TestCase):
+
+    def test_resolve(self):
+        leaf = _Node(value=3)
+        root = _Node(child=_Node(items=[_Node(), leaf]))
+        self.assertIs(datastore_path.resolve(root, "child.items.1"), leaf)
+        self.assertEqual(datastore_path.resolve(root, "child.items.1.value"), 3)
+        self.assertIs(datastore_path.resolve(root, "child"), root.child)
+        self.assertRaises(AttributeError, datastore_path.resolve, root, "missing")
+        self.assertRaises(IndexError, datastore_path.resolve, root, "child.items.2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import math
+import unittest
+
+import datastore as ds
+
+
+class AdcsDatastore_Test(unittest.TestCase):
+
+    def test_preallocated_state(self):
+        datastore = ds.Datastore()
+        self.assertFalse(datastore.attitude.valid)
+        self.assertTrue(all(math.isnan(v) for v in datastore.sensor.sun.vector))
+        quaternion = datastore.attitude.quaternion
+        datastore.attitude.set_quaternion(1.0, 0.0, 0.0, 0.0)
+        self.assertIs(datastore.attitude.quaternion, quaternion)
+        self.assertTrue(datastore.attitude.valid)
+        self.assertEqual(datastore.attitude.covariance.shape, (3, 3))
+        with self.assertRaises(AttributeError):
+            datastore.quaternion = None
+
+    def test_snapshot_round_trip(self):
+        source = ds.Datastore()
+        source.mode = ds.Datastore.NOMINAL_PROCESSES
+        source.attitude.set_quaternion(0.5, 0.5, -0.5, 0.5)
+        source.attitude.rates[:] = [0.01, -0.02, 0.03]
+        source.attitude.covariance[1, 2] = 0.25
+        source.sensor.magnetometer.record(123456789000, 2e-5, -1e-5, 4e-5)
+        source.attitude.updated_ns = 2**40
+        snapshot = ds.AdcsSnapshot()
+        self.assertEqual(snapshot.size, 1 + 4 * 4 + 4 * (4 + 3 + 9 + 3 + 3 + 3))
+        frame = bytearray(snapshot.size + 2)
+        snapshot.pack_into(source, frame, 2)
+        self.assertEqual(frame[:3], bytearray([0, 0, ds.Datastore.NOMINAL_PROCESSES]))
+
+        result = ds.Datastore()
+        arrays = [result.attitude.quaternion, result.attitude.covariance, result.sensor.sun.vector]
+        result.sensor.sun.record(5, 1.0, 1.0, 1.0)
+        snapshot.unpack_from(result, frame, 2)
+        self.assertEqual(result.mode, ds.Datastore.NOMINAL_PROCESSES)
+        self.assertEqual(list(result.attitude.quaternion), [0.5, 0.5, -0.5, 0.5])
+        for expected, value in zip([0.01, -0.02, 0.03], result.attitude.rates):
+            self.assertAlmostEqual(value, expected, places=6)
+        self.assertAlmostEqual(result.attitude.covariance[1, 2], 0.25)
+        self.assertAlmostEqual(result.attitude.covariance[0, 0], ds.INITIAL_ATTITUDE_VARIANCE)
+        self.assertAlmostEqual(result.sensor.magnetometer.vector[2], 4e-5)
+        self.assertTrue(all(math.isnan(v) for v in result.sensor.sun.vector))
+        self.assertIsNone(result.sensor.sun.time_ns)
+        self.assertEqual(result.sensor.magnetometer.time_ns, 123456000000)
+        self.assertEqual(result.attitude.updated_ns, (2**40 // 1000000 & 0xFFFFFFFF) * 1000000)
+        # the arrays are updated in place
+        self.assertIs(result.attitude.quaternion, arrays[0])
+        self.assertIs(result.attitude.covariance, arrays[1])
+        self.assertIs(result.sensor.sun.vector, arrays[2])
+
+    def test_sensor_samples(self):
+        samples = ds.SensorSamples(capacity=4)
+        out = [0.0, 0.0, 0.0]
+        self.assertFalse(samples.interpolate_into(out, 0))
+        self.assertIsNone(samples.next_time_ns(None))
+        for i in range(6):
+            samples.record(1000 * (i + 1), float(i), -2.0 * i, 1.0)
+        self.assertEqual(len(samples), 4)
+        self.assertEqual(samples.time_ns, 6000)
+        self.assertEqual(list(samples.vector), [5.0, -10.0, 1.0])
+        with self.assertRaises(ValueError):
+            samples.record(6000, 0.0, 0.0, 0.0)
+
+        # only the last four samples, taken at 3000 to 6000, are held
+        self.assertEqual(samples.next_time_ns(None), 3000)
+        self.assertEqual(samples.next_time_ns(3000), 4000)
+        self.assertEqual(samples.next_time_ns(4500), 5000)
+        self.assertIsNone(samples.next_time_ns(6000))
+
+        self.assertTrue(samples.interpolate_into(out, 4250))
+        self.assertEqual(out, [3.25, -6.5, 1.0])
+        samples.interpolate_into(out, 5000)
+        self.assertEqual(out, [4.0, -8.0, 1.0])
+        # outside of the held samples, the nearest sample is used
+        samples.interpolate_into(out, 1000)
+        self.assertEqual(out, [2.0, -4.0, 1.0])
+        samples.interpolate_into(out, 9000)
+        self.assertEqual(out, [5.0, -10.0, 1.0])
+
+        samples.clear()
+        self.assertEqual(len(samples), 0)
+        self.assertIsNone(samples.time_ns)
+        samples.record(10, 1.0, 2.0, 3.0)
+        self.assertEqual(samples.next_time_ns(None), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
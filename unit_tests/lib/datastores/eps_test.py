@@ -0,0 +1,65 @@
+import unittest
+
+import datastore as ds
+
+
+class DatastoreSnapshot_Test(unittest.TestCase):
+
+    def test_round_trip(self):
+        source = ds.Datastore()
+        source.batteries.string_2.top_cell_voltage = 3.75
+        source.batteries.string_2.charging_enabled = False
+        source.batteries.string_3.discharging_enabled = True
+        source.batteries.temperatures[1] = 21.5
+        source.bus_5v.trip_count = 3
+        source.mppt.charging_stage = 2
+        source.solar_array.panels[3].power_w = 1.25
+        source.control_commands.bus_12vhp_enabled = False
+        source.health.boot_count = 42
+        source.health.heap_growth_bph = -100
+        snapshot = ds.DatastoreSnapshot()
+        frame = bytearray(snapshot.size + 4)
+        snapshot.pack_into(source, memoryview(frame)[4:])
+        self.assertEqual(frame[:4], bytearray(4))
+
+        result = ds.Datastore()
+        result.bus_3v3.input_current = 1.0
+        snapshot.unpack_from(result, frame, 4)
+        self.assertEqual(result.batteries.string_2.top_cell_voltage, 3.75)
+        self.assertIs(result.batteries.string_2.charging_enabled, False)
+        self.assertIs(result.batteries.string_3.discharging_enabled, True)
+        self.assertIsNone(result.batteries.string_1.charging_enabled)
+        self.assertEqual(result.batteries.temperatures, [None, 21.5, None, None])
+        self.assertIsNone(result.bus_3v3.input_current)
+        self.assertEqual(result.bus_5v.trip_count, 3)
+        self.assertIsNone(result.bus_5v.last_trip_latency_ns)
+        self.assertEqual(result.mppt.charging_stage, 2)
+        self.assertEqual(result.solar_array.panels[3].power_w, 1.25)
+        self.assertIsNone(result.solar_array.panels[2].power_w)
+        self.assertIs(result.control_commands.bus_12vhp_enabled, False)
+        self.assertIs(result.control_commands.bus_3v3_enabled, True)
+        self.assertEqual(result.health.boot_count, 42)
+        self.assertEqual(result.health.heap_growth_bph, -100)
+        self.assertIsNone(result.health.mem_free)
+
+    def test_repacking_is_stable(self):
+        datastore = ds.Datastore()
+        snapshot = ds.DatastoreSnapshot()
+        first = bytearray(snapshot.size)
+        snapshot.pack_into(datastore, first)
+        datastore.bus_12vlp.output_voltage = 12.0
+        second = bytearray(snapshot.size)
+        snapshot.pack_into(datastore, second)
+        self.assertNotEqual(first, second)
+        datastore.bus_12vlp.output_voltage = None
+        snapshot.pack_into(datastore, second)
+        self.assertEqual(first, second)
+
+    def test_slots(self):
+        datastore = ds.Datastore()
+        with self.assertRaises(AttributeError):
+            datastore.bus_3v3.output_curent = 1.0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import flash_log
+import custom_module_mocking
+
+PAYLOAD_SIZE = 10
+
+
+def payload(i):
+    return struct.pack("<IIH", i, i * 3, i & 0xFFFF)
+
+
+class _CountingFlash(custom_module_mocking.SimulatedFlash):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = 0
+
+    def read(self, address, buffer):
+        self.reads += 1
+        super().read(address, buffer)
+
+
+class FlashLog_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "flash.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_flash(self):
+        return _CountingFlash(self.path, block_size=512, block_count=4, page_size=64)
+
+    def test_append_and_query(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            self.assertEqual(log.records_per_block, 31)
+            for i in range(50):
+                log.append(i * 10, payload(i))
+            result = [(t, bytes(p)) for t, p in log.records(95, 205)]
+            self.assertEqual(result, [(i * 10, payload(i)) for i in range(10, 21)])
+            self.assertEqual(len(list(log.records(0, 10000))), 50)
+            self.assertEqual(list(log.records(10000, 20000)), [])
+            with self.assertRaises(ValueError):
+                log.append(0, payload(0))
+            with self.assertRaises(ValueError):
+                log.append(1000, bytes(PAYLOAD_SIZE + 1))
+
+    def test_writes_are_batched_into_pages(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            for i in range(31):
+                log.append(i, payload(i))
+            log.flush()
+            # the block header, then one program per page of records
+            record_bytes = 31 * log.record_size
+            pages = -(-(flash_log.BLOCK_HEADER_SIZE + record_bytes) // flash.page_size)
+            self.assertEqual(flash.programs, 1 + pages)
+            self.assertEqual(flash.bytes_programmed, flash_log.BLOCK_HEADER_SIZE + record_bytes)
+
+    def test_ring_drops_oldest_blocks(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            for i in range(31 * 6 + 5):
+                log.append(i, payload(i))
+            timestamps = [t for t, _ in log.records(0, 10000)]
+            # the newest block holds 5 records, and the three before it are full
+            self.assertEqual(timestamps, list(range(31 * 3, 31 * 6 + 5)))
+            self.assertEqual(flash.erase_counts, [2, 2, 2, 1])
+
+    def test_sparse_index_limits_reads(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            for i in range(31 * 3 + 20):
+                log.append(i, payload(i))
+            log.flush()
+            flash.reads = 0
+            self.assertEqual([t for t, _ in log.records(70, 72)], [70, 71, 72])
+            # only the block holding the range is read, up to the first record past its end
+            self.assertEqual(flash.reads, 72 - 62 + 2)
+
+    def test_duplicate_timestamps_across_blocks(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            # the last four records of the first block and the first two of the second share a
+            # timestamp
+            timestamps = list(range(27)) + [27] * 6 + [28]
+            for i, timestamp in enumerate(timestamps):
+                log.append(timestamp, payload(i))
+            result = [(t, bytes(p)) for t, p in log.records(27, 27)]
+            self.assertEqual(result, [(27, payload(i)) for i in range(27, 33)])
+
+    def test_remount(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            for i in range(40):
+                log.append(i, payload(i))
+            log.flush()
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            self.assertEqual(log.last_timestamp, 39)
+            for i in range(40, 80):
+                log.append(i, payload(i))
+            # a record torn by a reset is skipped
+            address = log._slot_address(0, 5) + 4
+            flash.image[address] = 0
+            result = [(t, bytes(p)) for t, p in log.records(0, 1000)]
+        self.assertEqual(result, [(i, payload(i)) for i in range(80) if i != 5])
+
+    def test_index_skips_torn_first_records(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            for i in range(31 + 1):
+                log.append(i * 10, payload(i))
+            log.flush()
+            # the first record of each block is torn by a reset
+            flash.image[log._slot_address(0, 0) + 4] ^= 0x0F
+            flash.image[log._slot_address(1, 0) + 4] ^= 0x0F
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            # the first block is indexed by its first valid record
+            self.assertEqual([t for t, _ in log.records(0, 20)], [10, 20])
+            # and the newest block by the first record appended to it
+            for i in range(32, 40):
+                log.append(i * 10, payload(i))
+            self.assertEqual([t for t, _ in log.records(345, 370)], [350, 360, 370])
+            result = [t for t, _ in log.records(0, 1000)]
+        self.assertEqual(result, [i * 10 for i in range(1, 40) if i != 31])
+
+    def test_erase_ahead(self):
+        with self.open_flash() as flash:
+            log = flash_log.FlashLog(flash, PAYLOAD_SIZE)
+            with custom_module_mocking.HardwareSimulation() as sim:
+                for i in range(31):
+                    log.append(i, payload(i))
+                log.erase_ahead()
+                start_s = sim.clock.monotonic()
+                log.append(31, payload(31))
+                elapsed_s = sim.clock.monotonic() - start_s
+            self.assertLess(elapsed_s, flash.erase_time)
+            self.assertEqual(flash.erase_counts, [1, 1, 0, 0])
+            self.assertEqual(len(list(log.records(0, 100))), 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from unittest.mock import patch
+
+import loop_monitor
+
+
+class LoopMonitor_Test(unittest.TestCase):
+
+    def setUp(self):
+        loop_monitor.LoopMonitor._instance = None
+
+    def test_singleton(self):
+        self.assertIs(
+            loop_monitor.LoopMonitor.get_instance(), loop_monitor.LoopMonitor.get_instance()
+        )
+
+    def test_overrun_and_stall(self):
+        monitor = loop_monitor.LoopMonitor.get_instance()
+        with patch("time.monotonic_ns", return_value=0):
+            fast = monitor.register("fast", 0.1)
+            slow = monitor.register("slow", 1.0, deadline_s=5.0)
+        for now_ns in [100_000_000, 200_000_000, 450_000_000]:
+            with patch("time.monotonic_ns", return_value=now_ns):
+                fast.tick()
+        self.assertEqual(fast.ticks, 3)
+        self.assertEqual(fast.take_max_overrun_ms(), 150)
+        self.assertEqual(fast.take_max_overrun_ms(), 0)
+        self.assertEqual(slow.take_max_overrun_ms(), 0)
+        self.assertIsNone(monitor.stalled_timer(1_000_000_000))
+        self.assertIs(monitor.stalled_timer(1_500_000_000), fast)
+        with patch("time.monotonic_ns", return_value=4_500_000_000):
+            fast.tick()
+        self.assertIsNone(monitor.stalled_timer(5_000_000_000))
+        self.assertIs(monitor.stalled_timer(5_000_000_001), slow)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import asyncio
 
 import pin_manager
 import custom_module_mocking
@@ -50,6 +51,23 @@ class PinManager_Test(unittest.TestCase):
             self.assertIsNone(bus.readinto(buf1))
             self.assertIsNone(bus.deinit())
 
+    def test_simulated_uart(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = custom_module_mocking.SimulatedUartPeer()
+            sim.attach_uart_peer("D1", peer)
+            with inst.create_uart("D1", "D2", baudrate=9600) as bus:
+                self.assertEqual(bus.write(b"ping"), 4)
+                self.assertEqual(peer.received, b"ping")
+                peer.send(b"pong", baudrate=9600)
+                buf = bytearray(8)
+                self.assertIsNone(bus.readinto(buf))
+                sim.clock.advance(4 * 10 / 9600)
+                self.assertEqual(bus.in_waiting, 4)
+                self.assertEqual(bus.readinto(buf), 4)
+                self.assertEqual(buf[:4], b"pong")
+
     def test_context_retention(self):
         create_pin_manager_specific_mocking()
         inst = pin_manager.PinManager()
@@ -123,6 +141,137 @@ class PinManager_Test(unittest.TestCase):
         self.assertFalse(spi.is_busy())
         self.assertFalse(gpio1.is_busy())
 
+    def test_hold_release(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        spi = inst.create_spi("D1", "D2", "D3")
+        gpio1 = inst.create_digital_in_out("D1")
+        self.assertIs(spi, inst.create_spi("D1", "D2", "D3"))
+        bus = spi.hold()
+        self.assertTrue(spi.is_busy())
+        with spi as same_bus:
+            self.assertIs(bus, same_bus)
+        self.assertTrue(spi.is_busy())
+        self.assertRaises(RuntimeError, gpio1.__enter__)
+        spi.release()
+        self.assertFalse(spi.is_busy())
+        self.assertTrue(spi.is_running())
+        self.assertRaises(RuntimeError, spi.release)
+        with gpio1:
+            self.assertFalse(spi.is_running())
+
+    def test_acquire_waits_for_contention(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        spi = inst.create_spi("D1", "D2", "D3")
+        gpio1 = inst.create_digital_in_out("D1")
+        order = []
+
+        async def hold_spi():
+            async with inst.acquire(spi) as bus:
+                order.append("spi")
+                await asyncio.sleep(0.01)
+                self.assertTrue(bus.try_lock())
+            order.append("spi released")
+
+        async def use_gpio(name, priority):
+            await asyncio.sleep(0)
+            async with inst.acquire(gpio1, priority=priority) as pin:
+                order.append(name)
+                pin.value = True
+                await asyncio.sleep(0)
+
+        async def run():
+            await asyncio.gather(
+                hold_spi(), use_gpio("low", 0), use_gpio("first", 0), use_gpio("high", 1)
+            )
+
+        asyncio.run(run())
+        self.assertEqual(order, ["spi", "spi released", "high", "low", "first"])
+        self.assertFalse(spi.is_running())
+        self.assertFalse(gpio1.is_busy())
+
+    def test_acquire_timeout(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        spi = inst.create_spi("D1", "D2", "D3")
+        gpio1 = inst.create_digital_in_out("D1")
+
+        async def run():
+            with spi:
+                with self.assertRaises(asyncio.TimeoutError):
+                    async with inst.acquire(gpio1, timeout=0.01):
+                        pass
+            self.assertEqual(inst._get_pin_reference("D1").waiters, [])
+            async with inst.acquire(gpio1, timeout=0.01) as pin:
+                pin.value = True
+
+        asyncio.run(run())
+
+    def test_spi_bus_devices(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        adc1 = inst.create_spi_bus_device("D1", "D2", "D3", "D4", baudrate=1000000)
+        adc2 = inst.create_spi_bus_device("D1", "D2", "D3", "D5", phase=1)
+        cs1 = inst.create_digital_in_out("D4")
+        cs2 = inst.create_digital_in_out("D5")
+        # chip-select pins are only claimed by a device's first transaction
+        self.assertFalse(cs1.is_running())
+        self.assertFalse(cs2.is_running())
+        configurations = []
+        with adc1 as bus:
+            real_configure = bus.configure
+
+            def counting_configure(**kwargs):
+                configurations.append(kwargs["baudrate"])
+                real_configure(**kwargs)
+
+            bus.configure = counting_configure
+            with cs1 as pin:
+                self.assertFalse(pin.value)
+        self.assertTrue(cs1._instance.value)
+        for _ in range(3):
+            with adc1 as bus:
+                self.assertIsNone(bus.write_readinto(bytearray(2), bytearray(2)))
+        with adc2 as bus:
+            self.assertIsNone(bus.write_readinto(bytearray(2), bytearray(2)))
+        with adc1:
+            pass
+        self.assertEqual(configurations, [100000, 1000000])
+        self.assertIs(adc1._bus, adc2._bus)
+        self.assertTrue(bus.try_lock())
+        # a bus locked outside of a transaction is reported rather than waited on
+        with self.assertRaises(RuntimeError):
+            with adc2:
+                pass
+        self.assertFalse(adc1._bus.spi.is_busy())
+        self.assertFalse(cs2.is_busy())
+        self.assertTrue(cs2._instance.value)
+
+    def test_stats(self):
+        create_pin_manager_specific_mocking()
+        inst = pin_manager.PinManager()
+        spi = inst.create_spi("D1", "D2", "D3")
+        inst.enable_stats()
+        gpio1 = inst.create_digital_in_out("D1")
+        for _ in range(2):
+            with spi:
+                with spi:
+                    self.assertRaises(RuntimeError, gpio1.__enter__)
+            with gpio1:
+                pass
+        stats = inst.stats()
+        spi_stats = stats[(("D1", "D2", "D3"), "SPI_Test")]
+        gpio_stats = stats[(("D1",), "DigitalInOut_Test")]
+        self.assertEqual(spi_stats["inits"], 2)
+        self.assertEqual(spi_stats["deinits"], 2)
+        self.assertEqual(spi_stats["entries"], 4)
+        self.assertGreaterEqual(spi_stats["total_hold_ns"], spi_stats["max_hold_ns"])
+        self.assertEqual(gpio_stats["inits"], 2)
+        self.assertEqual(gpio_stats["deinits"], 1)
+        self.assertEqual(gpio_stats["contentions"], 2)
+        self.assertEqual(len(inst.format_stats().splitlines()), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
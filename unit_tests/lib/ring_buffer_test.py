@@ -0,0 +1,82 @@
+import unittest
+import random
+
+from ring_buffer import RingBuffer
+
+
+class RingBuffer_Test(unittest.TestCase):
+
+    def test_empty(self):
+        buf = RingBuffer(4, 0.1)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.mean(), 0)
+        self.assertEqual(buf.variance(), 0)
+        self.assertIsNone(buf.max())
+        self.assertIsNone(buf.min())
+        self.assertIsNone(buf.latest())
+        self.assertEqual(buf.window_mean(1.0), 0)
+        self.assertRaises(ValueError, RingBuffer, 0)
+
+    def test_running_statistics_match_window(self):
+        random.seed(0)
+        buf = RingBuffer(7)
+        window = []
+        for _ in range(100):
+            value = random.randint(-50, 50)
+            buf.push(value)
+            window = (window + [value])[-7:]
+            mean = sum(window) / len(window)
+            self.assertEqual(len(buf), len(window))
+            self.assertEqual(buf.latest(), value)
+            self.assertAlmostEqual(buf.sum(), sum(window), places=3)
+            self.assertAlmostEqual(buf.mean(), mean, places=3)
+            self.assertAlmostEqual(
+                buf.variance(),
+                sum((x - mean) ** 2 for x in window) / len(window),
+                places=2,
+            )
+            self.assertEqual(buf.max(), max(window))
+            self.assertEqual(buf.min(), min(window))
+
+    def test_indices_stay_within_buffer(self):
+        random.seed(1)
+        buf = RingBuffer(5)
+        window = []
+        for step in range(1000):
+            if step == 503:
+                buf.clear()
+                window = []
+            value = random.randint(0, 3)
+            buf.push(value)
+            window = (window + [value])[-5:]
+            self.assertEqual(buf.max(), max(window))
+            self.assertEqual(buf.min(), min(window))
+        # positions are kept relative to the buffer, so they cannot overflow on long runs
+        self.assertLess(buf._next, buf.capacity)
+        for deque in (buf._max_deque, buf._min_deque):
+            self.assertTrue(all(index < buf.capacity for index in deque._indices))
+
+    def test_duration_windows(self):
+        buf = RingBuffer(10, 0.5)
+        for value in range(20):
+            buf.push(value)
+        self.assertEqual(buf.window_sum(1.0), 18 + 19)
+        self.assertEqual(buf.window_mean(2.0), (16 + 17 + 18 + 19) / 4)
+        self.assertEqual(buf.window_max(1.5), 19)
+        self.assertEqual(buf.window_mean(100), buf.mean())
+        self.assertRaises(ValueError, RingBuffer(3).window_mean, 1.0)
+
+    def test_clear(self):
+        buf = RingBuffer(3)
+        for value in [5, 1, 3, 9]:
+            buf.push(value)
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+        buf.push(2)
+        self.assertEqual(buf.max(), 2)
+        self.assertEqual(buf.min(), 2)
+        self.assertEqual(buf.mean(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
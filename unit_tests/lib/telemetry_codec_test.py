@@ -0,0 +1,120 @@
+import unittest
+
+from telemetry_codec import TelemetryEncoder, TelemetryDecoder
+
+
+class _Sensor:
+    def __init__(self):
+        self.voltage = None
+        self.current = None
+        self.enabled = None
+        self.count = None
+
+
+class _Datastore:
+    def __init__(self):
+        self.sensors = [_Sensor(), _Sensor()]
+        self.temperatures = [None] * 4
+
+
+FIELDS = [
+    (path, field, kind)
+    for path in ["sensors.0", "sensors.1"]
+    for field, kind in [("voltage", "f"), ("current", "f"), ("enabled", "?"), ("count", "I")]
+] + [("temperatures", i, "f") for i in range(4)]
+SCALES = {"voltage": 1000, "current": 1000, "temperatures": 100}
+
+
+class TelemetryCodec_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.source = _Datastore()
+        self.result = _Datastore()
+        self.encoder = TelemetryEncoder(FIELDS, SCALES)
+        self.decoder = TelemetryDecoder(FIELDS, SCALES)
+        self.buffer = bytearray(self.encoder.max_size)
+
+    def transfer(self, acknowledge=True):
+        size = self.encoder.encode_into(self.source, self.buffer)
+        sequence = self.decoder.decode_from(self.result, self.buffer)
+        if acknowledge:
+            self.encoder.acknowledge(sequence)
+        return size
+
+    def test_key_frame_and_deltas(self):
+        self.assertEqual(self.transfer(), 2 + 2)  # nothing set: header and mask only
+
+        sensor = self.source.sensors[1]
+        sensor.voltage = 3.7004
+        sensor.current = -0.25
+        sensor.enabled = False
+        sensor.count = 0xFFFFFFFE
+        self.source.temperatures[2] = 21.37
+        self.transfer()
+        result = self.result.sensors[1]
+        self.assertEqual(result.voltage, 3.7)
+        self.assertEqual(result.current, -0.25)
+        self.assertIs(result.enabled, False)
+        self.assertEqual(result.count, 0xFFFFFFFE)
+        self.assertEqual(self.result.temperatures, [None, None, 21.37, None])
+        self.assertIsNone(self.result.sensors[0].voltage)
+
+        # only the fields which changed are sent, and small changes take a single byte
+        sensor.voltage = 3.701
+        sensor.current = float("nan")
+        self.assertEqual(self.transfer(), 2 + 2 + 2)
+        self.assertEqual(result.voltage, 3.701)
+        self.assertIsNone(result.current)
+        self.assertEqual(result.count, 0xFFFFFFFE)
+        self.assertEqual(self.transfer(), 2 + 2)
+
+        sensor.count = 0
+        sensor.enabled = None
+        self.source.temperatures[2] = float("inf")
+        self.transfer()
+        self.assertEqual(result.count, 0)
+        self.assertIsNone(result.enabled)
+        self.assertIsNone(self.result.temperatures[2])
+
+    def test_unacknowledged_frames(self):
+        self.source.sensors[0].voltage = 5.0
+        key_size = self.transfer()
+        self.source.sensors[0].voltage = 5.001
+        # frames which are not acknowledged are still encoded against the acknowledged frame
+        for _ in range(7):
+            self.assertEqual(self.transfer(acknowledge=False), 2 + 2 + 1)
+        # until the acknowledged frame leaves the history, when a key frame is sent
+        self.assertEqual(self.transfer(acknowledge=False), key_size)
+        self.assertEqual(self.result.sensors[0].voltage, 5.001)
+
+    def test_sequence_wraps(self):
+        sensor = self.source.sensors[0]
+        for i in range(600):
+            sensor.current = i / 1000
+            sensor.count = i
+            self.transfer(acknowledge=i % 3 == 0)
+            self.assertEqual(self.result.sensors[0].current, i / 1000)
+            self.assertEqual(self.result.sensors[0].count, i)
+
+    def test_missing_reference(self):
+        self.transfer()
+        self.encoder.encode_into(self.source, self.buffer)
+        decoder = TelemetryDecoder(FIELDS, SCALES)
+        self.assertRaises(ValueError, decoder.decode_from, self.result, self.buffer)
+        self.encoder.reset()
+        self.encoder.encode_into(self.source, self.buffer)
+        decoder.decode_from(self.result, self.buffer)
+
+    def test_truncated_frame(self):
+        self.source.sensors[0].count = 300
+        size = self.encoder.encode_into(self.source, self.buffer)
+        for length in [1, 3, size - 1]:
+            self.assertRaises(
+                ValueError, self.decoder.decode_from, self.result, self.buffer[:length]
+            )
+        self.decoder.decode_from(self.result, self.buffer[:size])
+        self.assertEqual(self.result.sensors[0].count, 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import math
+import unittest
+
+try:
+    import ulab.numpy as np  # For CircuitPython
+except ImportError:
+    import numpy as np  # For GitHub Actions / PC testing
+
+from quaternion import Quaternion
+import mekf
+import datastore as ds
+
+
+def as_quaternion(q):
+    return Quaternion(q[0], q[1], q[2], q[3])
+
+
+class Mekf_Test(unittest.TestCase):
+
+    def assertQuaternionAlmostEqual(self, q, expected, places=6):
+        for value, expected_value in zip(q, [expected.w, expected.x, expected.y, expected.z]):
+            self.assertAlmostEqual(value, expected_value, places=places)
+
+    def test_quaternion_helpers_match_quaternion_class(self):
+        q = np.array([0.9, 0.1, -0.3, 0.2])
+        w = np.array([0.02, -0.01, 0.05])
+        expected = as_quaternion(q)
+        expected += 0.5 * 0.1 * (Quaternion(0.0, *w) * expected)
+        mekf.propagate_quaternion(q, w, 0.1)
+        self.assertQuaternionAlmostEqual(q, expected)
+
+        v = np.array([1.0, 2.0, -0.5])
+        rotated = mekf.rotate_into(np.zeros(3), q, v)
+        for value, expected_value in zip(rotated, expected.rotate_vector(v)):
+            self.assertAlmostEqual(value, expected_value, places=6)
+
+        delta_a = np.array([0.01, 0.02, -0.03])
+        expected = Quaternion(1.0, *(0.5 * delta_a)) * expected
+        expected.normalize()
+        mekf.correct_quaternion(q, delta_a)
+        self.assertQuaternionAlmostEqual(q, expected)
+
+        self.assertEqual(mekf.skew(np.array([1.0, 2.0, 3.0])).tolist(), [
+            [0.0, -3.0, 2.0],
+            [3.0, 0.0, -1.0],
+            [-2.0, 1.0, 0.0],
+        ])
+
+    def test_update_in_place(self):
+        attitude = ds.Datastore().attitude
+        attitude.set_quaternion(1.0, 0.0, 0.0, 0.0)
+        attitude.rates[:] = 0.0
+        quaternion = attitude.quaternion
+        covariance = attitude.covariance
+        v_inertial = np.array([0.0, 0.0, 1.0])
+        initial_variance = covariance[0, 0]
+        for _ in range(10):
+            # a measurement matching the prediction leaves the attitude where it is
+            mekf.mekf_update(attitude, v_inertial, v_inertial, 0.1)
+        self.assertIs(attitude.quaternion, quaternion)
+        self.assertIs(attitude.covariance, covariance)
+        self.assertEqual(list(quaternion), [1.0, 0.0, 0.0, 0.0])
+        # the covariance update is kept, and shrinks about the axes the measurement observes
+        self.assertLess(covariance[0, 0], initial_variance)
+
+        mekf.mekf_update(attitude, np.array([0.0, 0.05, 1.0]), v_inertial, 0.1)
+        self.assertNotEqual(list(quaternion), [1.0, 0.0, 0.0, 0.0])
+        norm = math.sqrt(sum(v * v for v in quaternion))
+        self.assertAlmostEqual(norm, 1.0, places=6)
+
+    def test_propagate_to_gyroscope_samples(self):
+        attitude = ds.Datastore().attitude
+        attitude.set_quaternion(1.0, 0.0, 0.0, 0.0)
+        attitude.updated_ns = 2000000000
+        gyroscope = ds.SensorSamples(capacity=32)
+        # the rate about z ramps up from 0 at 2 s to 0.2 rad/s at 3 s, sampled every 0.05 s
+        for i in range(21):
+            gyroscope.record(2000000000 + i * 50000000, 0.0, 0.0, 0.01 * i)
+        variance = attitude.covariance[2, 2]
+
+        mekf.propagate_to(attitude, gyroscope, 2500000000)
+        self.assertEqual(attitude.updated_ns, 2500000000)
+        # the rotation angle is the integral of the rate, 0.025 rad after 0.5 s
+        angle = 2 * math.atan2(attitude.quaternion[3], attitude.quaternion[0])
+        self.assertAlmostEqual(angle, 0.025, places=4)
+        self.assertAlmostEqual(attitude.rates[2], 0.095, places=6)
+        self.assertAlmostEqual(
+            attitude.covariance[2, 2], variance + 0.5 * ds.GYRO_NOISE_VARIANCE, places=6
+        )
+
+        # past the last sample, the last rate is held
+        mekf.propagate_to(attitude, gyroscope, 4000000000)
+        angle = 2 * math.atan2(attitude.quaternion[3], attitude.quaternion[0])
+        self.assertAlmostEqual(angle, 0.1 + 0.2, places=3)
+
+        # without gyroscope samples the attitude is only moved to the new time
+        quaternion = list(attitude.quaternion)
+        mekf.propagate_to(attitude, ds.SensorSamples(), 5000000000)
+        self.assertEqual(list(attitude.quaternion), quaternion)
+        self.assertEqual(attitude.updated_ns, 5000000000)
+
+
+if __name__ == "__main__":
+    unittest.main()
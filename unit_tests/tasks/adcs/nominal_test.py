@@ -0,0 +1,85 @@
+import math
+import unittest
+
+from quaternion import Quaternion
+import nominal
+import datastore as ds
+
+RATE = 0.1  # rad/s about z
+SUN = [1.0, 0.0, 0.0]
+FIELD = [0.0, 0.6, 0.8]
+
+
+def true_attitude(time_ns):
+    # the body rotates about z at RATE from the identity at time 0
+    half_angle = 0.5 * RATE * time_ns * 1e-9
+    return Quaternion(math.cos(half_angle), 0.0, 0.0, math.sin(half_angle))
+
+
+def measure(samples, time_ns, reference):
+    # measured body vector, as modelled by the filter: q * reference * q.conjugate()
+    vector = true_attitude(time_ns).rotate_vector(reference)
+    samples.record(time_ns, vector[0], vector[1], vector[2])
+
+
+class Nominal_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.datastore = ds.Datastore()
+        sensor = self.datastore.sensor
+        sensor.sun_model[:] = SUN
+        sensor.magnetometer_model[:] = FIELD
+        # the filter starts from the attitude at 0 s, rather than from TRIAD
+        self.datastore.attitude.set_quaternion(1.0, 0.0, 0.0, 0.0)
+        self.datastore.attitude.updated_ns = 0
+
+    def record_samples(self, start_ms, end_ms):
+        # gyro at 50 Hz, magnetometer at 10 Hz offset by 3 ms, and sun sensor at 4 Hz offset by
+        # 7 ms, recorded as each sensor task would
+        sensor = self.datastore.sensor
+        for ms in range(start_ms, end_ms):
+            time_ns = ms * 1000000
+            if ms % 20 == 0:
+                sensor.gyroscope.record(time_ns, 0.0, 0.0, RATE)
+            if ms % 100 == 3:
+                measure(sensor.magnetometer, time_ns, FIELD)
+            if ms % 250 == 7:
+                measure(sensor.sun, time_ns, SUN)
+
+    def assertAttitudeAlmostEqual(self, expected, places):
+        attitude = self.datastore.attitude.quaternion
+        # q and -q are the same attitude
+        sign = 1.0 if attitude[0] * expected.w >= 0 else -1.0
+        expected = [expected.w, expected.x, expected.y, expected.z]
+        for value, expected_value in zip(attitude, expected):
+            self.assertAlmostEqual(sign * value, expected_value, places=places)
+
+    def test_asynchronous_measurements_are_time_aligned(self):
+        attitude = self.datastore.attitude
+        for second in range(5):
+            self.record_samples(second * 1000, (second + 1) * 1000)
+            nominal.update_attitude(self.datastore)
+            # the attitude is estimated at the time of the last measurement
+            self.assertEqual(attitude.updated_ns, (second * 1000 + 903) * 1000000)
+            self.assertAttitudeAlmostEqual(true_attitude(attitude.updated_ns), places=4)
+            self.assertAlmostEqual(attitude.rates[2], RATE, places=6)
+
+    def test_stale_samples_are_not_reapplied(self):
+        self.record_samples(0, 1000)
+        nominal.update_attitude(self.datastore)
+        quaternion = list(self.datastore.attitude.quaternion)
+        covariance = self.datastore.attitude.covariance.tolist()
+        nominal.update_attitude(self.datastore)
+        self.assertEqual(list(self.datastore.attitude.quaternion), quaternion)
+        self.assertEqual(self.datastore.attitude.covariance.tolist(), covariance)
+
+    def test_no_attitude_without_both_vectors(self):
+        datastore = ds.Datastore()
+        measure(datastore.sensor.magnetometer, 1000000, FIELD)
+        nominal.update_attitude(datastore)
+        self.assertFalse(datastore.attitude.valid)
+        self.assertIsNone(datastore.attitude.updated_ns)
+
+
+if __name__ == "__main__":
+    unittest.main()
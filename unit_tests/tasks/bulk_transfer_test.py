@@ -0,0 +1,152 @@
+import os
+import types
+import random
+import asyncio
+import tempfile
+import unittest
+
+import bulk_transfer
+import inter_subsystem_rs485 as rs485
+import custom_module_mocking
+
+NODE = rs485.Address.ADCS
+IMAGE_ID = 7
+
+
+async def serve(sender):
+    while True:
+        sender.link.poll(sender.handle)
+        await sender.send_burst()
+        await asyncio.sleep(0.002)
+
+
+class BulkTransfer_Test(unittest.TestCase):
+
+    def setUp(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        self.directory = tempfile.TemporaryDirectory()
+        random.seed(5)
+        self.data = bytes(random.getrandbits(8) for _ in range(20000))
+
+    def tearDown(self):
+        self.directory.cleanup()
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def transfer(self, sim, receiver, max_exchanges=1000, offered=True, **bus_options):
+        # runs `receiver` against a node offering `self.data` until it finishes
+        bus = custom_module_mocking.SimulatedRs485Bus(**bus_options)
+        bus.attach(sim, "CDH_TX")
+        bus.attach(sim, "NODE_TX")
+        cdh = rs485.Rs485Link("CDH_TX", "CDH_RX", "CDH_DE")
+        node = rs485.Rs485Link("NODE_TX", "NODE_RX", "NODE_DE")
+        sender = bulk_transfer.BulkSender(node, NODE)
+        if offered:
+            sender.offer(IMAGE_ID, bulk_transfer.MemoryRegion(bytearray(self.data)), tag=42)
+
+        async def run():
+            task = asyncio.create_task(serve(sender))
+            exchanges = 0
+            while not (receiver.done or receiver.failed) and exchanges < max_exchanges:
+                await receiver.exchange(cdh)
+                exchanges += 1
+            task.cancel()
+
+        start_s = sim.clock.monotonic()
+        sim.run(run())
+        cdh.close()
+        node.close()
+        return sender, sim.clock.monotonic() - start_s
+
+    def test_transfer_approaches_baud_rate(self):
+        path = os.path.join(self.directory.name, "flash.bin")
+        with custom_module_mocking.SimulatedFlash(
+            path, block_size=4096, block_count=8, program_time=0
+        ) as flash:
+            sink = bulk_transfer.FlashRegion(flash, 4096, len(self.data))
+            sink.erase()
+            receiver = bulk_transfer.BulkReceiver(NODE, IMAGE_ID, sink)
+            with custom_module_mocking.HardwareSimulation() as sim:
+                sender, elapsed_s = self.transfer(sim, receiver)
+            self.assertTrue(receiver.done)
+            received = bytearray(len(self.data))
+            sink.readinto(0, received)
+        self.assertEqual(bytes(received), self.data)
+        chunk_count = -(-len(self.data) // 250)
+        self.assertEqual(sender.chunks_sent, chunk_count)
+        self.assertEqual(receiver.stats.requests, 1 + -(-chunk_count // bulk_transfer.WINDOW_SIZE))
+        raw_bytes_per_s = rs485.RS485_BAUDRATE / 10
+        self.assertGreater(len(self.data) / elapsed_s, 0.9 * raw_bytes_per_s)
+
+    def test_selective_retransmit(self):
+        sink = bytearray(len(self.data))
+        receiver = bulk_transfer.BulkReceiver(
+            NODE, IMAGE_ID, bulk_transfer.MemoryRegion(sink)
+        )
+        with custom_module_mocking.HardwareSimulation() as sim:
+            sender, _ = self.transfer(sim, receiver, bit_error_rate=2e-5, seed=3)
+        self.assertTrue(receiver.done)
+        self.assertEqual(bytes(sink), self.data)
+        chunk_count = -(-len(self.data) // 250)
+        retransmitted = sender.chunks_sent - chunk_count
+        # only the chunks which were corrupted are sent again
+        self.assertGreater(retransmitted, 0)
+        self.assertLess(retransmitted, chunk_count // 4)
+        self.assertEqual(receiver.stats.chunks_received, chunk_count)
+
+    def test_resume_after_reset(self):
+        nvm = bytearray(32)
+        sink = bytearray(len(self.data))
+        progress = bulk_transfer.TransferProgress(nvm, 8)
+        receiver = bulk_transfer.BulkReceiver(
+            NODE, IMAGE_ID, bulk_transfer.MemoryRegion(sink), progress=progress
+        )
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.transfer(sim, receiver, max_exchanges=3)
+        self.assertFalse(receiver.done)
+        self.assertEqual(receiver.next_chunk, 2 * bulk_transfer.WINDOW_SIZE)
+
+        custom_module_mocking.simulate_pin_manager_hardware()
+        resumed = bulk_transfer.BulkReceiver(
+            NODE, IMAGE_ID, bulk_transfer.MemoryRegion(sink), progress=progress
+        )
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.transfer(sim, resumed)
+        self.assertTrue(resumed.done)
+        self.assertEqual(bytes(sink), self.data)
+        self.assertEqual(resumed.stats.chunks_received, -(-len(self.data) // 250) - 32)
+
+        # progress stored for another version of the object is not used
+        self.assertEqual(progress.load(NODE, IMAGE_ID, len(self.data), 43), 0)
+        self.assertEqual(progress.load(NODE, IMAGE_ID, len(self.data), 42), 80)
+
+    def test_progress_at_the_size_limit(self):
+        link = rs485.Rs485Link("TX", "RX", "DE")
+        sender = bulk_transfer.BulkSender(link, NODE)
+        size = bulk_transfer.MAX_CHUNKS * sender.chunk_size
+        sender.offer(IMAGE_ID, types.SimpleNamespace(size=size))
+        with self.assertRaises(ValueError):
+            sender.offer(IMAGE_ID, types.SimpleNamespace(size=size + 1))
+        link.close()
+        # a completed transfer of the largest object stores the chunk count as its progress
+        progress = bulk_transfer.TransferProgress(bytearray(bulk_transfer.PROGRESS_SIZE))
+        progress.save(NODE, IMAGE_ID, size, 42, bulk_transfer.MAX_CHUNKS)
+        self.assertEqual(progress.load(NODE, IMAGE_ID, size, 42), bulk_transfer.MAX_CHUNKS)
+
+    def test_unknown_object(self):
+        receiver = bulk_transfer.BulkReceiver(NODE, IMAGE_ID, bulk_transfer.MemoryRegion(b""))
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.transfer(sim, receiver, offered=False)
+        self.assertTrue(receiver.failed)
+        self.assertEqual(receiver.status, rs485.Status.BAD_VALUE)
+
+    def test_silent_node(self):
+        receiver = bulk_transfer.BulkReceiver(NODE + 1, IMAGE_ID, bulk_transfer.MemoryRegion(b""))
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.transfer(sim, receiver)
+        self.assertTrue(receiver.failed)
+        self.assertIsNone(receiver.status)
+        self.assertEqual(receiver.stats.timeouts, bulk_transfer.MAX_IDLE_EXCHANGES)
+
+
+if __name__ == "__main__":
+    unittest.main()
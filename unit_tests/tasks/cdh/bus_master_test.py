@@ -0,0 +1,190 @@
+import unittest
+
+import bus_master
+import bulk_transfer
+import inter_subsystem_rs485 as rs485
+from inter_subsystem_rs485 import Address, MessageId, REPLY_FLAG
+import custom_module_mocking
+import rs485_bench
+
+TELEMETRY_ID = rs485_bench.TELEMETRY_ID
+
+
+class BusMaster_Test(unittest.TestCase):
+
+    def setUp(self):
+        rs485_bench.use_simulated_hardware()
+
+    def run_bus(self, sim, schedule, responders, duration_s, on_master=None, **options):
+        bus = rs485_bench.attach_bus(sim, responders)
+        link = rs485.Rs485Link("CDH_TX", "CDH_RX", "CDH_DE")
+        master = bus_master.BusMaster(link, schedule)
+        if on_master is not None:
+            on_master(master)
+        rs485_bench.run_master(sim, master, responders, duration_s, **options)
+        link.close()
+        return master, bus
+
+    def test_round_trips(self):
+        eps = bus_master.Node("eps", Address.EPS)
+        adcs = bus_master.Node("adcs", Address.ADCS)
+        replies = []
+        schedule = [
+            bus_master.PollEntry(
+                eps, TELEMETRY_ID, 0.1, on_reply=lambda i, body: replies.append((i, bytes(body)))
+            ),
+            bus_master.PollEntry(adcs, TELEMETRY_ID, 0.1),
+            bus_master.PollEntry(eps, MessageId.PING, 0),
+            bus_master.PollEntry(adcs, MessageId.PING, 0),
+        ]
+        with custom_module_mocking.HardwareSimulation() as sim:
+            master, bus = self.run_bus(sim, schedule, [Address.EPS, Address.ADCS], 2.0)
+            rate = master.round_trips_per_s()
+        self.assertEqual(bus.collisions, 0)
+        self.assertEqual(master.unexpected_frames, 0)
+        for node in [eps, adcs]:
+            self.assertEqual(node.stats.timeouts, 0)
+            self.assertGreater(node.stats.replies, 100)
+            self.assertGreaterEqual(node.stats.requests - node.stats.replies, 0)
+            self.assertLessEqual(node.stats.requests - node.stats.replies, 1)
+            self.assertLess(node.stats.latency_us.max(), node.timeout_ns // 1000)
+        # telemetry is polled at its own period despite the back-to-back pings
+        self.assertIn(len(replies), [20, 21])
+        self.assertEqual(
+            replies[0], (TELEMETRY_ID | REPLY_FLAG, rs485_bench.telemetry_body())
+        )
+        self.assertAlmostEqual(rate, master.round_trips / 2.0, delta=1)
+        # each round trip takes two 2 ms polls on the responder at most, plus frame times
+        self.assertGreater(rate, 200)
+
+    def test_replies_are_handled_after_the_next_request_is_sent(self):
+        eps = bus_master.Node("eps", Address.EPS)
+        masters = []
+        seen = []
+
+        def on_reply(message_id, body):
+            master = masters[0]
+            seen.append((master.link.stats.frames_sent, master.round_trips))
+
+        schedule = [bus_master.PollEntry(eps, MessageId.PING, 0, on_reply=on_reply)]
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.run_bus(sim, schedule, [Address.EPS], 0.5, on_master=masters.append)
+        self.assertGreater(len(seen), 10)
+        # when each reply is handled, the request after it is already on the bus
+        for frames_sent, round_trips in seen:
+            self.assertEqual(frames_sent, round_trips + 1)
+
+    def test_bulk_transfer_between_polls(self):
+        eps = bus_master.Node("eps", Address.EPS)
+        reply_times = []
+        schedule = [
+            bus_master.PollEntry(
+                eps,
+                TELEMETRY_ID,
+                0.1,
+                on_reply=lambda i, body: reply_times.append(sim.clock.monotonic()),
+            ),
+        ]
+        image = bytes(i * 13 % 256 for i in range(30000))
+        received = bytearray(len(image))
+        receiver = bulk_transfer.BulkReceiver(
+            Address.ADCS, 1, bulk_transfer.MemoryRegion(received)
+        )
+        with custom_module_mocking.HardwareSimulation() as sim:
+            master, _ = self.run_bus(
+                sim,
+                schedule,
+                [Address.EPS, Address.ADCS],
+                4.0,
+                on_master=lambda master: master.start_transfer(receiver),
+                objects={1: image},
+            )
+        self.assertTrue(receiver.done)
+        self.assertEqual(bytes(received), image)
+        self.assertEqual(master.transfers, [])
+        # the transfer fills the bus between polls, delaying each by at most one window
+        self.assertEqual(eps.stats.timeouts, 0)
+        window_bytes = bulk_transfer.WINDOW_SIZE * (rs485.MAX_PAYLOAD_SIZE + 8)
+        window_s = window_bytes * 10 / rs485.RS485_BAUDRATE
+        gaps = [b - a for a, b in zip(reply_times, reply_times[1:])]
+        self.assertLess(max(gaps), 0.1 + window_s)
+        self.assertGreater(len(reply_times), 25)
+
+    def test_nack(self):
+        eps = bus_master.Node("eps", Address.EPS)
+        replies = []
+        schedule = [
+            bus_master.PollEntry(
+                eps, 0x55, 0.1, b"\x01", on_reply=lambda i, body: replies.append((i, bytes(body)))
+            )
+        ]
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.run_bus(sim, schedule, [Address.EPS], 0.25)
+        self.assertEqual(eps.stats.nacks, 3)
+        self.assertEqual(eps.stats.retries, 0)
+        self.assertEqual(replies[0], (MessageId.NACK, bytes([0x55, rs485.Status.UNKNOWN_MESSAGE])))
+
+    def test_timeouts_spend_the_retry_budget(self):
+        eps = bus_master.Node("eps", Address.EPS)
+        adcs = bus_master.Node("adcs", Address.ADCS, timeout_s=0.01, retry_budget=4)
+        schedule = [
+            bus_master.PollEntry(eps, MessageId.PING, 0.01),
+            bus_master.PollEntry(adcs, MessageId.PING, 0.01),
+        ]
+        with custom_module_mocking.HardwareSimulation() as sim:
+            # ADCS is not on the bus
+            self.run_bus(sim, schedule, [Address.EPS], 5.5)
+        # two failed requests use up the budget of four retries, the third goes unretried and
+        # ADCS goes offline, and then ADCS is polled once more, without retries
+        self.assertFalse(adcs.online)
+        self.assertEqual(adcs.stats.replies, 0)
+        self.assertEqual(adcs.stats.failures, 4)
+        self.assertEqual(adcs.stats.retries, 4)
+        self.assertEqual(adcs.stats.requests, 8)
+        self.assertEqual(adcs.stats.timeouts, 8)
+        # EPS keeps being polled at its period while ADCS is offline
+        self.assertEqual(eps.stats.timeouts, 0)
+        self.assertGreater(eps.stats.replies, 500)
+
+    def test_retry_budget_refills(self):
+        node = bus_master.Node("eps", Address.EPS, retry_budget=2)
+        window_ns = bus_master.RETRY_BUDGET_WINDOW_S * 1_000_000_000
+        self.assertEqual([node.take_retry(0) for _ in range(3)], [True, True, False])
+        self.assertEqual([node.take_retry(window_ns // 2) for _ in range(2)], [True, False])
+        self.assertEqual([node.take_retry(window_ns * 5) for _ in range(3)], [True, True, False])
+
+    def test_empty_schedule_is_rejected(self):
+        with self.assertRaises(ValueError):
+            bus_master.BusMaster(None, [])
+
+    def test_bench_recovers_from_bit_errors(self):
+        clean = rs485_bench.run_bench(2.0)
+        self.assertEqual(clean.corrupted_transmissions, 0)
+        self.assertEqual(clean.recovery_s, [])
+        self.assertGreater(clean.round_trips_per_s, 50)
+        self.assertLessEqual(clean.latency_us[50], clean.latency_us[99])
+
+        noisy = rs485_bench.run_bench(2.0, bit_error_rate=1e-4, seed=1)
+        self.assertGreater(noisy.corrupted_transmissions, 5)
+        self.assertEqual(noisy.collisions, 0)
+        self.assertEqual(len(noisy.recovery_s), noisy.corrupted_transmissions)
+        self.assertGreater(noisy.crc_errors + noisy.framing_errors, 0)
+        self.assertLess(noisy.round_trips_per_s, clean.round_trips_per_s)
+        # a corrupted frame costs at most the timeout, the retry, and the next round trip
+        timeout_s = bus_master.DEFAULT_TIMEOUT_S
+        self.assertLess(noisy.recovery_s[-1], timeout_s + 0.05)
+        self.assertIn("round trips/s", noisy.report())
+
+    def test_node_comes_back_online(self):
+        node = bus_master.Node("eps", Address.EPS)
+        node.consecutive_failures = bus_master.OFFLINE_AFTER_FAILURES
+        self.assertFalse(node.online)
+        schedule = [bus_master.PollEntry(node, MessageId.PING, 0.1)]
+        with custom_module_mocking.HardwareSimulation() as sim:
+            self.run_bus(sim, schedule, [Address.EPS], 0.35)
+        self.assertTrue(node.online)
+        self.assertEqual(node.stats.replies, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
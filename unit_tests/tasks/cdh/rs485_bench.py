@@ -0,0 +1,282 @@
+"""
+Host-side benchmark of the inter-subsystem RS485 protocol.
+
+Runs the CDH BusMaster against simulated subsystems on a SimulatedRs485Bus, inside the virtual
+clock of a HardwareSimulation. Every node uses the real Rs485Link, and bytes take exactly as long
+to cross the bus as they would at the configured baud rate. Bits can be flipped in transit and
+overlapping transmissions are garbled, so the throughput, latency, and error recovery of a
+protocol change can be measured deterministically, without boards:
+```sh
+python rs485_bench.py --duration 10 --bit-error-rate 1e-5
+```
+run from the directory the cdh_breakout_board_fc_sim artifact and its unit tests are deployed to.
+
+Each simulated subsystem answers pings and a telemetry request with a fixed body, serves bulk
+transfers of the objects it is given, and NACKs anything else. The recovery time of each
+corrupted transmission is measured from the end of the transmission to the next good reply
+handled by the BusMaster, so it includes any timeout and retry needed to recover.
+"""
+
+import sys
+import asyncio
+from unittest.mock import MagicMock
+
+try:
+    import digitalio  # noqa: F401
+except ImportError:
+    # outside pytest, mock away the firmware modules the same way conftest.py does
+    for name in ["analogio", "board", "busio", "digitalio", "microcontroller", "pwmio"]:
+        sys.modules[name] = MagicMock()
+
+import bus_master
+import bulk_transfer
+import inter_subsystem_rs485 as rs485
+from inter_subsystem_rs485 import Address, MessageId, HEADER_SIZE, REPLY_FLAG
+import loop_monitor
+import custom_module_mocking
+
+TELEMETRY_ID = 0x10
+TELEMETRY_SIZE = 120
+RESPONDER_POLL_PERIOD_S = 0.002
+PERCENTILES = [50, 90, 99]
+
+
+def telemetry_body(size=TELEMETRY_SIZE):
+    """Returns the body of the simulated subsystems' telemetry replies"""
+    return bytes(i % 255 + 1 for i in range(size))
+
+
+async def responder(
+    address,
+    tx,
+    rx,
+    de,
+    *,
+    telemetry_size=TELEMETRY_SIZE,
+    poll_period_s=RESPONDER_POLL_PERIOD_S,
+    baudrate=rs485.RS485_BAUDRATE,
+    objects=None,
+):
+    """
+    Simulates a subsystem at `address` which answers requests until cancelled, offering the
+    buffers in the `objects` dict, by object ID, for bulk transfer.
+    """
+    link = rs485.Rs485Link(tx, rx, de, baudrate=baudrate)
+    telemetry = bytes([address, TELEMETRY_ID | REPLY_FLAG]) + telemetry_body(telemetry_size)
+    sender = bulk_transfer.BulkSender(link, address)
+    for object_id, data in (objects or {}).items():
+        sender.offer(object_id, bulk_transfer.MemoryRegion(data))
+
+    def on_frame(payload):
+        if len(payload) < HEADER_SIZE or payload[0] != address or sender.handle(payload):
+            return
+        if payload[1] == MessageId.PING:
+            link.queue_frame(link.encode(bytes([address, MessageId.PING | REPLY_FLAG])))
+        elif payload[1] == TELEMETRY_ID:
+            link.queue_frame(link.encode(telemetry))
+        else:
+            nack = bytes([address, MessageId.NACK, payload[1], rs485.Status.UNKNOWN_MESSAGE])
+            link.queue_frame(link.encode(nack))
+
+    try:
+        while True:
+            link.poll(on_frame)
+            await sender.send_burst()
+            await asyncio.sleep(poll_period_s)
+    finally:
+        link.close()
+
+
+def use_simulated_hardware():
+    """Routes the PinManager's pins and UARTs to the HardwareSimulation, and resets singletons"""
+    custom_module_mocking.simulate_pin_manager_hardware()
+    loop_monitor.LoopMonitor._instance = None
+
+
+def attach_bus(sim, responders, **bus_options):
+    """
+    Creates a SimulatedRs485Bus connecting CDH to the subsystems at the `responders`
+    addresses. CDH uses the pins "CDH_TX", "CDH_RX", and "CDH_DE", and each subsystem uses
+    "TX<address>", "RX<address>", and "DE<address>".
+    """
+    bus = custom_module_mocking.SimulatedRs485Bus(**bus_options)
+    bus.attach(sim, "CDH_TX")
+    for address in responders:
+        bus.attach(sim, "TX%d" % address)
+    return bus
+
+
+def run_master(sim, master, responders, duration_s, **responder_options):
+    """Runs `master` and the subsystems at the `responders` addresses for `duration_s`"""
+
+    async def run():
+        tasks = [
+            asyncio.create_task(
+                responder(a, "TX%d" % a, "RX%d" % a, "DE%d" % a, **responder_options)
+            )
+            for a in responders
+        ]
+        try:
+            await asyncio.wait_for(master.run(), duration_s)
+        except asyncio.TimeoutError:
+            pass
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    sim.run(run())
+
+
+def percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of a sorted list, or None if it is empty"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-percent * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+class BenchResult:
+    """Measurements from a single run of the benchmark"""
+
+    def __init__(self, duration_s, master, bus, latencies_us, recovery_s):
+        self.duration_s = duration_s
+        self.round_trips_per_s = master.round_trips / duration_s
+        link_stats = master.link.stats
+        self.frames_per_s = (link_stats.frames_sent + link_stats.frames_received) / duration_s
+        self.bus_utilization = bus.bytes_transmitted * 10 / bus.baudrate / duration_s
+        latencies_us = sorted(latencies_us)
+        self.latency_us = {p: percentile(latencies_us, p) for p in PERCENTILES}
+        self.latency_us["max"] = latencies_us[-1] if latencies_us else None
+        self.recovery_s = sorted(recovery_s)
+        self.corrupted_transmissions = len(bus.corrupted_ns)
+        self.bit_errors = bus.bit_errors
+        self.collisions = bus.collisions
+        self.crc_errors = link_stats.crc_errors
+        self.framing_errors = link_stats.framing_errors
+        self.nodes = master.nodes
+
+    def report(self):
+        """Returns a human-readable summary of the result"""
+        lines = [
+            "%.1f round trips/s, %.1f frames/s, %.0f%% bus utilization over %.1f s"
+            % (
+                self.round_trips_per_s,
+                self.frames_per_s,
+                self.bus_utilization * 100,
+                self.duration_s,
+            ),
+            "latency: "
+            + ", ".join(
+                ["p%d %s us" % (p, self.latency_us[p]) for p in PERCENTILES]
+                + ["max %s us" % self.latency_us["max"]]
+            ),
+            "%d corrupted transmissions (%d bit errors, %d collisions), "
+            "%d CRC and %d framing errors at CDH"
+            % (
+                self.corrupted_transmissions,
+                self.bit_errors,
+                self.collisions,
+                self.crc_errors,
+                self.framing_errors,
+            ),
+        ]
+        if self.recovery_s:
+            lines.append(
+                "recovery: p50 %.1f ms, max %.1f ms"
+                % (percentile(self.recovery_s, 50) * 1e3, self.recovery_s[-1] * 1e3)
+            )
+        for node in self.nodes:
+            stats = node.stats
+            lines.append(
+                "%s: %d/%d replies, %d timeouts, %d retries, %d failures"
+                % (
+                    node.name,
+                    stats.replies,
+                    stats.requests,
+                    stats.timeouts,
+                    stats.retries,
+                    stats.failures,
+                )
+            )
+        return "\n".join(lines)
+
+
+def run_bench(
+    duration_s=5.0,
+    *,
+    responders=(Address.EPS, Address.ADCS),
+    telemetry_size=TELEMETRY_SIZE,
+    bit_error_rate=0.0,
+    baudrate=rs485.RS485_BAUDRATE,
+    seed=0,
+):
+    """
+    Polls telemetry from each of the subsystems at the `responders` addresses back to back for
+    `duration_s` seconds of virtual time, and returns a BenchResult.
+    """
+    use_simulated_hardware()
+    latencies_us = []
+    reply_ns = []
+    with custom_module_mocking.HardwareSimulation() as sim:
+
+        def on_reply(node):
+            def record(message_id, body):
+                reply_ns.append(sim.clock.monotonic_ns())
+                latencies_us.append(node.stats.latency_us.latest())
+
+            return record
+
+        schedule = []
+        for address in responders:
+            node = bus_master.Node("node %d" % address, address)
+            schedule.append(bus_master.PollEntry(node, TELEMETRY_ID, 0, on_reply=on_reply(node)))
+        bus = attach_bus(
+            sim, responders, baudrate=baudrate, bit_error_rate=bit_error_rate, seed=seed
+        )
+        link = rs485.Rs485Link("CDH_TX", "CDH_RX", "CDH_DE", baudrate=baudrate)
+        master = bus_master.BusMaster(link, schedule)
+        start_s = sim.clock.monotonic()
+        run_master(
+            sim,
+            master,
+            responders,
+            duration_s,
+            telemetry_size=telemetry_size,
+            baudrate=baudrate,
+        )
+        link.close()
+        # transmissions in progress when the run times out finish afterwards
+        elapsed_s = sim.clock.monotonic() - start_s
+
+    recovery_s = []
+    reply_index = 0
+    for corrupted_ns in bus.corrupted_ns:
+        while reply_index < len(reply_ns) and reply_ns[reply_index] <= corrupted_ns:
+            reply_index += 1
+        if reply_index < len(reply_ns):
+            recovery_s.append((reply_ns[reply_index] - corrupted_ns) / 1e9)
+    return BenchResult(elapsed_s, master, bus, latencies_us, recovery_s)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0, help="virtual seconds to run")
+    parser.add_argument("--bit-error-rate", type=float, default=0.0)
+    parser.add_argument("--baudrate", type=int, default=rs485.RS485_BAUDRATE)
+    parser.add_argument("--telemetry-size", type=int, default=TELEMETRY_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    result = run_bench(
+        args.duration,
+        telemetry_size=args.telemetry_size,
+        bit_error_rate=args.bit_error_rate,
+        baudrate=args.baudrate,
+        seed=args.seed,
+    )
+    print(result.report())
+
+
+if __name__ == "__main__":
+    main()
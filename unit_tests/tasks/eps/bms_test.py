@@ -0,0 +1,146 @@
+import unittest
+import asyncio
+import random
+from unittest.mock import patch
+
+import bms
+import datastore as ds
+import pin_manager
+import custom_module_mocking
+
+
+def set_healthy_string(string):
+    string.top_cell_voltage = 3.9
+    string.bottom_cell_voltage = 3.9
+    string.output_current = 0.1
+
+
+class BMS_Test(unittest.TestCase):
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def test_checks_with_missing_readings(self):
+        string = ds.DsBatteryString()
+        with patch.multiple(
+            bms,
+            DISCHARGING_CURRENT_THRESHOLD_A=2.0,
+            DISCHARGING_VOLTAGE_THRESHOLD_V=4.2,
+            DISCHARGING_TEMPERATURE_THRESHOLD_C=60,
+        ):
+            self.assertTrue(bms.string_discharge_check(string, [None] * 4))
+            set_healthy_string(string)
+            self.assertTrue(bms.string_discharge_check(string, [20, None, 20, 20]))
+            self.assertTrue(bms.string_discharge_check(string, [20] * 4))
+            self.assertFalse(bms.string_discharge_check(string, [20, 70, 20, 20]))
+            string.output_current = 3.0
+            self.assertFalse(bms.string_discharge_check(string, [20] * 4))
+
+    def test_all_strings_each_tick_with_change_only_writes(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        datastore = ds.Datastore()
+        datastore.batteries.temperatures = [20] * 4
+        for string in [
+            datastore.batteries.string_1,
+            datastore.batteries.string_2,
+            datastore.batteries.string_3,
+        ]:
+            set_healthy_string(string)
+        writes = []
+        real_setter = custom_module_mocking.DigitalInOut_Test.value.fset
+
+        def recording_setter(pin, value):
+            writes.append(value)
+            real_setter(pin, value)
+
+        async def run():
+            task = asyncio.create_task(
+                bms.battery_management_task(datastore, rate_hz=100)
+            )
+            await asyncio.sleep(0.035)
+            first_writes = len(writes)
+            datastore.batteries.string_2.output_current = 5.0
+            with patch.object(bms, "DISCHARGING_CURRENT_THRESHOLD_A", 2.0):
+                bms.notify_battery_data()
+                # wakes well before the next 10ms tick would be due
+                await asyncio.sleep(0.001)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return first_writes
+
+        with patch.object(
+            custom_module_mocking.DigitalInOut_Test,
+            "value",
+            property(custom_module_mocking.DigitalInOut_Test.value.fget, recording_setter),
+        ):
+            with custom_module_mocking.HardwareSimulation() as sim:
+                first_writes = sim.run(run())
+        self.assertEqual(first_writes, 12)
+        self.assertEqual(writes[12:], [True])
+        self.assertTrue(datastore.batteries.string_1.discharging_enabled)
+        self.assertFalse(datastore.batteries.string_2.discharging_enabled)
+        self.assertTrue(datastore.batteries.string_3.charging_enabled)
+        m_shd = pin_manager.PinManager.get_instance().create_digital_in_out(
+            bms.board.S2_DISCHARGE_SHD
+        )
+        self.assertFalse(m_shd.is_busy())
+
+    @patch.multiple(
+        bms,
+        MEASURABLE_DIFF_V=0.002,
+        SIGNIFICANT_DIFF_V=0.01,
+        BALANCING_VOLTAGE_THRESHOLD_V=3.9,
+        BALANCE_SHUNT_RESISTANCE_OHM=40,
+    )
+    def test_predictive_balancing(self):
+        random.seed(1)
+        string = ds.DsBatteryString()
+        string.charging_enabled = True
+        string.output_current = -1.0
+        balancer = bms.CellBalancer()
+        top_offset = 0.03
+        shunt_changes = 0
+        previous = (None, None)
+        for second in range(20000):
+            # the top shunt slowly bleeds away the top cell's excess charge
+            if string.top_balancing_shunt_enabled:
+                top_offset -= 0.000003
+            noise = random.uniform(-0.005, 0.005)
+            string.top_cell_voltage = 4.0 + top_offset + noise
+            string.bottom_cell_voltage = 4.0
+            bms.balance_string(string, balancer, second)
+            state = (string.top_balancing_shunt_enabled, string.bottom_balancing_shunt_enabled)
+            if state != previous:
+                shunt_changes += 1
+                previous = state
+            self.assertFalse(state[0] and state[1])
+        self.assertLess(abs(top_offset), 0.01)
+        self.assertLessEqual(shunt_changes, 6)
+        self.assertFalse(string.bottom_balancing_shunt_enabled)
+        string.charging_enabled = False
+        bms.balance_string(string, balancer, 20000)
+        self.assertFalse(string.top_balancing_shunt_enabled)
+        self.assertIsNone(balancer.shunt)
+
+    def test_balancing_uses_both_cells(self):
+        string = ds.DsBatteryString()
+        string.charging_enabled = True
+        string.top_cell_voltage = 3.5
+        string.bottom_cell_voltage = 4.1
+        with patch.multiple(
+            bms,
+            MEASURABLE_DIFF_V=0.002,
+            SIGNIFICANT_DIFF_V=0.01,
+            BALANCING_VOLTAGE_THRESHOLD_V=4.0,
+            BALANCE_SHUNT_RESISTANCE_OHM=40,
+        ):
+            bms.balance_string(string, bms.CellBalancer(), 0)
+        self.assertTrue(string.bottom_balancing_shunt_enabled)
+        self.assertFalse(string.top_balancing_shunt_enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,334 @@
+import unittest
+from unittest.mock import patch
+
+import icd
+import datastore as ds
+import inter_subsystem_rs485 as rs485
+import telemetry_codec
+import pin_manager
+import custom_module_mocking
+
+
+class _RecordingPin:
+    def __init__(self):
+        self.writes = []
+
+    @property
+    def value(self):
+        return self.writes[-1] if self.writes else None
+
+    @value.setter
+    def value(self, value):
+        self.writes.append(value)
+
+
+def create_controller(datastore, buses=None):
+    for window in icd.output_current_windows.values():
+        window.clear()
+    buses = icd.OUTPUT_BUSES if buses is None else buses
+    pins = [_RecordingPin() for _ in buses]
+    with patch.object(icd, "OUTPUT_BUSES", buses):
+        return icd.OutputBusController(datastore, pins), pins
+
+
+def output_bus(name, **policy):
+    # the named bus with the given policy and no startup delay unless one is given
+    return icd.OutputBus(
+        name, f"EN_{name.upper()}_BUS", f"bus_{name}", f"bus_{name}_enabled", **policy
+    )
+
+
+class OutputBusController_Test(unittest.TestCase):
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def test_change_only_writes(self):
+        datastore = ds.Datastore()
+        buses = [output_bus(name) for name in ["3v3", "5v", "12vlp", "12vhp"]]
+        controller, pins = create_controller(datastore, buses)
+        for _ in range(5):
+            controller.tick()
+        for pin in pins:
+            self.assertEqual(pin.writes, [True])
+        self.assertTrue(datastore.bus_12vhp.enabled)
+        datastore.control_commands.bus_5v_enabled = False
+        controller.tick()
+        controller.tick()
+        self.assertEqual(pins[1].writes, [True, False])
+        self.assertFalse(datastore.bus_5v.enabled)
+        self.assertEqual(pins[0].writes, [True])
+
+    def test_3v3_policy(self):
+        datastore = ds.Datastore()
+        datastore.batteries.pack_capacity_mah = 1000
+        datastore.batteries.filled_capacity_mah = 500
+        datastore.bus_3v3.output_current = 0.5
+        controller, pins = create_controller(datastore)
+        controller.tick()
+        self.assertTrue(datastore.bus_3v3.enabled)
+        datastore.bus_3v3.output_current = 1.0
+        for _ in range(icd.output_current_windows["3v3"].capacity):
+            controller.tick()
+        self.assertFalse(datastore.bus_3v3.enabled)
+        datastore.bus_3v3.output_current = 0.05
+        for _ in range(icd.output_current_windows["3v3"].capacity):
+            controller.tick()
+        self.assertTrue(datastore.bus_3v3.enabled)
+        datastore.batteries.filled_capacity_mah = 50
+        controller.tick()
+        self.assertFalse(datastore.bus_3v3.enabled)
+        self.assertEqual(pins[0].writes, [True, False, True, False])
+
+    def test_bus_without_limits_follows_commands(self):
+        datastore = ds.Datastore()
+        datastore.batteries.pack_capacity_mah = 1000
+        datastore.batteries.filled_capacity_mah = 0
+        datastore.bus_5v.output_current = 100.0
+        controller, pins = create_controller(datastore, [output_bus("5v")])
+        controller.tick()
+        self.assertTrue(datastore.bus_5v.enabled)
+        datastore.control_commands.bus_5v_enabled = False
+        controller.tick()
+        self.assertFalse(datastore.bus_5v.enabled)
+        datastore.control_commands.bus_5v_enabled = True
+        datastore.bus_5v.tripped = True
+        controller.tick()
+        self.assertFalse(datastore.bus_5v.enabled)
+        self.assertEqual(pins[0].writes, [True, False])
+
+    def test_startup_sequence(self):
+        datastore = ds.Datastore()
+        with patch("time.monotonic", return_value=0.0):
+            controller, pins = create_controller(datastore)
+        enabled_at = {}
+        for tick in range(50):
+            with patch("time.monotonic", return_value=tick / icd.TICK_RATE_HZ):
+                controller.tick()
+            for bus, pin in zip(icd.OUTPUT_BUSES, pins):
+                if pin.value and bus.name not in enabled_at:
+                    enabled_at[bus.name] = tick / icd.TICK_RATE_HZ
+        self.assertEqual(list(enabled_at), ["3v3", "5v", "12vlp", "12vhp"])
+        for bus in icd.OUTPUT_BUSES:
+            self.assertAlmostEqual(enabled_at[bus.name], bus.startup_delay_s)
+
+    def test_startup_delay(self):
+        datastore = ds.Datastore()
+        buses = [output_bus("3v3"), output_bus("5v", startup_delay_s=1.0)]
+        with patch("time.monotonic", return_value=10.0):
+            controller, pins = create_controller(datastore, buses)
+        for now_s in [10.0, 10.5, 10.99]:
+            with patch("time.monotonic", return_value=now_s):
+                controller.tick()
+            self.assertTrue(datastore.bus_3v3.enabled)
+            self.assertFalse(datastore.bus_5v.enabled)
+            self.assertEqual(pins[1].writes, [])
+        with patch("time.monotonic", return_value=11.0):
+            controller.tick()
+        self.assertTrue(datastore.bus_5v.enabled)
+        self.assertEqual(pins[0].writes, [True])
+        self.assertEqual(pins[1].writes, [True])
+
+    def test_fast_trip(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        datastore = ds.Datastore()
+        controller, pins = create_controller(datastore)
+        controller.tick()
+        self.assertTrue(datastore.bus_3v3.enabled)
+        with patch("time.monotonic_ns", return_value=1000):
+            icd.record_output_current_sample(datastore, "3v3", 0.2, 900)
+            self.assertEqual(datastore.bus_3v3.trip_count, 0)
+            icd.record_output_current_sample(datastore, "3v3", 5.0, 900)
+            icd.record_output_current_sample(datastore, "3v3", 5.0, 950)
+        m_en = pin_manager.PinManager.get_instance().create_digital_in_out(
+            icd.board.EN_3V3_BUS
+        )
+        self.assertFalse(m_en._instance.value)
+        self.assertTrue(datastore.bus_3v3.tripped)
+        self.assertFalse(datastore.bus_3v3.enabled)
+        self.assertEqual(datastore.bus_3v3.trip_count, 1)
+        self.assertEqual(datastore.bus_3v3.last_trip_latency_ns, 100)
+        # the latch holds until CDH commands the bus off, however long ago the trip was
+        datastore.bus_3v3.output_current = 0.2
+        with patch("time.monotonic_ns", return_value=1000 + 3600 * 10**9):
+            controller.tick()
+        self.assertFalse(datastore.bus_3v3.enabled)
+        self.assertEqual(pins[0].writes, [True, False])
+        datastore.control_commands.bus_3v3_enabled = False
+        controller.tick()
+        self.assertFalse(datastore.bus_3v3.tripped)
+        datastore.control_commands.bus_3v3_enabled = True
+        controller.tick()
+        self.assertTrue(datastore.bus_3v3.enabled)
+        self.assertEqual(pins[0].writes, [True, False, True])
+
+
+class ReplyCollector(custom_module_mocking.SimulatedUartPeer):
+    def replies(self):
+        res = []
+        for encoded in bytes(self.received).split(b"\x00"):
+            if encoded:
+                buffer = bytearray(encoded)
+                length = rs485.cobs_decode_in_place(buffer, len(buffer))
+                res.append(bytes(buffer[: length - rs485.CRC_SIZE]))
+        self.received = bytearray()
+        return res
+
+
+class IcdEngine_Test(unittest.TestCase):
+
+    def setUp(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def request(self, sim, peer, link, on_frame, address, message_id, body=b""):
+        payload = bytearray(rs485.HEADER_SIZE + len(body) + rs485.CRC_SIZE)
+        payload[0] = address
+        payload[1] = message_id
+        payload[rs485.HEADER_SIZE : rs485.HEADER_SIZE + len(body)] = body
+        frame = bytearray(rs485.max_frame_size(len(payload)))
+        size = rs485.encode_frame_into(payload, rs485.HEADER_SIZE + len(body), frame)
+        peer.send(frame[:size])
+        sim.clock.advance(0.01)
+        link.poll(on_frame)
+        sim.run(link.flush())
+        return peer.replies()
+
+    def test_telemetry_groups_fit_in_a_frame(self):
+        fields = []
+        for message_id in icd.TELEMETRY_GROUPS:
+            snapshot = icd.telemetry_snapshot(message_id)
+            self.assertLessEqual(rs485.HEADER_SIZE + snapshot.size, rs485.MAX_PAYLOAD_SIZE)
+            fields.extend(snapshot.fields)
+        self.assertEqual(sorted(fields, key=repr), sorted(ds.SNAPSHOT_FIELDS, key=repr))
+
+    def test_requests(self):
+        datastore = ds.Datastore()
+        datastore.batteries.string_1.top_cell_voltage = 3.5
+        datastore.health.boot_count = 7
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = ReplyCollector()
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE")
+            engine = icd.IcdEngine(datastore)
+            on_frame = engine.frame_handler(link)
+
+            def request(*args):
+                return self.request(sim, peer, link, on_frame, *args)
+
+            self.assertEqual(
+                request(rs485.Address.EPS, rs485.MessageId.PING),
+                [bytes([rs485.Address.EPS, rs485.MessageId.PING | rs485.REPLY_FLAG])],
+            )
+            self.assertEqual(request(rs485.Address.ADCS, rs485.MessageId.PING), [])
+
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_BATTERY_TELEMETRY)
+            self.assertEqual(reply[1], rs485.MessageId.EPS_BATTERY_TELEMETRY | rs485.REPLY_FLAG)
+            received = ds.Datastore()
+            snapshot = icd.telemetry_snapshot(rs485.MessageId.EPS_BATTERY_TELEMETRY)
+            self.assertEqual(len(reply), rs485.HEADER_SIZE + snapshot.size)
+            snapshot.unpack_from(received, reply, rs485.HEADER_SIZE)
+            self.assertEqual(received.batteries.string_1.top_cell_voltage, 3.5)
+
+            # replies are served from the prepacked frame until it is refreshed
+            datastore.health.boot_count = 8
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_HEALTH_TELEMETRY)
+            snapshot = icd.telemetry_snapshot(rs485.MessageId.EPS_HEALTH_TELEMETRY)
+            snapshot.unpack_from(received, reply, rs485.HEADER_SIZE)
+            self.assertEqual(received.health.boot_count, 7)
+            engine.refresh()
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_HEALTH_TELEMETRY)
+            snapshot.unpack_from(received, reply, rs485.HEADER_SIZE)
+            self.assertEqual(received.health.boot_count, 8)
+
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_SET_BUS_ENABLES, b"\x05")
+            self.assertEqual(reply[2], rs485.Status.OK)
+            commands = datastore.control_commands
+            self.assertEqual(
+                [
+                    commands.bus_3v3_enabled,
+                    commands.bus_5v_enabled,
+                    commands.bus_12vlp_enabled,
+                    commands.bus_12vhp_enabled,
+                ],
+                [True, False, True, False],
+            )
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_BUS_TELEMETRY)
+            snapshot = icd.telemetry_snapshot(rs485.MessageId.EPS_BUS_TELEMETRY)
+            snapshot.unpack_from(received, reply, rs485.HEADER_SIZE)
+            self.assertFalse(received.control_commands.bus_5v_enabled)
+
+            [reply] = request(rs485.Address.EPS, rs485.MessageId.EPS_SET_BUS_ENABLES)
+            nack = [rs485.MessageId.NACK, rs485.MessageId.EPS_SET_BUS_ENABLES]
+            self.assertEqual(reply[1:], bytes(nack + [rs485.Status.BAD_LENGTH]))
+            [reply] = request(rs485.Address.EPS, 0x55)
+            nack = [rs485.MessageId.NACK, 0x55, rs485.Status.UNKNOWN_MESSAGE]
+            self.assertEqual(reply[1:], bytes(nack))
+            link.close()
+        self.assertEqual(engine.requests, 8)
+        self.assertEqual(engine.unknown_requests, 1)
+
+    def test_delta_telemetry(self):
+        datastore = ds.Datastore()
+        batteries = datastore.batteries
+        for i, string in enumerate([batteries.string_1, batteries.string_2, batteries.string_3]):
+            string.top_cell_voltage = 3.6 + i / 100
+            string.bottom_cell_voltage = 3.61 + i / 100
+            string.output_current = 0.5
+            string.discharging_enabled = True
+            string.charging_enabled = True
+            string.top_balancing_shunt_enabled = False
+            string.bottom_balancing_shunt_enabled = False
+        batteries.temperatures[:] = [20.0, 21.0, 22.0, 23.0]
+        batteries.state_of_charge = 0.8
+        group = rs485.MessageId.EPS_BATTERY_TELEMETRY
+        fields = icd.telemetry_snapshot(group).fields
+        full_size = icd.telemetry_snapshot(group).size
+        decoder = telemetry_codec.TelemetryDecoder(fields, ds.TELEMETRY_SCALES)
+        received = ds.Datastore()
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = ReplyCollector()
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE")
+            engine = icd.IcdEngine(datastore)
+            on_frame = engine.frame_handler(link)
+
+            def request(*body):
+                [reply] = self.request(
+                    sim, peer, link, on_frame, rs485.Address.EPS,
+                    rs485.MessageId.EPS_DELTA_TELEMETRY, bytes(body),
+                )
+                self.assertEqual(reply[1], rs485.MessageId.EPS_DELTA_TELEMETRY | rs485.REPLY_FLAG)
+                self.assertEqual(reply[2], group)
+                return decoder.decode_from(received, reply, 3), len(reply) - 3
+
+            sequence, key_size = request(group)
+            self.assertEqual(received.batteries.string_3.top_cell_voltage, 3.62)
+            self.assertIs(received.batteries.string_1.charging_enabled, True)
+            self.assertEqual(received.batteries.temperatures, [20.0, 21.0, 22.0, 23.0])
+            self.assertLess(key_size, full_size)
+
+            batteries.string_2.output_current = 0.52
+            batteries.temperatures[0] = 20.05
+            sequence, delta_size = request(group, sequence)
+            self.assertEqual(received.batteries.string_2.output_current, 0.52)
+            self.assertEqual(received.batteries.temperatures[0], 20.05)
+            self.assertLess(delta_size * 8, full_size)
+
+            [reply] = self.request(
+                sim, peer, link, on_frame, rs485.Address.EPS,
+                rs485.MessageId.EPS_DELTA_TELEMETRY, b"\x55",
+            )
+            self.assertEqual(reply[3], rs485.Status.BAD_VALUE)
+            link.close()
+
+    def test_delta_telemetry_fits_in_a_frame(self):
+        engine = icd.IcdEngine(ds.Datastore())
+        for encoder in engine.encoders.values():
+            self.assertLessEqual(rs485.HEADER_SIZE + 1 + encoder.max_size, rs485.MAX_PAYLOAD_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
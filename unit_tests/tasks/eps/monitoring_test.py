@@ -0,0 +1,204 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+
+import monitoring
+import icd
+import datastore as ds
+import datastore_path
+import loop_monitor
+import custom_module_mocking
+from ads1118 import ADS1118_SPS_DELAYS
+
+
+ADC_PINS = dict(
+    ADC_SCK="SCK",
+    ADC_MOSI="MOSI",
+    ADC_MISO="MISO",
+    **{"ADC_CS%d" % i: "CS%d" % i for i in range(1, 8)},
+)
+
+
+def run_schedule(datastore, duration_s, channels):
+    adcs = {}
+    with patch.multiple(
+        monitoring.board, **ADC_PINS
+    ), custom_module_mocking.HardwareSimulation() as sim:
+        for i in range(1, 8):
+            adcs[i] = custom_module_mocking.SimulatedAds1118(
+                "CS%d" % i, "MISO", channels=channels.get(i, {})
+            )
+            sim.attach_spi_device("SCK", adcs[i])
+
+        async def run():
+            task = asyncio.create_task(monitoring.data_recording_task(datastore))
+            await asyncio.sleep(duration_s)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        sim.run(run())
+    return adcs
+
+
+class Monitoring_Test(unittest.TestCase):
+
+    def setUp(self):
+        for window in icd.output_current_windows.values():
+            window.clear()
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def test_schedule_covers_every_channel_once(self):
+        channels = [(m.adc, m.channel) for m in monitoring.SCHEDULE]
+        self.assertEqual(len(channels), len(set(channels)))
+        self.assertEqual(len(set(m.name for m in monitoring.SCHEDULE)), len(channels))
+        datastore = ds.Datastore()
+        for m in monitoring.SCHEDULE:
+            target = datastore_path.resolve(datastore, m.target)
+            if isinstance(m.field, int):
+                self.assertLess(m.field, len(target))
+            else:
+                self.assertTrue(hasattr(target, m.field))
+
+    def test_measurements_grouped_by_settings(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        datastore = ds.Datastore()
+        with patch.multiple(monitoring.board, **ADC_PINS):
+            schedules, statistics = monitoring.create_adc_schedules(datastore)
+        self.assertEqual(len(schedules), 7)
+        self.assertEqual(len(statistics), len(monitoring.SCHEDULE))
+        for schedule in schedules.values():
+            settings = [(m.input_range, m.sample_rate) for m in schedule.measurements]
+            self.assertEqual(settings, sorted(settings))
+
+    def test_simulated_sampling(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        datastore = ds.Datastore()
+        channels = {
+            1: {4: 1.95, 5: 1.95, 6: 0.2, 7: 0.7},
+            6: {4: 0.1},
+        }
+        run_schedule(datastore, 2.0, channels)
+        string = datastore.batteries.string_1
+        self.assertAlmostEqual(string.top_cell_voltage, 3.9, places=2)
+        self.assertAlmostEqual(string.bottom_cell_voltage, 3.9, places=2)
+        self.assertAlmostEqual(string.output_current, 0.2, places=2)
+        self.assertAlmostEqual(datastore.batteries.temperatures[0], 20.0, places=0)
+        self.assertAlmostEqual(datastore.bus_3v3.output_current, 0.1, places=2)
+        self.assertFalse(datastore.bus_3v3.tripped)
+        for m in monitoring.SCHEDULE:
+            sampling = datastore.sampling[m.name]
+            self.assertAlmostEqual(
+                sampling.achieved_rate_hz, 1 / m.period_s, delta=0.1 / m.period_s
+            )
+            self.assertLessEqual(sampling.staleness_s, 1.0)
+        self.assertGreaterEqual(datastore.sampling["bus_3v3_output_current"].samples, 95)
+
+    def test_output_current_fast_trip(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        datastore = ds.Datastore()
+        datastore.bus_3v3.enabled = True
+        run_schedule(datastore, 0.1, {6: {4: 2.0}})
+        self.assertTrue(datastore.bus_3v3.tripped)
+        self.assertEqual(datastore.bus_3v3.trip_count, 1)
+        # the latency runs from the start of the conversion, so it includes the conversion time
+        measurement = next(
+            m for m in monitoring.SCHEDULE if m.name == "bus_3v3_output_current"
+        )
+        self.assertGreaterEqual(
+            datastore.bus_3v3.last_trip_latency_ns,
+            ADS1118_SPS_DELAYS[measurement.sample_rate] * 1e9,
+        )
+        self.assertFalse(datastore.bus_5v.tripped)
+
+    def test_boot_records(self):
+        nvm = bytearray(64)
+        reason = monitoring.RESET_REASONS.index("WATCHDOG")
+        self.assertEqual(monitoring.record_boot(nvm, reason, offset=8)[0], 1)
+        boot_count, reset_counts = monitoring.record_boot(nvm, reason, offset=8)
+        self.assertEqual(boot_count, 2)
+        self.assertEqual(reset_counts[reason], 2)
+        boot_count, reset_counts = monitoring.record_boot(nvm, 0, offset=8)
+        self.assertEqual(boot_count, 3)
+        self.assertEqual(reset_counts[0], 1)
+        self.assertEqual(sum(reset_counts), 3)
+        self.assertEqual(nvm[:8], bytearray(8))
+        with patch.object(monitoring.microcontroller.ResetReason, "BROWNOUT", "brownout"):
+            self.assertEqual(
+                monitoring.reset_reason_code("brownout"),
+                monitoring.RESET_REASONS.index("BROWNOUT"),
+            )
+        self.assertEqual(
+            monitoring.reset_reason_code(object()), monitoring.RESET_REASONS.index("UNKNOWN")
+        )
+
+    def test_heap_growth(self):
+        health = ds.DsHealth()
+        allocated = [10000]
+        with patch.object(
+            monitoring.gc, "mem_alloc", lambda: allocated[0], create=True
+        ), patch.object(monitoring.gc, "mem_free", lambda: 50000 - allocated[0], create=True):
+            heap = monitoring.HeapMonitor()
+            for _ in range(10):
+                heap.check(health, period_s=60)
+                allocated[0] += 100
+        # 100 bytes per minute
+        self.assertEqual(health.heap_growth_bph, 6000)
+        self.assertEqual(health.mem_free, 50000 - 10900)
+        self.assertEqual(health.mem_free_min, 50000 - 10900)
+        self.assertFalse(health.heap_fragmented)
+
+    def test_watchdog_fed_only_while_tasks_run(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        loop_monitor.LoopMonitor._instance = None
+        datastore = ds.Datastore()
+        feeds = []
+
+        def watchdog_level():
+            return sim.pin_levels.get("WATCHDOG_FEED")
+
+        async def worker(stop_after_s):
+            loop_timer = loop_monitor.LoopMonitor.get_instance().register("worker", 0.1)
+            start_s = asyncio.get_event_loop().time()
+            while asyncio.get_event_loop().time() - start_s < stop_after_s:
+                loop_timer.tick()
+                await asyncio.sleep(0.1)
+
+        async def run():
+            health = asyncio.create_task(monitoring.health_task(datastore, rate_hz=10))
+            work = asyncio.create_task(worker(2.0))
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                feeds.append(watchdog_level())
+            health.cancel()
+            work.cancel()
+            for task in [health, work]:
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        nvm = bytearray(32)
+        with patch.object(monitoring.microcontroller, "nvm", nvm), patch.object(
+            monitoring.board, "WATCHDOG_FEED", "WATCHDOG_FEED"
+        ), custom_module_mocking.HardwareSimulation() as sim:
+            sim.run(run())
+        changes = [i for i in range(1, len(feeds)) if feeds[i] != feeds[i - 1]]
+        # fed every tick until the worker has missed its deadline of ten periods
+        self.assertGreaterEqual(len(changes), 25)
+        self.assertLess(changes[-1], 32)
+        self.assertEqual(datastore.health.stalled_task, "worker")
+        self.assertEqual(datastore.health.boot_count, 1)
+        self.assertEqual(
+            datastore.health.reset_reason, monitoring.RESET_REASONS.index("UNKNOWN")
+        )
+        self.assertEqual(datastore.health.uptime_s, 4)
+        self.assertIn("worker", datastore.health.task_overrun_ms)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+
+import solar
+import datastore as ds
+import custom_module_mocking
+
+
+class Solar_Test(unittest.TestCase):
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def test_mppt_status_decoding(self):
+        mppt = ds.DsMppt()
+        decoder = solar.MpptStatusDecoder(rate_hz=10)
+        for _ in range(5):
+            decoder.update(False, mppt)
+        self.assertEqual(mppt.charging_stage, solar.MpptChargingStage.CHARGING)
+        decoder.update(True, mppt)
+        self.assertEqual(mppt.charging_stage, solar.MpptChargingStage.NOT_CHARGING)
+        self.assertIsNone(mppt.fault)
+        for i in range(10):
+            decoder.update(i % 2 == 0, mppt)
+        self.assertEqual(mppt.charging_stage, solar.MpptChargingStage.FAULTED)
+        self.assertIsNotNone(mppt.fault)
+        for _ in range(solar.STATUS_WINDOW_S * 10):
+            decoder.update(False, mppt)
+        self.assertEqual(mppt.charging_stage, solar.MpptChargingStage.CHARGING)
+        self.assertIsNone(mppt.fault)
+
+    def test_harvest_accumulation(self):
+        harvest = solar.HarvestAccumulator()
+        for _ in range(2 * 3600):
+            harvest.add(10.0, 1.0)
+        self.assertAlmostEqual(harvest.total_wh, 20.0, places=3)
+        self.assertAlmostEqual(
+            harvest.recent_wh(), 10.0 * solar.HARVEST_WINDOW_S / 3600, places=2
+        )
+        self.assertAlmostEqual(harvest.recent_wh(600), 10.0 * 600 / 3600, places=3)
+
+    def test_monitor_requires_voltage(self):
+        datastore = ds.Datastore()
+        monitor = solar.SolarArrayMonitor(datastore, rate_hz=10)
+        for panel in datastore.solar_array.panels:
+            panel.output_current = 0.5
+        monitor.update(0)
+        self.assertIsNone(datastore.solar_array.panels[0].power_w)
+        self.assertEqual(datastore.solar_array.power_w, 0)
+        datastore.mppt.input_voltage = 8.0
+        datastore.solar_array.panels[3].output_current = None
+        for i in range(1, 11):
+            monitor.update(i * 100_000_000)
+        self.assertAlmostEqual(datastore.solar_array.panels[0].power_w, 4.0)
+        self.assertIsNone(datastore.solar_array.panels[3].power_w)
+        self.assertAlmostEqual(datastore.solar_array.power_w, 12.0)
+        self.assertAlmostEqual(datastore.solar_array.peak_power_w, 12.0)
+        self.assertAlmostEqual(datastore.solar_array.energy_harvested_wh, 12.0 / 3600)
+        self.assertAlmostEqual(datastore.solar_array.panels[0].energy_harvested_wh, 4.0 / 3600)
+
+    def test_simulated_task(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        pins = dict(
+            ADC_SCK="SCK",
+            ADC_MOSI="MOSI",
+            ADC_MISO="MISO",
+            SA_ADC_CS1="CS1",
+            SA_ADC_CS2="CS2",
+            SA_ADC_CS3="CS3",
+            SA_ADC_CS4="CS4",
+            MPPT_EN="MPPT_EN",
+            MPPT_STATUS="MPPT_STATUS",
+        )
+        datastore = ds.Datastore()
+        datastore.mppt.input_voltage = 10.0
+        with patch.multiple(solar.board, **pins), custom_module_mocking.HardwareSimulation() as sim:
+            adcs = []
+            for i in range(4):
+                adc = custom_module_mocking.SimulatedAds1118(
+                    "CS%d" % (i + 1), "MISO", channels={4: 0.75, 5: 0.75, 6: 0.75, 7: 0.1 * i}
+                )
+                sim.attach_spi_device("SCK", adc)
+                adcs.append(adc)
+            sim.drive_pin("MPPT_STATUS", lambda: False)
+
+            async def run():
+                task = asyncio.create_task(solar.solar_array_task(datastore, rate_hz=10))
+                await asyncio.sleep(2.05)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+            sim.run(run())
+            self.assertTrue(sim.pin_levels["MPPT_EN"])
+        self.assertTrue(datastore.mppt.enabled)
+        self.assertEqual(datastore.mppt.charging_stage, solar.MpptChargingStage.CHARGING)
+        panels = datastore.solar_array.panels
+        for i in range(4):
+            self.assertAlmostEqual(panels[i].output_current, 0.1 * i, places=3)
+            self.assertAlmostEqual(panels[i].top_temperature, 25.0, places=1)
+        self.assertAlmostEqual(datastore.solar_array.power_w, 6.0, places=2)
+        # one current conversion per tick per panel, plus temperatures once per second
+        self.assertEqual(adcs[0].conversions, 21 + 3 * 3)
+        self.assertAlmostEqual(datastore.solar_array.energy_harvested_wh, 6.0 * 2 / 3600, places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
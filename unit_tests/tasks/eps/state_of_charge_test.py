@@ -0,0 +1,127 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+
+import state_of_charge as soc
+import datastore as ds
+import custom_module_mocking
+
+
+def simulate_discharge(estimator, true_soc, capacity_mah, current, seconds, step_s=1.0):
+    """Discharges an ideal pack and feeds its measurements to the estimator"""
+    time_ns = 0
+    for _ in range(int(seconds / step_s)):
+        time_ns += int(step_s * 1e9)
+        true_soc -= current * step_s / 3.6 / capacity_mah
+        cell_voltage = soc.ocv_from_soc(true_soc) - estimator._cell_ir_drop(current)
+        estimator.update(current, cell_voltage, time_ns)
+    return true_soc, time_ns
+
+
+class StateOfCharge_Test(unittest.TestCase):
+
+    def test_ocv_table_lookups(self):
+        for value in [0.0, 0.05, 0.33, 0.5, 0.91, 1.0]:
+            self.assertAlmostEqual(soc.soc_from_ocv(soc.ocv_from_soc(value)), value)
+        self.assertEqual(soc.soc_from_ocv(2.5), 0.0)
+        self.assertEqual(soc.soc_from_ocv(4.5), 1.0)
+        self.assertAlmostEqual(soc.cell_energy_fraction(0.0), 0.0)
+        self.assertGreater(soc.cell_energy_fraction(1.0), 3.5)
+        self.assertLess(soc.cell_energy_fraction(1.0), 4.2)
+
+    def test_converges_from_wrong_initial_estimate(self):
+        estimator = soc.SocEstimator(capacity_mah=9000)
+        estimator.update(0.0, soc.ocv_from_soc(0.9), 0)
+        self.assertAlmostEqual(estimator.soc, 0.9)
+        estimator.soc = 0.5
+        true_soc, _ = simulate_discharge(estimator, 0.9, 9000, 3.0, 600)
+        self.assertAlmostEqual(estimator.soc, true_soc, places=2)
+        self.assertLess(estimator.variance, soc.INITIAL_VARIANCE)
+
+    def test_tracks_capacity_fade(self):
+        estimator = soc.SocEstimator(capacity_mah=9000)
+        actual_capacity = 7000
+        estimator.update(0.0, soc.ocv_from_soc(0.95), 0)
+        true_soc, time_ns = simulate_discharge(
+            estimator, 0.95, actual_capacity, 3.5, 3600
+        )
+        for _ in range(10):
+            # the pack rests, so the capacity estimate is refreshed
+            time_ns += int(1e9)
+            estimator.update(0.0, soc.ocv_from_soc(true_soc), time_ns)
+        self.assertLess(estimator.capacity_mah, 9000)
+
+    def test_publish(self):
+        estimator = soc.SocEstimator(capacity_mah=9000)
+        batteries = ds.DsBatteryPack()
+        for string in [batteries.string_1, batteries.string_2, batteries.string_3]:
+            string.output_current = 0.5
+            string.top_cell_voltage = 3.8
+            string.bottom_cell_voltage = 3.8
+        current, voltage = soc.pack_measurements(batteries)
+        self.assertAlmostEqual(current, 1.5)
+        self.assertAlmostEqual(voltage, 3.8)
+        for i in range(100):
+            estimator.update(current, voltage, i * 100000000)
+        estimator.publish(batteries)
+        self.assertEqual(batteries.pack_capacity_mah, 9000)
+        self.assertAlmostEqual(
+            batteries.filled_capacity_mah, batteries.state_of_charge * 9000
+        )
+        self.assertGreater(batteries.remaining_energy_wh, 0)
+        self.assertGreater(batteries.time_to_empty_s, 0)
+        batteries.string_2.top_cell_voltage = None
+        self.assertIsNone(soc.pack_measurements(batteries))
+
+    def test_task_updates_on_new_string_currents(self):
+        datastore = ds.Datastore()
+        for string in [
+            datastore.batteries.string_1,
+            datastore.batteries.string_2,
+            datastore.batteries.string_3,
+        ]:
+            string.output_current = 0.5
+            string.top_cell_voltage = 3.8
+            string.bottom_cell_voltage = 3.8
+        samplings = [ds.DsChannelSampling(0.1) for _ in soc.STRING_CURRENT_MEASUREMENTS]
+        for name, sampling in zip(soc.STRING_CURRENT_MEASUREMENTS, samplings):
+            datastore.sampling[name] = sampling
+        update_times_ns = []
+        update = soc.SocEstimator.update
+
+        def recording_update(estimator, pack_current, cell_voltage, time_ns):
+            update_times_ns.append(time_ns)
+            update(estimator, pack_current, cell_voltage, time_ns)
+
+        async def run():
+            task = asyncio.create_task(soc.state_of_charge_task(datastore))
+            await asyncio.sleep(0.01)
+            for sample_ns in [1000000, 2000000]:
+                # each string's current is sampled a little after the previous one
+                for i, sampling in enumerate(samplings):
+                    sampling.last_time_ns = sample_ns + i * 1000
+                soc.notify_string_current()
+                await asyncio.sleep(0.001)
+            # a new sample of one string alone is not a new pack reading
+            samplings[0].last_time_ns = 3000000
+            soc.notify_string_current()
+            await asyncio.sleep(0.001)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        with patch.object(
+            soc.SocEstimator, "update", recording_update
+        ), custom_module_mocking.HardwareSimulation() as sim:
+            sim.run(run())
+        # woken by each notification rather than the task's 1 s tick, and stamped with the
+        # time of the last string current sample
+        self.assertEqual(update_times_ns, [1002000, 2002000])
+        self.assertIsNotNone(datastore.batteries.state_of_charge)
+        self.assertIsNone(soc.pack_sample_time_ns(datastore, 2002000))
+
+
+if __name__ == "__main__":
+    unittest.main()
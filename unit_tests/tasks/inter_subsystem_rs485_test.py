@@ -0,0 +1,175 @@
+import unittest
+import asyncio
+import random
+
+import inter_subsystem_rs485 as rs485
+import custom_module_mocking
+
+
+def decode_frames(data):
+    frames = []
+    for encoded in bytes(data).split(b"\x00"):
+        if not encoded:
+            continue
+        buffer = bytearray(encoded)
+        length = rs485.cobs_decode_in_place(buffer, len(buffer))
+        frames.append(bytes(buffer[: length - rs485.CRC_SIZE]))
+    return frames
+
+
+class DeCheckingPeer(custom_module_mocking.SimulatedUartPeer):
+    def __init__(self, de_pin):
+        super().__init__()
+        self.de_pin = de_pin
+        self.de_levels = []
+
+    def on_receive(self, data):
+        self.de_levels.append(self.simulation.pin_levels.get(self.de_pin))
+        super().on_receive(data)
+
+
+class Rs485_Test(unittest.TestCase):
+
+    def tearDown(self):
+        custom_module_mocking.restore_pin_manager_hardware()
+
+    def test_crc(self):
+        self.assertEqual(rs485.crc16(b"123456789"), 0x29B1)
+        self.assertEqual(rs485.crc16(b"6789", rs485.crc16(b"12345")), 0x29B1)
+
+    def test_cobs_round_trip(self):
+        random.seed(2)
+        payloads = [
+            b"",
+            b"\x00",
+            b"\x00\x00",
+            b"\x11\x00\x22",
+            bytes(range(1, 255)),
+            bytes(range(1, 256)),
+            bytes(range(256)),
+            bytes(random.choice([0, 1, 255]) for _ in range(600)),
+        ]
+        for payload in payloads:
+            encoded = bytearray(len(payload) + len(payload) // 254 + 2)
+            size = rs485.cobs_encode_into(payload, len(payload), encoded)
+            self.assertNotIn(0, encoded[:size])
+            self.assertLessEqual(size, len(payload) + len(payload) // 254 + 1)
+            self.assertEqual(rs485.cobs_decode_in_place(encoded, size), len(payload))
+            self.assertEqual(bytes(encoded[: len(payload)]), payload)
+        self.assertEqual(rs485.cobs_decode_in_place(bytearray(b"\x05\x01"), 2), -1)
+
+    def test_send_drives_de_only_while_transmitting(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = DeCheckingPeer("DE")
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE")
+            start_s = sim.clock.monotonic()
+            sim.run(link.send(b"\x01\x00\x02"))
+            sim.run(link.send(bytes(200)))
+            elapsed_s = sim.clock.monotonic() - start_s
+            self.assertFalse(sim.pin_levels["DE"])
+            link.close()
+        self.assertEqual(peer.de_levels, [True, True])
+        self.assertEqual(decode_frames(peer.received), [b"\x01\x00\x02", bytes(200)])
+        self.assertAlmostEqual(elapsed_s, len(peer.received) * 10 / rs485.RS485_BAUDRATE, places=4)
+        with self.assertRaises(ValueError):
+            link.encode(bytes(rs485.MAX_PAYLOAD_SIZE + 1))
+
+    def test_other_tasks_run_while_transmitting(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(sim.clock.monotonic_ns())
+                await asyncio.sleep(0.001)
+
+        async def transmit():
+            task = asyncio.create_task(ticker())
+            await asyncio.sleep(0)
+            link.queue_frame(link.encode(bytes(range(1, 201))))
+            await link.flush()
+            task.cancel()
+
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = DeCheckingPeer("DE")
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE")
+            sim.run(transmit())
+            elapsed_ns = sim.clock.monotonic_ns()
+            self.assertFalse(sim.pin_levels["DE"])
+            link.close()
+        self.assertEqual(decode_frames(peer.received), [bytes(range(1, 201))])
+        frame_ns = len(peer.received) * 10e9 / rs485.RS485_BAUDRATE
+        self.assertAlmostEqual(elapsed_ns, frame_ns, delta=1000)
+        # the ticker only stops for the final guard time of the frame
+        self.assertGreaterEqual(len(ticks), int((frame_ns / 1e9 - rs485.TX_GUARD_S) / 0.001))
+        self.assertEqual(link.stats.frames_sent, 1)
+
+    def test_receive_at_full_baud_rate_under_load(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        random.seed(3)
+        payloads = [
+            bytes(random.randrange(256) for _ in range(random.randrange(1, 120)))
+            for _ in range(150)
+        ]
+        received = []
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = custom_module_mocking.SimulatedUartPeer()
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE")
+            stream = bytearray(b"\x13\x37")  # end of a frame sent before the receiver started
+            for payload in payloads:
+                stream.extend(link.encode(payload))
+            # corrupt one frame, which should be dropped without losing the next
+            corrupt = bytearray(link.encode(b"corrupted frame"))
+            corrupt[3] ^= 0x40
+            stream.extend(corrupt)
+            stream.extend(link.encode(b"last"))
+            peer.send(stream, baudrate=rs485.RS485_BAUDRATE)
+            duration_s = len(stream) * 10 / rs485.RS485_BAUDRATE + 0.1
+
+            async def other_tasks():
+                # other tasks hold the event loop for 30 ms at a time
+                while True:
+                    sim.clock.advance(0.03)
+                    await asyncio.sleep(0.01)
+
+            async def run():
+                load = asyncio.create_task(other_tasks())
+                try:
+                    await asyncio.wait_for(
+                        link.run(lambda payload: received.append(bytes(payload))), duration_s
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                load.cancel()
+
+            sim.run(run())
+            uart = link.uart
+            link.close()
+        self.assertEqual(received, payloads + [b"last"])
+        self.assertEqual(link.stats.frames_received, len(payloads) + 1)
+        self.assertEqual(link.stats.framing_errors + link.stats.crc_errors, 2)
+        self.assertEqual(link.stats.receive_buffer_full, 0)
+        self.assertEqual(uart.overflowed_bytes, 0)
+
+    def test_oversize_frame_discarded(self):
+        custom_module_mocking.simulate_pin_manager_hardware()
+        received = []
+        with custom_module_mocking.HardwareSimulation() as sim:
+            peer = custom_module_mocking.SimulatedUartPeer()
+            sim.attach_uart_peer("TX", peer)
+            link = rs485.Rs485Link("TX", "RX", "DE", max_payload=16)
+            peer.send(b"\x01" * 40 + b"\x00")
+            peer.send(link.encode(b"ok"))
+            sim.clock.advance(0.01)
+            link.poll(lambda payload: received.append(bytes(payload)))
+            link.close()
+        self.assertEqual(received, [b"ok"])
+        self.assertEqual(link.stats.oversize_frames, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()